@@ -0,0 +1,162 @@
+import threading
+import time
+
+import pandas as pd
+
+import db_queries
+from cache import data_versions
+
+# Rollup bucket of each dashboard time frame, see models.ROLLUP_BUCKETS
+TIME_FRAMES = {
+    'daily': 'day',
+    'monthly': 'month',
+    'yearly': 'year',
+}
+
+
+# Computes every dashboard series from the appointment rollups and one in-memory snapshot of the
+# appointments' diagnostic counts.
+#
+# The rollups (models.ROLLUP_BUCKETS) are loaded whole into a frame with categorical bucket and
+# period columns; they hold one row per day, month, year and doctor, so reloading them is cheap.
+# The snapshot is a columnar frame indexed by appointment id with int32 patient_id and
+# diagnostic_count. It is loaded once and then refreshed from appointment_change_log, reloading only
+# appointments changed since the last load. A refresh happens when a write in this process bumped one
+# of the analytics tables, or every refresh_seconds to pick up writes from other processes. Series are
+# memoized until the next refresh, so a dashboard view costs at most the two queries of a refresh.
+class AnalyticsEngine:
+
+    def __init__(self, refresh_seconds=30):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.RLock()
+        self._frame = None
+        self._rollups = None
+        self._seq = 0
+        self._versions = None
+        self._checked_at = 0
+        self._doctors = None
+        self._departments = None
+        self._patients = None
+        self._dimension_versions = None
+        self._series = {}
+
+    def refresh(self):
+        with self._lock:
+            versions = data_versions.get(*db_queries.ANALYTICS_TABLES)
+            expired = time.monotonic() - self._checked_at >= self.refresh_seconds
+            if self._frame is not None and versions == self._versions and not expired:
+                return
+            if self._frame is None or not self._apply_changes():
+                self._load_snapshot()
+            self._load_rollups()
+            dimension_versions = data_versions.get('doctor', 'department', 'patient')
+            if self._doctors is None or dimension_versions != self._dimension_versions or expired:
+                self._load_dimensions()
+                self._dimension_versions = dimension_versions
+            self._versions = versions
+            self._checked_at = time.monotonic()
+
+    def _load_snapshot(self):
+        self._seq, columns, rows = db_queries.get_analytics_snapshot()
+        self._frame = _to_frame(columns, rows)
+        self._series.clear()
+
+    # Returns False when the change log no longer reaches back to the last load.
+    def _apply_changes(self):
+        columns, rows = db_queries.get_analytics_changes(self._seq)
+        if not rows:
+            return True
+        changes = pd.DataFrame.from_records(rows, columns=columns)
+        if changes['first_seq'].iloc[0] > self._seq + 1:
+            return False
+        self._seq = int(changes['seq'].max())
+        current = changes[changes['patient_id'].notna()].drop(columns=['seq', 'first_seq'])
+        frame = self._frame.drop(index=changes['id'], errors='ignore')
+        if len(current):
+            frame = pd.concat([frame, _to_frame(list(current.columns), current.itertuples(index=False))])
+        self._frame = frame
+        self._series.clear()
+        return True
+
+    def _load_rollups(self):
+        columns, rows = db_queries.get_analytics_rollups()
+        self._rollups = pd.DataFrame.from_records(rows, columns=columns).astype({
+            'bucket': 'category',
+            'period': 'category',
+            'doctor_id': 'int64',
+            'patient_count': 'int64',
+            'appointment_count': 'int64',
+        })
+        self._series.clear()
+
+    def _load_dimensions(self):
+        doctors, departments, patients = db_queries.get_analytics_dimensions()
+        self._doctors = pd.DataFrame.from_records(doctors, columns=['doctor_id', 'doctor_name', 'department_id'])
+        self._departments = pd.DataFrame.from_records(departments, columns=['department_id', 'department_name'])
+        self._patients = pd.DataFrame.from_records(patients, columns=['patient_id', 'patient_name'])
+        self._series.clear()
+
+    def _memoized(self, key, compute):
+        with self._lock:
+            self.refresh()
+            if key not in self._series:
+                self._series[key] = compute()
+            return self._series[key].copy()
+
+    # Per-doctor rollup rows indexed by doctor id.
+    def _doctor_rollups(self):
+        return self._rollups[self._rollups['bucket'] == 'doctor'].set_index('doctor_id')
+
+    # Distinct patients per doctor, including doctors without appointments.
+    def patients_per_doctor(self):
+        def compute():
+            counts = self._doctor_rollups()['patient_count']
+            df = self._doctors[['doctor_id', 'doctor_name']].copy()
+            df['patient_count'] = df['doctor_id'].map(counts).fillna(0).astype('int64')
+            return df
+
+        return self._memoized('patients_per_doctor', compute)
+
+    # Appointments per department name, including departments without any.
+    def patients_per_department(self):
+        def compute():
+            per_doctor = self._doctor_rollups()['appointment_count']
+            doctors = self._doctors.assign(appointments=self._doctors['doctor_id'].map(per_doctor).fillna(0))
+            per_department = doctors.groupby('department_id')['appointments'].sum()
+            departments = self._departments.assign(
+                patient_count=self._departments['department_id'].map(per_department).fillna(0).astype('int64'))
+            counts = departments.groupby('department_name', sort=True)['patient_count'].sum()
+            return pd.DataFrame({'department_name': counts.index, 'patient_count': counts.to_numpy()})
+
+        return self._memoized('patients_per_department', compute)
+
+    # Distinct patients per day, month or year, see TIME_FRAMES.
+    def patients_over_time(self, time_frame):
+        def compute():
+            rows = self._rollups[self._rollups['bucket'] == TIME_FRAMES[time_frame]]
+            rows = rows.sort_values('period')
+            return pd.DataFrame({'date': rows['period'].astype(str).to_numpy(),
+                                 'patient_count': rows['patient_count'].to_numpy()})
+
+        return self._memoized(('patients_over_time', time_frame), compute)
+
+    # Diagnostics per patient name, highest first, including patients without appointments.
+    # Patients sharing a name are counted together and ties are ordered by name.
+    def top_diagnostics_per_patient(self, count):
+        def compute():
+            totals = self._frame.groupby('patient_id')['diagnostic_count'].sum()
+            patients = self._patients.assign(
+                diagnostics_count=self._patients['patient_id'].map(totals).fillna(0).astype('int64'))
+            per_name = patients.groupby('patient_name', dropna=False, sort=True)['diagnostics_count'].sum()
+            top = per_name.sort_values(ascending=False, kind='stable').head(count)
+            return pd.DataFrame({'patient_name': top.index, 'diagnostics_count': top.to_numpy()})
+
+        return self._memoized(('top_diagnostics_per_patient', count), compute)
+
+
+def _to_frame(columns, rows):
+    frame = pd.DataFrame.from_records(rows, columns=columns, index='id')
+    return frame.astype({
+        'patient_id': 'int32',
+        'diagnostic_count': 'int32',
+    })
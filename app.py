@@ -2,51 +2,125 @@ import logging
 import os
 from datetime import datetime
 from functools import wraps
-from logging.handlers import RotatingFileHandler
 
+import click
 import pandas as pd
 import plotly.express as px
 import yaml
 from dash import Dash, dcc, html, Input, Output
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
-from flask_bcrypt import Bcrypt
+from flask import (Flask, Response, render_template, request, jsonify, redirect, url_for, session, flash,
+                   stream_with_context)
+from flask.json.provider import DefaultJSONProvider
 
+import bulk_import
+import compression
 import db_queries
-from models import init_app
+import export
+import metrics
+import structured_logging
+from analytics import AnalyticsEngine, TIME_FRAMES
+from cache import ResultCache, cached
+from conditional_get import ConditionalGet
+from password_hashing import HasherBusy, PasswordHasher
+from models import db, init_app
+from query_profiler import QueryProfiler, add_response_headers, slow_query_logger
+
+
+# Load configuration
+def load_config():
+    with open('configurations/config.yml', 'r') as config_file:
+        return yaml.safe_load(config_file)
+
+
+config = load_config()
+database_config = dict(config.get('database', {}))
+database_uri = database_config.pop('uri', 'sqlite:///hospital.db')
 
 # Initialize Flask app
+# Writes the typed records of db_queries as JSON objects
+class JSONProvider(DefaultJSONProvider):
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, db_queries.Record):
+            return o.to_json()
+        return DefaultJSONProvider.default(o)
+
+
 app = Flask(__name__)
+app.json = JSONProvider(app)
 app.config['SECRET_KEY'] = os.urandom(24)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///hospital.db'
+# HOSPITAL_DATABASE_URI overrides the configured database, e.g. to run the benchmark suite on a copy
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('HOSPITAL_DATABASE_URI', database_uri)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['LOGS_FOLDER'] = 'logs'
 
 if not os.path.exists(app.config['LOGS_FOLDER']):
     os.makedirs(app.config['LOGS_FOLDER'])
 
-bcrypt = Bcrypt(app)
-init_app(app)
-
-log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-log_handler = RotatingFileHandler('logs/hospital_app.log', maxBytes=1024 * 1024, backupCount=10)
-log_handler.setFormatter(log_formatter)
-app.logger.addHandler(log_handler)
+# bcrypt runs on a bounded pool of worker threads, see password_hashing.py
+password_hasher = PasswordHasher(**config.get('password_hashing', {}))
+init_app(app, database_config)
+db_queries.configure_write_retry(**config.get('write_retry', {}))
+
+# Records are written as JSON lines by a writer thread, requests only queue them, see structured_logging.py
+logging_config = dict(config.get('logging', {}))
+log_handlers = [structured_logging.json_file_handler(
+    os.path.join(app.config['LOGS_FOLDER'], logging_config.get('file', 'hospital_app.log')),
+    logging_config.get('max_bytes', 1024 * 1024), logging_config.get('backup_count', 10))]
+if logging_config.get('console', True):
+    log_handlers.append(structured_logging.console_handler())
+log_listener = structured_logging.queue_logging(
+    app.logger, log_handlers,
+    filters=[structured_logging.RequestContextFilter(), structured_logging.SamplingFilter(logging_config.get('sampling'))],
+    queue_size=logging_config.get('queue_size', structured_logging.QUEUE_SIZE))
 app.logger.setLevel(logging.INFO)
+
+# Statements slower than query_profiler.slow_query_ms, with their query plans
+structured_logging.queue_logging(
+    slow_query_logger, [structured_logging.json_file_handler(os.path.join(app.config['LOGS_FOLDER'], 'slow_queries.log'))])
+slow_query_logger.setLevel(logging.WARNING)
 # Initialize Dash app
 dash_app = Dash(__name__, server=app, url_base_pathname='/dash/')
 
 
-# Load configuration
-def load_config():
-    with open('configurations/config.yml', 'r') as config_file:
-        return yaml.safe_load(config_file)
-
-
-config = load_config()
 doctor_categories = config['doctor_categories']
 admin_username = config['admin_username']
 admin_password = config['admin_password']
 
+if config.get('appointment_interval_index'):
+    db_queries.enable_appointment_index()
+
+# Dash figures are cached like the analytics queries they are built from. A cached figure is shared
+# by every later hit and must not be modified: the callbacks only hand it to Dash, which serializes it.
+figure_cache = ResultCache()
+for result_cache in (db_queries.analytics_cache, figure_cache):
+    result_cache.configure(**config.get('analytics_cache', {}))
+db_queries.entity_cache.configure(**config.get('entity_cache', {}))
+# Caches whose hit rates are exposed by /metrics and /metrics/summary
+result_caches = {'entity': db_queries.entity_cache, 'analytics': db_queries.analytics_cache, 'figure': figure_cache}
+
+# Pages, lists and entity JSON are answered with 304 while the tables they read are unchanged
+conditional_get = ConditionalGet(**config.get('conditional_get', {}))
+
+# Latency, status and size of every request and Dash callback, exposed at /metrics
+request_metrics = metrics.Metrics()
+metrics.instrument(app, request_metrics)
+scrape_networks = metrics.parse_networks(config.get('metrics', {}).get('scrape_networks', metrics.SCRAPE_NETWORKS))
+# Registered after the metrics, so it runs before them and the response sizes are the compressed ones
+compression.Compression(**config.get('compression', {})).install(app)
+
+# Every SQL statement is timed per db_queries function and route, see query_profiler.py
+query_profiler_config = dict(config.get('query_profiler', {}))
+query_profiler = QueryProfiler(**{name: value for name, value in query_profiler_config.items() if name != 'enabled'})
+if query_profiler_config.get('enabled', True):
+    with app.app_context():
+        query_profiler.install(db.engine)
+    add_response_headers(app, query_profiler)
+
+# The Dash callbacks compute their series from the rollups and one shared in-memory snapshot of the appointments
+analytics_engine = AnalyticsEngine(**config.get('analytics_engine', {}))
+
 
 def login_required(f):
     @wraps(f)
@@ -58,6 +132,18 @@ def login_required(f):
     return decorated_function
 
 
+# Reads the search, sort and paging query parameters shared by the /list_* endpoints.
+def page_args(default_sort, default_descending=False):
+    order = request.args.get('order')
+    return {
+        'search': request.args.get('q', '').strip() or None,
+        'sort': request.args.get('sort', default_sort),
+        'descending': order == 'desc' if order else default_descending,
+        'cursor': request.args.get('cursor') or None,
+        'limit': request.args.get('limit', db_queries.PAGE_SIZE, type=int)
+    }
+
+
 @app.route('/')
 def index():
     if 'user_id' in session:
@@ -71,14 +157,30 @@ def login():
         username = request.form['username']
         password = request.form['password']
         user = db_queries.get_user_by_username(username)
-        if user and bcrypt.check_password_hash(user.password, password):
+        try:
+            valid = user is not None and password_hasher.verify(password, user.password)
+        except HasherBusy:
+            app.logger.warning("Login of '%s' rejected, the password hasher is busy", username,
+                               extra={'event': 'login_busy'})
+            flash('Too many logins at the moment, please try again', 'danger')
+            return render_template('login.html'), 503
+        if valid:
+            # Hashes of an earlier bcrypt cost are replaced while the password is at hand
+            if password_hasher.needs_rehash(user.password):
+                try:
+                    db_queries.set_user_password(user.id, password_hasher.hash(password))
+                    app.logger.info("Rehashed the password of '%s' with cost %s", username, password_hasher.rounds,
+                                    extra={'event': 'password_rehash'})
+                except (HasherBusy, db_queries.DatabaseError) as e:
+                    app.logger.warning("Rehashing the password of '%s' failed: %s", username, e,
+                                       extra={'event': 'password_rehash_failed'})
             session['user_id'] = user.id
             session['username'] = user.username
             session['is_admin'] = user.is_admin
-            app.logger.info(f"User '{username}' logged in")
+            app.logger.info("User '%s' logged in", username, extra={'event': 'login'})
             return redirect(url_for('dashboard'))
         else:
-            app.logger.warning(f"Failed login attempt for username '{username}'")
+            app.logger.warning("Failed login attempt for username '%s'", username, extra={'event': 'login_failed'})
             flash('Invalid username or password', 'danger')
     return render_template('login.html')
 
@@ -89,15 +191,22 @@ def signup():
         username = request.form['username']
         password = request.form['password']
         if db_queries.get_user_by_username(username):
-            app.logger.warning(f"Failed to create User with username {username}, it already exists")
+            app.logger.warning("Failed to create User with username %s, it already exists", username,
+                               extra={'event': 'signup_failed'})
             flash('Username already exists', 'danger')
         else:
-            if username == admin_username:
-                db_queries.add_user(username, password, bcrypt, True)
-                app.logger.info(f"New User created as an Admin privileged user with username {username}")
-            else:
-                db_queries.add_user(username, password, bcrypt)
-                app.logger.info(f"New User created as a regular user with username {username}")
+            try:
+                if username == admin_username:
+                    db_queries.add_user(username, password, password_hasher, True)
+                    app.logger.info("New User created as an Admin privileged user with username %s", username,
+                                    extra={'event': 'signup'})
+                else:
+                    db_queries.add_user(username, password, password_hasher)
+                    app.logger.info("New User created as a regular user with username %s", username,
+                                    extra={'event': 'signup'})
+            except HasherBusy:
+                flash('Too many signups at the moment, please try again', 'danger')
+                return render_template('signup.html'), 503
             flash('Account created successfully', 'success')
             return redirect(url_for('login'))
     return render_template('signup.html')
@@ -106,7 +215,7 @@ def signup():
 @app.route('/logout')
 def logout():
     username = session.get('username', 'Unknown user')
-    app.logger.info(f"User '{username}' logged out")
+    app.logger.info("User '%s' logged out", username, extra={'event': 'logout'})
     session.pop('user_id', None)
     session.pop('username', None)
     session.pop('is_admin', None)
@@ -133,8 +242,8 @@ def admin():
 @login_required
 def admin_create_user(data=None, bypass_admin_check=False):
     if not bypass_admin_check and not session.get('is_admin'):
-        app.logger.warning(f"Insufficient privileges for user '{session['username']}' who is trying"
-                           f" to create admin user with username {data['username']}")
+        app.logger.warning("Insufficient privileges for user '%s' who is trying to create admin user with username %s",
+                           session['username'], data['username'], extra={'event': 'access_denied'})
         return jsonify({'success': False, 'error': 'Access denied'}), 403
 
     if data is None:
@@ -142,43 +251,110 @@ def admin_create_user(data=None, bypass_admin_check=False):
 
     try:
         is_admin = data.get('is_admin') in [True, 'true', 'on', 1]
-        user_id = db_queries.add_user(data['username'], data['password'], bcrypt, is_admin)
+        user_id = db_queries.add_user(data['username'], data['password'], password_hasher, is_admin)
         if is_admin:
-            app.logger.info(
-                f"User '{session['username']}' user added an Admin privileged user with username {data['username']}")
+            app.logger.info("User '%s' user added an Admin privileged user with username %s",
+                            session['username'], data['username'], extra={'event': 'user_create'})
         else:
-            app.logger.info(f"User '{session['username']}' user added a regular user with username {data['username']}")
+            app.logger.info("User '%s' user added a regular user with username %s",
+                            session['username'], data['username'], extra={'event': 'user_create'})
         return jsonify({'success': True, 'id': user_id}), 201
+    except HasherBusy as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
     except db_queries.DatabaseError as e:
-        app.logger.warning(
-            f"Unsuccessful attempt by '{session['username']}' to create admin user with username {data['username']}")
+        app.logger.warning("Unsuccessful attempt by '%s' to create admin user with username %s",
+                           session['username'], data['username'], extra={'event': 'user_create_failed'})
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# Most users one /admin/users/bulk request may create
+MAX_BULK_USERS = 1000
+
+
+# Creates many users at once from {"users": [{"username", "password", "is_admin"}, ...]}.
+# Passwords are hashed on all password hasher workers in parallel and the users are added in one
+# transaction. Usernames that are taken or repeated in the request are reported and skipped.
+@app.route('/admin/users/bulk', methods=['POST'])
+@login_required
+def admin_bulk_create_users():
+    if not session.get('is_admin'):
+        app.logger.warning("Insufficient privileges for user '%s' who is trying to create users in bulk",
+                           session['username'], extra={'event': 'access_denied'})
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    users = (request.get_json(silent=True) or {}).get('users')
+    if not isinstance(users, list) or not users:
+        return jsonify({'success': False, 'error': 'Expected a non-empty list of users'}), 400
+    if len(users) > MAX_BULK_USERS:
+        return jsonify({'success': False, 'error': f'At most {MAX_BULK_USERS} users per request'}), 400
+    if not all(isinstance(user, dict) and user.get('username') and user.get('password') for user in users):
+        return jsonify({'success': False, 'error': 'Every user needs a username and a password'}), 400
+
+    taken = db_queries.get_existing_usernames({user['username'] for user in users})
+    accepted, rejected, seen = [], [], set()
+    for user in users:
+        if user['username'] in taken or user['username'] in seen:
+            rejected.append({'username': user['username'], 'error': 'Username already exists'})
+        else:
+            seen.add(user['username'])
+            accepted.append(user)
+    try:
+        hashes = password_hasher.hash_many([user['password'] for user in accepted])
+        ids = db_queries.add_users([
+            {'username': user['username'], 'password': hashed, 'is_admin': user.get('is_admin') in [True, 'true', 'on', 1]}
+            for user, hashed in zip(accepted, hashes)
+        ])
+    except HasherBusy as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+    except db_queries.DatabaseError as e:
+        app.logger.warning("Bulk creation of %s users by '%s' failed: %s", len(accepted), session['username'], e,
+                           extra={'event': 'user_bulk_create_failed'})
+        return jsonify({'success': False, 'error': str(e)}), 409 if "already taken" in str(e) else 500
+    app.logger.info("User '%s' created %s users in bulk, %s rejected", session['username'], len(ids), len(rejected),
+                    extra={'event': 'user_bulk_create'})
+    return jsonify({
+        'success': True,
+        'created': [{'username': user['username'], 'id': id} for user, id in zip(accepted, ids)],
+        'rejected': rejected,
+    }), 201
+
+
 @app.route('/admin/delete_user/<int:id>', methods=['POST'])
 @login_required
 def admin_delete_user(id):
     if not session.get('is_admin'):
-        app.logger.warning(f"Insufficient privileges for user '{session['username']}' who is trying"
-                           f" to delete user with id {id}")
+        app.logger.warning("Insufficient privileges for user '%s' who is trying to delete user with id %s",
+                           session['username'], id, extra={'event': 'access_denied'})
         return jsonify({'success': False, 'error': 'Access denied'}), 403
     try:
         user_to_delete = db_queries.get_user_by_id(id)
         db_queries.delete_user(id)
-        app.logger.warning(f"User '{session['username']}' user deleted with username {user_to_delete.username}")
+        app.logger.warning("User '%s' user deleted with username %s", session['username'], user_to_delete.username,
+                           extra={'event': 'user_delete'})
         return jsonify({'success': True}), 200
     except db_queries.DatabaseError as e:
-        app.logger.warning(f"User '{session['username']}' user not found with id {id}")
+        app.logger.warning("User '%s' user not found with id %s", session['username'], id,
+                           extra={'event': 'user_delete_failed'})
         return jsonify({'success': False, 'error': str(e)}), 404 if "No user found" in str(e) else 500
 
 
 @app.route('/doctors')
 @login_required
+@conditional_get(('department',))
 def doctors():
-    saved_doctors = db_queries.get_all_doctors_with_address_and_dept()
     saved_departments = db_queries.get_all_departments()
-    return render_template('doctors.html', doctors=saved_doctors, departments=saved_departments,
-                           doctor_categories=doctor_categories)
+    return render_template('doctors.html', departments=saved_departments, doctor_categories=doctor_categories)
+
+
+@app.route('/list_doctors')
+@login_required
+@conditional_get(('doctor', 'address', 'department'))
+def list_doctors():
+    try:
+        page = db_queries.list_doctors(department_id=request.args.get('department_id', type=int),
+                                       **page_args('name'))
+        return jsonify(page), 200
+    except db_queries.DatabaseError as e:
+        return jsonify({'error': str(e)}), 400
 
 
 @app.route('/add_doctor', methods=['POST'])
@@ -186,7 +362,8 @@ def add_doctor():
     data = request.json
     try:
         doctor_id = db_queries.add_doctor(data)
-        app.logger.info(f"User '{session['username']}' added doctor with details: {data}")
+        app.logger.info("User '%s' added doctor with details: %s", session['username'], data,
+                        extra={'event': 'doctor_add'})
         return jsonify({'success': True, 'id': doctor_id}), 201
     except db_queries.DatabaseError as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -196,10 +373,9 @@ def add_doctor():
 def edit_doctor_route(id):
     data = request.json
     try:
-        previous_doctor = db_queries.get_doctor(id)
-        app.logger.info('Previous values of doctor: ' + str(previous_doctor))
         db_queries.edit_doctor(id, data)
-        app.logger.warning(f"User '{session['username']}' edited doctor with updated values: {data}")
+        app.logger.warning("User '%s' edited doctor %s with updated values: %s", session['username'], id, data,
+                           extra={'event': 'doctor_edit'})
         return jsonify({'success': True}), 200
     except db_queries.DatabaseError as e:
         return jsonify({'success': False, 'error': str(e)}), 404 if "No doctor found" in str(e) else 500
@@ -208,20 +384,17 @@ def edit_doctor_route(id):
 @app.route('/delete_doctor/<int:id>', methods=['POST'])
 def delete_doctor_route(id):
     try:
-        previous_doctor = db_queries.get_doctor(id)
-        app.logger.info('Delete in progress for doctor: ' + str(previous_doctor))
-
-        # Delete all appointments for this doctor, cascading delete
-        db_queries.delete_appointments_for_doctor(id)
-
-        db_queries.delete_doctor(id)
-        app.logger.warning(f"User '{session['username']}' deleted doctor with ID {id} and all related appointments")
+        # Also deletes the doctor's appointments with their prescriptions and diagnostics
+        appointments = db_queries.delete_doctor(id)
+        app.logger.warning("User '%s' deleted doctor with ID %s and %s related appointments", session['username'], id,
+                           appointments, extra={'event': 'doctor_delete'})
         return jsonify({'success': True}), 200
     except db_queries.DatabaseError as e:
         return jsonify({'success': False, 'error': str(e)}), 404 if "No doctor found" in str(e) else 500
 
 
 @app.route('/get_doctor/<int:id>')
+@conditional_get(('doctor', 'address'))
 def get_doctor_route(id):
     try:
         doctor = db_queries.get_doctor(id)
@@ -232,10 +405,20 @@ def get_doctor_route(id):
 
 @app.route('/nurses')
 @login_required
+@conditional_get(('doctor',))
 def nurses():
-    saved_nurses = db_queries.get_all_nurses()
-    saved_doctors = db_queries.get_all_doctors()
-    return render_template('nurses.html', nurses=saved_nurses, doctors=saved_doctors)
+    saved_doctors = db_queries.get_doctor_options()
+    return render_template('nurses.html', doctors=saved_doctors)
+
+
+@app.route('/list_nurses')
+@login_required
+@conditional_get(('nurse', 'doctor', 'address'))
+def list_nurses():
+    try:
+        return jsonify(db_queries.list_nurses(**page_args('name'))), 200
+    except db_queries.DatabaseError as e:
+        return jsonify({'error': str(e)}), 400
 
 
 @app.route('/get_nurses')
@@ -249,7 +432,8 @@ def add_nurse():
     data = request.json
     try:
         nurse_id = db_queries.add_nurse(data)
-        app.logger.info(f"User '{session['username']}' added nurse with details: {data}")
+        app.logger.info("User '%s' added nurse with details: %s", session['username'], data,
+                        extra={'event': 'nurse_add'})
         return jsonify({'success': True, 'id': nurse_id}), 201
     except db_queries.DatabaseError as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -259,10 +443,9 @@ def add_nurse():
 def edit_nurse(id):
     data = request.json
     try:
-        previous_nurse = db_queries.get_nurse(id)
-        app.logger.info('Previous values of nurse: ' + str(previous_nurse))
         db_queries.edit_nurse(id, data)
-        app.logger.warning(f"User '{session['username']}' edited nurse with updated values: {data}")
+        app.logger.warning("User '%s' edited nurse %s with updated values: %s", session['username'], id, data,
+                           extra={'event': 'nurse_edit'})
         return jsonify({'success': True}), 200
     except db_queries.DatabaseError as e:
         return jsonify({'success': False, 'error': str(e)}), 404 if "No nurse found" in str(e) else 500
@@ -271,24 +454,30 @@ def edit_nurse(id):
 @app.route('/delete_nurse/<int:id>', methods=['POST'])
 def delete_nurse(id):
     try:
-        previous_nurse = db_queries.get_nurse(id)
-        app.logger.info('Delete in progress for nurse: ' + str(previous_nurse))
+        # delete_nurse does not report a missing nurse
+        db_queries.get_nurse(id)
 
         db_queries.delete_nurse(id)
-        app.logger.warning(f"User '{session['username']}' deleted nurse with ID {id} ")
+        app.logger.warning("User '%s' deleted nurse with ID %s", session['username'], id, extra={'event': 'nurse_delete'})
         return jsonify({'success': True}), 200
     except db_queries.DatabaseError as e:
         return jsonify({'success': False, 'error': str(e)}), 404 if "No nurse found" in str(e) else 500
 
 
+# Select box options of the edit dialogs: just the entity a record references, if it still exists.
+def referenced(id, name):
+    return [{'id': id, 'name': name}] if name is not None else []
+
+
 @app.route('/get_nurse/<int:id>')
+@conditional_get(('nurse', 'doctor', 'address'))
 def get_nurse(id):
     try:
         nurse = db_queries.get_nurse(id)
-        saved_doctors = db_queries.get_all_doctors()
+        # Only the nurse's own doctor, the dialog looks up others through /typeahead/doctors
         return jsonify({
             'nurse': nurse,
-            'doctors': [{'id': d['id'], 'name': d['name']} for d in saved_doctors]
+            'doctors': referenced(nurse['doctor_id'], nurse['doctor_name'])
         })
     except db_queries.DatabaseError as e:
         return jsonify({'error': str(e)}), 404 if "No nurse found" in str(e) else 500
@@ -296,19 +485,19 @@ def get_nurse(id):
 
 @app.route('/patients')
 @login_required
+@conditional_get(())
 def patients():
-    saved_patients = db_queries.get_all_patients()
-    for patient in saved_patients:
-        patient['dob'] = datetime.fromisoformat(patient['dob'])
-    return render_template('patients.html', patients=saved_patients)
+    return render_template('patients.html')
 
 
-@app.route('/get_patients')
-def get_patients():
-    saved_patients = db_queries.get_all_patients()
-    for patient in saved_patients:
-        patient['dob'] = datetime.fromisoformat(patient['dob'])
-    return jsonify([{'id': p.id, 'name': p.name} for p in saved_patients])
+@app.route('/list_patients')
+@login_required
+@conditional_get(('patient', 'address'))
+def list_patients():
+    try:
+        return jsonify(db_queries.list_patients(**page_args('name'))), 200
+    except db_queries.DatabaseError as e:
+        return jsonify({'error': str(e)}), 400
 
 
 @app.route('/add_patient', methods=['POST'])
@@ -316,7 +505,8 @@ def add_patient():
     data = request.json
     try:
         patient_id = db_queries.add_patient(data)
-        app.logger.info(f"User '{session['username']}' added patient with details: {data}")
+        app.logger.info("User '%s' added patient with details: %s", session['username'], data,
+                        extra={'event': 'patient_add'})
         return jsonify({'success': True, 'id': patient_id}), 201
     except db_queries.DatabaseError as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -326,10 +516,9 @@ def add_patient():
 def edit_patient(id):
     data = request.json
     try:
-        previous_patient = db_queries.get_patient(id)
-        app.logger.info('Previous values of patient: ' + str(previous_patient))
         db_queries.edit_patient(id, data)
-        app.logger.warning(f"User '{session['username']}' edited patient with updated values: {data}")
+        app.logger.warning("User '%s' edited patient %s with updated values: %s", session['username'], id, data,
+                           extra={'event': 'patient_edit'})
         return jsonify({'success': True}), 200
     except db_queries.DatabaseError as e:
         return jsonify({'success': False, 'error': str(e)}), 404 if "No patient found" in str(e) else 500
@@ -338,20 +527,17 @@ def edit_patient(id):
 @app.route('/delete_patient/<int:id>', methods=['POST'])
 def delete_patient(id):
     try:
-        previous_patient = db_queries.get_patient(id)
-        app.logger.info('Delete in progress for patient: ' + str(previous_patient))
-
-        # Delete all appointments for this patient, cascading delete
-        db_queries.delete_appointments_for_patient(id)
-
-        db_queries.delete_patient(id)
-        app.logger.warning(f"User '{session['username']}' deleted patient with ID {id} and all related appointments")
+        # Also deletes the patient's appointments with their prescriptions and diagnostics
+        appointments = db_queries.delete_patient(id)
+        app.logger.warning("User '%s' deleted patient with ID %s and %s related appointments", session['username'], id,
+                           appointments, extra={'event': 'patient_delete'})
         return jsonify({'success': True}), 200
     except db_queries.DatabaseError as e:
         return jsonify({'success': False, 'error': str(e)}), 404 if "No patient found" in str(e) else 500
 
 
 @app.route('/get_patient/<int:id>')
+@conditional_get(('patient', 'address'))
 def get_patient(id):
     try:
         doctor = db_queries.get_patient(id)
@@ -360,23 +546,67 @@ def get_patient(id):
         return jsonify({'error': str(e)}), 404 if "No patient found" in str(e) else 500
 
 
+# The rows come from /list_appointments, the patients and doctors of the dialogs from /typeahead/*
 @app.route('/appointments')
 @login_required
+@conditional_get(())
 def appointments():
-    saved_appointments = db_queries.get_all_appointments()
-    for appointment in saved_appointments:
-        appointment['from_time'] = datetime.fromisoformat(appointment['from_time'])
-        appointment['to_time'] = datetime.fromisoformat(appointment['to_time'])
-    saved_doctors = db_queries.get_all_doctors_with_address_and_dept()
-    saved_patients = db_queries.get_all_patients()
-    return render_template('appointments.html', appointments=saved_appointments, doctors=saved_doctors,
-                           patients=saved_patients)
+    return render_template('appointments.html')
+
+
+@app.route('/list_appointments')
+@login_required
+@conditional_get(('appointment', 'doctor', 'patient'))
+def list_appointments():
+    try:
+        page = db_queries.list_appointments(
+            from_date=request.args.get('from_date') or None,
+            to_date=request.args.get('to_date') or None,
+            doctor_id=request.args.get('doctor_id', type=int),
+            patient_id=request.args.get('patient_id', type=int),
+            **page_args('from_time', default_descending=True)
+        )
+        return jsonify(page), 200
+    except db_queries.DatabaseError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+# Reads the date range, slot length, working hours and limit of the free slot endpoints.
+def free_slot_args():
+    return {
+        'from_date': request.args.get('from_date') or None,
+        'to_date': request.args.get('to_date') or None,
+        'slot_minutes': request.args.get('slot_minutes', db_queries.FREE_SLOT_MINUTES, type=int),
+        'day_start': request.args.get('day_start', db_queries.WORKING_HOURS[0]),
+        'day_end': request.args.get('day_end', db_queries.WORKING_HOURS[1]),
+        'limit': request.args.get('limit', db_queries.FREE_SLOT_LIMIT, type=int)
+    }
+
+
+@app.route('/doctors/<int:id>/free_slots')
+@login_required
+def doctor_free_slots(id):
+    try:
+        return jsonify(db_queries.find_free_slots(id, **free_slot_args())), 200
+    except db_queries.DatabaseError as e:
+        return jsonify({'error': str(e)}), 404 if "No doctor found" in str(e) else 400
+
+
+@app.route('/departments/<int:id>/free_slots')
+@login_required
+def department_free_slots(id):
+    try:
+        return jsonify(db_queries.find_department_free_slots(id, **free_slot_args())), 200
+    except db_queries.DatabaseError as e:
+        return jsonify({'error': str(e)}), 404 if "No department found" in str(e) else 400
 
 
 @app.route('/add_appointment', methods=['POST'])
 def add_appointment():
     data = request.json
-    try:
+
+    # The appointment and its empty prescription are committed together
+    def book():
         result = db_queries.add_appointment(
             int(data['doctor_id']),
             int(data['patient_id']),
@@ -384,26 +614,69 @@ def add_appointment():
             datetime.fromisoformat(data['to_time']),
             data['notes']
         )
-
         if result['success']:
             db_queries.add_prescription(result['id'])
-            app.logger.info(f"User '{session['username']}' successfully created appointment with details {data}")
+        return result
+
+    try:
+        result = db_queries.run_in_transaction(book)
+        if result['success']:
+            app.logger.info("User '%s' successfully created appointment with details %s", session['username'], data,
+                            extra={'event': 'appointment_add'})
             return jsonify({'success': True, 'id': result['id']})
         else:
-            app.logger.warning(f"User '{session['username']}' tried creating appointment with details {data} "
-                               f"but failed due to {result['message']}")
+            app.logger.warning("User '%s' tried creating appointment with details %s but failed due to %s",
+                               session['username'], data, result['message'], extra={'event': 'appointment_add_failed'})
             return jsonify({'success': False, 'message': result['message']}), 400
     except db_queries.DatabaseError as e:
-        print(str(e))
+        app.logger.error("Creating appointment with details %s failed: %s", data, e, extra={'event': 'appointment_add_failed'})
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+# Books a series of appointments for one doctor and patient in one transaction. The slots are either
+# listed in `slots` ([{'from_time': ..., 'to_time': ...}]) or given by a `recurrence`
+# ({'from_time', 'to_time', 'frequency': 'daily' | 'weekly', 'interval', and 'count' or 'until'}).
+# Slots that conflict are skipped and reported.
+@app.route('/add_appointment_series', methods=['POST'])
+def add_appointment_series():
+    data = request.json
+    try:
+        if 'recurrence' in data:
+            rule = data['recurrence']
+            slots = db_queries.recurring_slots(
+                datetime.fromisoformat(rule['from_time']),
+                datetime.fromisoformat(rule['to_time']),
+                rule.get('frequency', 'weekly'),
+                int(rule.get('interval', 1)),
+                int(rule['count']) if rule.get('count') is not None else None,
+                datetime.fromisoformat(rule['until']) if rule.get('until') else None
+            )
+        else:
+            slots = [(datetime.fromisoformat(slot['from_time']), datetime.fromisoformat(slot['to_time']))
+                     for slot in data['slots']]
+        doctor_id, patient_id = int(data['doctor_id']), int(data['patient_id'])
+    except (KeyError, TypeError, ValueError, db_queries.DatabaseError) as e:
+        return jsonify({'success': False, 'message': f"Invalid series: {e}"}), 400
+
+    try:
+        result = db_queries.add_appointment_series(doctor_id, patient_id, slots, data.get('notes', ''))
+    except db_queries.DatabaseError as e:
+        if "A series must" in str(e) or "Every slot must" in str(e):
+            return jsonify({'success': False, 'message': str(e)}), 400
+        app.logger.error("Creating appointment series with details %s failed: %s", data, e,
+                         extra={'event': 'appointment_series_add_failed'})
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+    app.logger.info("User '%s' booked %s of %s appointments of a series for doctor %s and patient %s",
+                    session['username'], len(result['booked']), len(slots), doctor_id, patient_id,
+                    extra={'event': 'appointment_series_add'})
+    return jsonify({'success': bool(result['booked']), **result}), 200 if result['booked'] else 400
+
+
 @app.route('/edit_appointment/<int:id>', methods=['POST'])
 def edit_appointment(id):
     data = request.json
     try:
-        previous_appointment = db_queries.get_appointment(id)
-        app.logger.info('Previous values of appointment: ' + str(previous_appointment))
         result = db_queries.edit_appointment(
             id,
             int(data['doctor_id']),
@@ -413,37 +686,36 @@ def edit_appointment(id):
             data['notes']
         )
         if result['success']:
-            app.logger.info(f"User '{session['username']}' successfully updated appointment with details {data}")
+            app.logger.info("User '%s' successfully updated appointment %s with details %s", session['username'], id, data,
+                            extra={'event': 'appointment_edit'})
             return jsonify({'success': True, 'id': result['id']})
         else:
-            app.logger.warning(f"User '{session['username']}' tried updating appointment with details {data} "
-                               f"but failed due to {result['message']}")
+            app.logger.warning("User '%s' tried updating appointment %s with details %s but failed due to %s",
+                               session['username'], id, data, result['message'], extra={'event': 'appointment_edit_failed'})
             return jsonify({'success': False, 'message': result['message']}), 400
     except db_queries.DatabaseError as e:
-        print(str(e))
+        app.logger.error("Updating appointment %s with details %s failed: %s", id, data, e,
+                         extra={'event': 'appointment_edit_failed'})
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
 @app.route('/delete_appointment/<int:id>', methods=['POST'])
 def delete_appointment(id):
     try:
-        previous_appointment = db_queries.get_appointment(id)
-        app.logger.info('Delete in progress for appointment: ' + str(previous_appointment))
-        db_queries.delete_prescription_by_appointment_id(id)  # Delete associated prescription first, if any
-        db_queries.delete_diagnostic_by_appointment_id(id)  # Delete associated diagnostic first, if any
+        # Also deletes the appointment's prescription and diagnostics
         db_queries.delete_appointment(id)
-        app.logger.warning(f"User '{session['username']}' successfully deleted appointment with ID {id}")
+        app.logger.warning("User '%s' successfully deleted appointment with ID %s", session['username'], id,
+                           extra={'event': 'appointment_delete'})
         return jsonify({'success': True}), 200
     except db_queries.DatabaseError as e:
         return jsonify({'success': False, 'error': str(e)}), 404 if "No appointment found" in str(e) else 500
 
 
 @app.route('/get_appointment/<int:id>')
+@conditional_get(('appointment', 'doctor', 'patient'))
 def get_appointment(id):
     try:
         appointment = db_queries.get_appointment(id)
-        saved_doctors = db_queries.get_all_doctors()
-        saved_patients = db_queries.get_all_patients()
         return jsonify({
             'appointment': {
                 'id': appointment['id'],
@@ -453,8 +725,8 @@ def get_appointment(id):
                 'to_time': appointment['to_time'],
                 'notes': appointment['notes']
             },
-            'doctors': [{'id': d['id'], 'name': d['name']} for d in saved_doctors],
-            'patients': [{'id': p['id'], 'name': p['name']} for p in saved_patients]
+            'doctors': referenced(appointment['doctor_id'], appointment['doctor_name']),
+            'patients': referenced(appointment['patient_id'], appointment['patient_name'])
         })
     except db_queries.DatabaseError as e:
         return jsonify({'error': str(e)}), 404 if "No appointment found" in str(e) else 500
@@ -464,26 +736,26 @@ def get_appointment(id):
 def edit_prescription_for_appointment(id):
     data = request.json
     try:
-        previous_prescription = db_queries.get_prescription_by_appointment_id(id)
-        app.logger.info('Previous values of prescription: ' + str(previous_prescription))
         result = db_queries.edit_prescription_by_appointment_id(
             id,
             data['prescription_notes']
         )
         if result['success']:
-            app.logger.info(f"User '{session['username']}' successfully updated prescription with details {data}")
+            app.logger.info("User '%s' successfully updated prescription of appointment %s with details %s",
+                            session['username'], id, data, extra={'event': 'prescription_edit'})
             return jsonify({'success': True})
         else:
-            app.logger.warning(f"User '{session['username']}' tried updating prescription with details {data} "
-                               f"but failed due to {result['message']}")
+            app.logger.warning("User '%s' tried updating prescription of appointment %s with details %s but failed due to %s",
+                               session['username'], id, data, result['message'], extra={'event': 'prescription_edit_failed'})
             return jsonify({'success': False, 'message': result['message']}), 400
     except db_queries.DatabaseError as e:
-        app.logger.warning(f"User '{session['username']}' tried updating prescription with details {data} "
-                           f"but failed due to {str(e)}")
+        app.logger.warning("User '%s' tried updating prescription of appointment %s with details %s but failed due to %s",
+                           session['username'], id, data, e, extra={'event': 'prescription_edit_failed'})
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
 @app.route('/get_prescription/<int:id>')
+@conditional_get(('prescription',))
 def get_prescription(id):
     try:
         prescription = db_queries.get_prescription_by_appointment_id(id)
@@ -508,18 +780,21 @@ def add_diagnostic():
         )
 
         if result['success']:
-            app.logger.info(f"User '{session['username']}' successfully added diagnostic with details {test_name}")
+            app.logger.info("User '%s' successfully added diagnostic with details %s", session['username'], test_name,
+                            extra={'event': 'diagnostic_add'})
             return jsonify({'success': True, 'id': result['id']})
         else:
-            app.logger.warning(f"User '{session['username']}' tried adding diagnostic with details {test_name} "
-                               f"but failed due to {result['message']}")
+            app.logger.warning("User '%s' tried adding diagnostic with details %s but failed due to %s",
+                               session['username'], test_name, result['message'], extra={'event': 'diagnostic_add_failed'})
             return jsonify({'success': False, 'message': result['message']}), 400
     except db_queries.DatabaseError as e:
-        print(str(e))
+        app.logger.error("Adding diagnostic to appointment %s failed: %s", request.form.get('appointment_id'), e,
+                         extra={'event': 'diagnostic_add_failed'})
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
 @app.route('/get_diagnostic/<int:id>')
+@conditional_get(('diagnostic',))
 def get_diagnostic(id):
     try:
         diagnostics = db_queries.get_diagnostic_by_appointment_id(id)
@@ -531,10 +806,9 @@ def get_diagnostic(id):
 @app.route('/delete_diagnostic/<int:id>', methods=['POST'])
 def delete_diagnostic(id):
     try:
-        previous_diagnostic = db_queries.get_diagnostic(id)
-        app.logger.info('Delete in progress for diagnostic: ' + str(previous_diagnostic))
         db_queries.delete_diagnostic(id)
-        app.logger.warning(f"User '{session['username']}' successfully deleted diagnostic with ID {id}")
+        app.logger.warning("User '%s' successfully deleted diagnostic with ID %s", session['username'], id,
+                           extra={'event': 'diagnostic_delete'})
         return jsonify({'success': True}), 200
     except db_queries.DatabaseError as e:
         return jsonify({'success': False, 'error': str(e)}), 404 if "No diagnostic found" in str(e) else 500
@@ -542,6 +816,7 @@ def delete_diagnostic(id):
 
 @app.route('/departments')
 @login_required
+@conditional_get(('department',))
 def departments():
     saved_departments = db_queries.get_all_departments()
     return render_template('departments.html', departments=saved_departments)
@@ -552,7 +827,8 @@ def add_department():
     data = request.json
     try:
         department_id = db_queries.add_department(data)
-        app.logger.info(f"User '{session['username']}' successfully created department with details {data}")
+        app.logger.info("User '%s' successfully created department with details %s", session['username'], data,
+                        extra={'event': 'department_add'})
         return jsonify({'success': True, 'id': department_id}), 201
     except db_queries.DatabaseError as e:
         return jsonify({'success': False, 'message': 'Department already exists', 'error': str(e)}), 500
@@ -562,36 +838,31 @@ def add_department():
 def edit_department(id):
     data = request.json
     try:
-        previous_department = db_queries.get_department(id)
-        app.logger.info('Previous values of department: ' + str(previous_department))
         department_id = db_queries.edit_department(id, data)
-        app.logger.info(f"User '{session['username']}' successfully updated department with details {data}")
+        app.logger.info("User '%s' successfully updated department %s with details %s", session['username'], id, data,
+                        extra={'event': 'department_edit'})
         return jsonify({'success': True, 'id': department_id}), 201
     except db_queries.DatabaseError as e:
+        if "No department found" in str(e):
+            return jsonify({'success': False, 'error': str(e)}), 404
         return jsonify({'success': False, 'message': 'Department already exists', 'error': str(e)}), 500
 
 
 @app.route('/delete_department/<int:id>', methods=['POST'])
 def delete_department(id):
     try:
-        previous_department = db_queries.get_department(id)
-        app.logger.info('Delete in progress for department: ' + str(previous_department))
-        # Find all doctors with department_id, first delete all appointments for these doctors,
-        # then delete all these doctors to accomplish cascading delete
-        doctors_in_dept = db_queries.get_all_doctors_with_dept(id)
-        for doctor in doctors_in_dept:
-            print('Deleting doctor: ' + doctor['name'])
-            db_queries.delete_appointments_for_doctor(doctor['id'])
-            db_queries.delete_doctor(doctor['id'])
-
-        db_queries.delete_department(id)
-        app.logger.info(f"User '{session['username']}' successfully deleted department with ID {id}")
+        # Also deletes the department's doctors and everything deleting a doctor removes
+        deleted = db_queries.delete_department(id)
+        app.logger.info("User '%s' successfully deleted department with ID %s, %s doctors and %s appointments",
+                        session['username'], id, deleted['doctors'], deleted['appointments'],
+                        extra={'event': 'department_delete'})
         return jsonify({'success': True}), 200
     except db_queries.DatabaseError as e:
         return jsonify({'success': False, 'error': str(e)}), 404 if "No department found" in str(e) else 500
 
 
 @app.route('/get_department/<int:id>')
+@conditional_get(('department',))
 def get_department(id):
     try:
         department = db_queries.get_department(id)
@@ -600,6 +871,149 @@ def get_department(id):
         return jsonify({'error': str(e)}), 404 if "No department found" in str(e) else 500
 
 
+@app.route('/search')
+@login_required
+def search():
+    try:
+        results = db_queries.search(request.args.get('q', ''), request.args.get('entity') or None,
+                                    request.args.get('limit', 20, type=int))
+        return jsonify({'results': results}), 200
+    except db_queries.DatabaseError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+# Typeahead for the doctor and patient fields of the appointment and nurse dialogs. ?q= is matched as a
+# prefix of the name, email or phone, ?limit= caps the results and doctors can be narrowed with ?department_id=.
+@app.route('/typeahead/doctors')
+@login_required
+def typeahead_doctors():
+    try:
+        results = db_queries.typeahead_doctors(request.args.get('q', ''), request.args.get('department_id', type=int),
+                                               request.args.get('limit', db_queries.TYPEAHEAD_LIMIT, type=int))
+        return jsonify({'results': results}), 200
+    except db_queries.DatabaseError as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/typeahead/patients')
+@login_required
+def typeahead_patients():
+    try:
+        results = db_queries.typeahead_patients(request.args.get('q', ''),
+                                                request.args.get('limit', db_queries.TYPEAHEAD_LIMIT, type=int))
+        return jsonify({'results': results}), 200
+    except db_queries.DatabaseError as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# Bulk imports patients, doctors, nurses or appointments from CSV or NDJSON, see bulk_import.py.
+# The body is either the file itself or a multipart upload in the `file` field; the format comes
+# from ?format=, the file name or the content type.
+@app.route('/import/<entity>', methods=['POST'])
+@login_required
+def import_entities(entity):
+    if not session.get('is_admin'):
+        app.logger.warning("Insufficient privileges for user '%s' who is trying to import %s", session['username'], entity,
+                           extra={'event': 'access_denied'})
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    upload = request.files.get('file')
+    try:
+        if upload is not None:
+            format = bulk_import.detect_format(request.args.get('format'), upload.filename, upload.content_type)
+            report = bulk_import.import_stream(entity, upload.stream, format)
+        else:
+            format = bulk_import.detect_format(request.args.get('format'), content_type=request.content_type)
+            report = bulk_import.import_stream(entity, request.stream, format)
+    except bulk_import.BulkImportError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    app.logger.info("User '%s' imported %s of %s %s rows", session['username'], report['imported'], report['rows'], entity,
+                    extra={'event': 'import'})
+    return jsonify({'success': True, **report}), 200
+
+
+# Streams all rows of an entity as CSV or NDJSON (?format=), optionally limited to
+# ?from_date=&to_date= (YYYY-MM-DD) and ?department_id=, see db_queries.export_rows.
+@app.route('/export/<entity>')
+@login_required
+def export_entities(entity):
+    try:
+        format = request.args.get('format', 'csv')
+        mimetype, chunks = export.export_entity(
+            entity, format,
+            from_date=request.args.get('from_date') or None,
+            to_date=request.args.get('to_date') or None,
+            department_id=request.args.get('department_id', type=int)
+        )
+    except db_queries.DatabaseError as e:
+        return jsonify({'error': str(e)}), 400
+    app.logger.info("User '%s' exported %s as %s with filters %s", session['username'], entity, format, dict(request.args),
+                    extra={'event': 'export'})
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={entity}s.{format}'
+    })
+
+
+# Request, Dash callback and result cache metrics of this process in the Prometheus text format, for scraping.
+# Open to the scrape_networks of the `metrics` configuration only, the scraper has no session.
+@app.route('/metrics')
+def prometheus_metrics():
+    if not metrics.address_allowed(request.remote_addr, scrape_networks):
+        return Response('Forbidden\n', 403, mimetype='text/plain')
+    return Response(request_metrics.render_prometheus() + metrics.render_cache_metrics(result_caches),
+                    mimetype='text/plain; version=0.0.4')
+
+
+# The same metrics as JSON, with estimated latency percentiles per route and callback and the hit
+# rate of each result cache. Admins only, like the SQL profiler.
+@app.route('/metrics/summary')
+@login_required
+def metrics_summary():
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Access denied'}), 403
+    summary = request_metrics.summary()
+    summary['caches'] = {name: result_cache.stats() for name, result_cache in result_caches.items()}
+    return jsonify(summary), 200
+
+
+# Statement, db_queries function and route totals of the SQL profiler, slowest first
+@app.route('/profiler/queries')
+@login_required
+def profiler_queries():
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Access denied'}), 403
+    return jsonify(query_profiler.summary(request.args.get('limit', 50, type=int))), 200
+
+
+@app.cli.command('import-data')
+@click.argument('entity', type=click.Choice(bulk_import.IMPORT_ENTITIES))
+@click.argument('file', type=click.File('rb'))
+@click.option('--format', type=click.Choice(bulk_import.IMPORT_FORMATS), default=None,
+              help='Defaults to ndjson for .ndjson/.jsonl files and csv otherwise.')
+@click.option('--chunk-size', type=int, default=bulk_import.IMPORT_CHUNK_SIZE, show_default=True)
+def import_data_command(entity, file, format, chunk_size):
+    try:
+        report = bulk_import.import_stream(entity, file, bulk_import.detect_format(format, file.name), chunk_size)
+    except bulk_import.BulkImportError as e:
+        raise click.ClickException(str(e))
+    print(f"Imported {report['imported']} of {report['rows']} {entity} rows in {report['seconds']}s")
+    for error in report['errors']:
+        print(f"line {error['line']}: {error['error']}")
+    if report['rejected'] > len(report['errors']):
+        print(f"... and {report['rejected'] - len(report['errors'])} more rejected rows")
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    db_queries.rebuild_search_index()
+    print('Search index rebuilt')
+
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    db_queries.rebuild_rollups()
+    print('Dashboard rollups rebuilt')
+
+
 dash_app.layout = html.Div([
     dcc.Dropdown(
         id='x-axis-column',
@@ -635,10 +1049,10 @@ dash_app.layout = html.Div([
     Input('x-axis-column', 'value'),
     Input('y-axis-column', 'value')
 )
+@request_metrics.timed_callback
+@cached(figure_cache, db_queries.ANALYTICS_TABLES)
 def update_doctor_patient_histogram(x_column, y_column):
-    data = db_queries.count_patients_per_doctor()
-    df = pd.DataFrame(data)
-    print(df.columns)
+    df = analytics_engine.patients_per_doctor()
     df.rename(columns={'doctor_name': 'Doctor Name', 'patient_count': 'Number of Patients'}, inplace=True)
 
     if x_column not in df.columns:
@@ -655,17 +1069,18 @@ def update_doctor_patient_histogram(x_column, y_column):
     Output('dept_patient_histogram', 'figure'),
     Input('x-axis-column', 'value')
 )
+@request_metrics.timed_callback
+@cached(figure_cache, db_queries.ANALYTICS_TABLES)
 def update_dept_patient_histogram(x_column):
     try:
-        data = db_queries.count_patients_per_department()
-        df = pd.DataFrame(data)
+        df = analytics_engine.patients_per_department()
         df.rename(columns={'department_name': 'Department Name', 'patient_count': 'Number of Patients'}, inplace=True)
 
         fig = px.histogram(df, x='Department Name', y='Number of Patients', title="Number of Patients per Department")
         return fig
 
     except Exception as e:
-        print(f"Error updating histogram: {e}")
+        app.logger.exception("Error updating histogram: %s", e, extra={'event': 'dashboard_error'})
         return {}
 
 
@@ -673,17 +1088,13 @@ def update_dept_patient_histogram(x_column):
     Output('time_graph', 'figure'),
     Input('time-frame', 'value')
 )
+@request_metrics.timed_callback
+@cached(figure_cache, db_queries.ANALYTICS_TABLES)
 def update_time_graph(time_frame):
-    if time_frame == 'daily':
-        data = db_queries.count_patients_daily()
-    elif time_frame == 'monthly':
-        data = db_queries.count_patients_monthly()
-    elif time_frame == 'yearly':
-        data = db_queries.count_patients_yearly()
+    if time_frame in TIME_FRAMES:
+        df = analytics_engine.patients_over_time(time_frame)
     else:
-        data = []
-
-    df = pd.DataFrame(data)
+        df = pd.DataFrame(columns=['date', 'patient_count'])
 
     fig = px.line(df, x='date', y='patient_count', title=f'Number of Patients {time_frame.capitalize()}')
     return fig
@@ -693,17 +1104,18 @@ def update_time_graph(time_frame):
     Output('diagnostics_patient_histogram', 'figure'),
     Input('x-axis-column', 'value')
 )
+@request_metrics.timed_callback
+@cached(figure_cache, db_queries.ANALYTICS_TABLES)
 def update_diagnostics_patient_histogram(x_column):
     try:
-        data = db_queries.count_top_diagnostics_per_patient(10)
-        df = pd.DataFrame(data)
+        df = analytics_engine.top_diagnostics_per_patient(10)
         df.rename(columns={'patient_name': 'Patient Name', 'diagnostics_count': 'Number of Diagnostic Scans'}, inplace=True)
 
         fig = px.histogram(df, x='Patient Name', y='Number of Diagnostic Scans', title="10 Patients with maximum number of Diagnostic Scans")
         return fig
 
     except Exception as e:
-        print(f"Error updating histogram: {e}")
+        app.logger.exception("Error updating histogram: %s", e, extra={'event': 'dashboard_error'})
         return {}
 
 if __name__ == '__main__':
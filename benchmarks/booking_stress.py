@@ -0,0 +1,125 @@
+# Concurrent booking stress test: many threads book overlapping slots of a few doctors at once.
+#
+# Usage: python -m benchmarks.booking_stress [--threads 16] [--doctors 4] [--slots 48] [--seconds 5]
+#
+# Every thread books random 30 minute appointments starting on a 15 minute grid through add_appointment(),
+# so most attempts overlap an existing or concurrent booking. All threads book the same day, which moves
+# on every --round-ms so that bookings keep succeeding once a day is full. Afterwards the appointment
+# table is checked for overlapping pairs of the same doctor. The run is repeated without the booking
+# guard triggers (models.booking_guard_ddl) to show the race they close. Exits with status 1 if the
+# guarded run double booked.
+import argparse
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import db_queries
+from benchmarks.common import create_app, seed_appointments, percentile
+from benchmarks.concurrency import Stats
+from models import db
+
+GRID_MINUTES = 15
+APPOINTMENT_MINUTES = 30
+
+
+def booker(app, start, stop, stats, booked_counts, args, first_slot, seed):
+    rng = random.Random(seed)
+    latencies, errors, booked = [], 0, 0
+    with app.app_context():
+        start.wait()
+        began_run = time.perf_counter()
+        while not stop.is_set():
+            day = int((time.perf_counter() - began_run) * 1000 / args.round_ms)
+            from_time = first_slot + timedelta(days=day, minutes=GRID_MINUTES * rng.randrange(args.slots))
+            began = time.perf_counter()
+            try:
+                result = db_queries.add_appointment(rng.randint(1, args.doctors), 1, from_time,
+                                                    from_time + timedelta(minutes=APPOINTMENT_MINUTES), 'stress')
+                booked += result['success']
+            except db_queries.DatabaseError:
+                errors += 1
+            latencies.append((time.perf_counter() - began) * 1000)
+            db.session.remove()
+    stats.record(latencies, errors)
+    booked_counts.append(booked)
+
+
+# Pairs of appointments of the same doctor that overlap.
+def double_bookings():
+    return db.session.execute(text("""
+        SELECT COUNT(*)
+        FROM appointment a
+        JOIN appointment b ON b.doctor_id = a.doctor_id AND b.id > a.id
+            AND b.from_time < a.to_time AND b.to_time > a.from_time
+    """)).scalar()
+
+
+def run(guarded, args):
+    app, _ = create_app()
+    first_slot = (datetime.now() + timedelta(days=30)).replace(hour=8, minute=0, second=0, microsecond=0)
+    with app.app_context():
+        seed_appointments(0, num_doctors=args.doctors, num_patients=1)
+        if not guarded:
+            for name in ('booking_guard_insert', 'booking_guard_update'):
+                db.session.execute(text(f'DROP TRIGGER {name}'))
+            db.session.commit()
+        if args.interval_index:
+            db_queries.enable_appointment_index()
+
+    start, stop = threading.Barrier(args.threads), threading.Event()
+    stats, booked_counts = Stats(), []
+    threads = [threading.Thread(target=booker, args=(app, start, stop, stats, booked_counts, args, first_slot, i))
+               for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    db_queries.appointment_index = None
+
+    with app.app_context():
+        overlaps = double_bookings()
+    return {
+        'attempts': len(stats.latencies),
+        'booked': sum(booked_counts),
+        'errors': stats.errors,
+        'double_bookings': overlaps,
+        'attempts_per_sec': len(stats.latencies) / args.seconds,
+        'bookings_per_sec': sum(booked_counts) / args.seconds,
+        'p50_ms': percentile(stats.latencies, 50),
+        'p99_ms': percentile(stats.latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--doctors', type=int, default=4)
+    parser.add_argument('--slots', type=int, default=48, help='Start times per doctor, 15 minutes apart')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--round-ms', type=float, default=250, help='How long all threads book the same day')
+    parser.add_argument('--interval-index', action='store_true',
+                        help='Check conflicts with the in-process interval index instead of SQL')
+    parser.add_argument('--guarded-only', action='store_true', help='Skip the run without the booking guard')
+    args = parser.parse_args()
+
+    print(f"{'run':<10} {'attempts/s':>10} {'bookings/s':>10} {'booked':>7} {'errors':>6} {'p50 ms':>7} {'p99 ms':>7} "
+          f"{'double':>6}")
+    guarded_overlaps = 0
+    for guarded in (True,) if args.guarded_only else (True, False):
+        result = run(guarded, args)
+        if guarded:
+            guarded_overlaps = result['double_bookings']
+        print(f"{'guarded' if guarded else 'unguarded':<10} {result['attempts_per_sec']:>10.0f} "
+              f"{result['bookings_per_sec']:>10.0f} {result['booked']:>7} {result['errors']:>6} {result['p50_ms']:>7.2f} "
+              f"{result['p99_ms']:>7.2f} {result['double_bookings']:>6}")
+    sys.exit(1 if guarded_overlaps else 0)
+
+
+if __name__ == '__main__':
+    main()
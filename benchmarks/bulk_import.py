@@ -0,0 +1,84 @@
+# Throughput of the bulk import pipeline against the per-row add_* functions.
+#
+# Usage: python -m benchmarks.bulk_import [--rows 20000] [--per-row 1000]
+#
+# Patients are imported once through add_patient(), one commit per row like /add_patient,
+# and once as a CSV stream through bulk_import.import_stream(). Appointments for the imported
+# patients are then imported as NDJSON, including the conflict checks.
+import argparse
+import csv
+import io
+import json
+import time
+from datetime import datetime, timedelta
+
+import bulk_import
+import db_queries
+from benchmarks.common import create_app, SQLITE_DATETIME
+
+NUM_DOCTORS = 50
+ADDRESS = {'street': '1 Main St', 'county': 'County', 'city': 'City', 'state': 'State',
+           'country': 'Country', 'zipcode': '12345'}
+
+
+def patient_records(count, prefix):
+    return [{'name': f'Patient {i}', 'dob': '1990-01-01', 'phone': '555-0100',
+             'email': f'{prefix}{i}@example.com', **ADDRESS} for i in range(count)]
+
+
+def csv_stream(records):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(records[0]))
+    writer.writeheader()
+    writer.writerows(records)
+    return io.BytesIO(buffer.getvalue().encode('utf-8'))
+
+
+def appointment_stream(count, num_patients, now):
+    lines = []
+    for i in range(count):
+        from_time = now + timedelta(minutes=45 * (i // NUM_DOCTORS))
+        lines.append(json.dumps({
+            'doctor_id': i % NUM_DOCTORS + 1, 'patient_id': i % num_patients + 1,
+            'from_time': from_time.strftime(SQLITE_DATETIME),
+            'to_time': (from_time + timedelta(minutes=30)).strftime(SQLITE_DATETIME), 'notes': 'bench'
+        }))
+    return io.BytesIO('\n'.join(lines).encode('utf-8'))
+
+
+def rate(count, seconds):
+    return f"{count / seconds:>10.0f} rows/s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--per-row', type=int, default=1000, help='Rows added through add_patient()')
+    args = parser.parse_args()
+
+    app, _ = create_app()
+    with app.app_context():
+        db_queries.import_people('doctor', [
+            {'line': i, 'name': f'Doctor {i}', 'phone': '0', 'email': f'doctor{i}@example.com',
+             'department_id': None, 'category': 'Medicine', 'experience': 1, 'degree': 'PhD'}
+            for i in range(NUM_DOCTORS)
+        ])
+
+        start = time.perf_counter()
+        for record in patient_records(args.per_row, 'single'):
+            db_queries.add_patient(dict(record))
+        per_row = args.per_row / (time.perf_counter() - start)
+        print(f"add_patient per row:     {per_row:>10.0f} rows/s")
+
+        report = bulk_import.import_stream('patient', csv_stream(patient_records(args.rows, 'bulk')), 'csv')
+        bulk = report['imported'] / report['seconds']
+        print(f"patient CSV import:      {bulk:>10.0f} rows/s  ({bulk / per_row:.0f}x, {report['rejected']} rejected)")
+
+        now = datetime.now().replace(second=0, microsecond=0)
+        report = bulk_import.import_stream('appointment', appointment_stream(args.rows, args.rows, now), 'ndjson')
+        print(f"appointment NDJSON import: {report['imported'] / report['seconds']:>8.0f} rows/s  "
+              f"({report['rejected']} rejected)")
+
+
+if __name__ == '__main__':
+    main()
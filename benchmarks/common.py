@@ -0,0 +1,83 @@
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import text
+
+from models import db, init_app
+
+SQLITE_DATETIME = '%Y-%m-%d %H:%M:%S'
+
+
+# Creates a Flask app bound to a fresh SQLite database in a temporary directory.
+# engine_profile overrides settings of models.ENGINE_PROFILE.
+#
+# Returns:
+#     tuple: The app and the path of its database file.
+def create_app(engine_profile=None):
+    db_path = os.path.join(tempfile.mkdtemp(prefix='hms-bench-'), 'hospital.db')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    init_app(app, engine_profile)
+    return app, db_path
+
+
+# Inserts doctors, patients and num_appointments non-overlapping 30 minute appointments.
+# Each doctor's history runs backwards from `now`, so every new booking is in the future.
+# Must be called inside an app context.
+def seed_appointments(num_appointments, num_doctors=50, num_patients=1000, seed=42, now=None):
+    rng = random.Random(seed)
+    now = now or datetime.now().replace(second=0, microsecond=0)
+    db.session.execute(text("""
+        INSERT INTO doctor (id, name, phone, email, category, experience, degree)
+        VALUES (:id, :name, '0', :email, 'Medicine', 1, 'PhD')
+    """), [{'id': i, 'name': f'Doctor {i}', 'email': f'doctor{i}@example.com'} for i in range(1, num_doctors + 1)])
+    db.session.execute(text("""
+        INSERT INTO patient (id, name, phone, email, dob)
+        VALUES (:id, :name, '0', :email, '1990-01-01 00:00:00')
+    """), [{'id': i, 'name': f'Patient {i}', 'email': f'patient{i}@example.com'} for i in range(1, num_patients + 1)])
+
+    batch = []
+    for i in range(num_appointments):
+        doctor_id = i % num_doctors + 1
+        from_time = now - timedelta(minutes=45 * (i // num_doctors + 1))
+        batch.append({
+            'doctor_id': doctor_id,
+            'patient_id': rng.randint(1, num_patients),
+            'from_time': from_time.strftime(SQLITE_DATETIME),
+            'to_time': (from_time + timedelta(minutes=30)).strftime(SQLITE_DATETIME),
+            'notes': 'seed'
+        })
+        if len(batch) == 10000:
+            _insert_appointments(batch)
+            batch = []
+    if batch:
+        _insert_appointments(batch)
+    db.session.commit()
+
+
+def _insert_appointments(batch):
+    db.session.execute(text("""
+        INSERT INTO appointment (doctor_id, patient_id, from_time, to_time, notes)
+        VALUES (:doctor_id, :patient_id, :from_time, :to_time, :notes)
+    """), batch)
+
+
+# Calls fn(*args) for every args tuple and returns the latencies in milliseconds.
+def time_calls(fn, calls):
+    latencies = []
+    for args in calls:
+        start = time.perf_counter()
+        fn(*args)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
@@ -0,0 +1,125 @@
+# Read throughput of the SQLite engine profiles while writes are in flight.
+#
+# Usage: python -m benchmarks.concurrency [--appointments 50000] [--readers 8] [--writers 2] [--seconds 5]
+#
+# For each profile it runs the reader threads alone, then together with the writer threads.
+# Readers page through list_appointments() and load single appointments with get_appointment(),
+# writers book and cancel future appointments through add_appointment() and delete_appointment().
+# The "rollback" profile is SQLite's default rollback journal, "wal" is models.ENGINE_PROFILE.
+import argparse
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+import db_queries
+from benchmarks.common import create_app, seed_appointments, percentile
+
+NUM_DOCTORS = 50
+
+PROFILES = {
+    'rollback': {
+        'journal_mode': 'delete',
+        'synchronous': 'full',
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'temp_store': 'default',
+    },
+    'wal': {},
+}
+
+
+class Stats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+
+    def record(self, latencies, errors):
+        with self._lock:
+            self.latencies.extend(latencies)
+            self.errors += errors
+
+
+def reader(app, stop, stats, num_appointments, seed):
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    with app.app_context():
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                if rng.random() < 0.5:
+                    db_queries.list_appointments(doctor_id=rng.randint(1, NUM_DOCTORS))
+                else:
+                    db_queries.get_appointment(rng.randint(1, num_appointments))
+            except db_queries.DatabaseError:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+            db_queries.db.session.remove()
+    stats.record(latencies, errors)
+
+
+def writer(app, stop, stats, now, seed):
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    with app.app_context():
+        while not stop.is_set():
+            from_time = now + timedelta(days=rng.randint(1, 365), minutes=15 * rng.randint(0, 95))
+            start = time.perf_counter()
+            try:
+                result = db_queries.add_appointment(
+                    rng.randint(1, NUM_DOCTORS), 1, from_time, from_time + timedelta(minutes=30), 'bench')
+                if result['success'] and rng.random() < 0.5:
+                    db_queries.delete_appointment(result['id'])
+            except db_queries.DatabaseError:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+            db_queries.db.session.remove()
+    stats.record(latencies, errors)
+
+
+def run_phase(app, readers, writers, seconds, num_appointments, now):
+    stop = threading.Event()
+    read_stats, write_stats = Stats(), Stats()
+    threads = [threading.Thread(target=reader, args=(app, stop, read_stats, num_appointments, i))
+               for i in range(readers)]
+    threads += [threading.Thread(target=writer, args=(app, stop, write_stats, now, 1000 + i))
+                for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return read_stats, write_stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--appointments', type=int, default=50000)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--profiles', nargs='+', choices=sorted(PROFILES), default=['rollback', 'wal'])
+    args = parser.parse_args()
+
+    print(f"{'profile':<9} {'writers':>7} {'reads/s':>9} {'read p50':>9} {'read p95':>9} {'read p99':>9} "
+          f"{'writes/s':>9} {'write p95':>9} {'errors':>6}")
+    for name in args.profiles:
+        app, _ = create_app(PROFILES[name])
+        now = datetime.now().replace(second=0, microsecond=0)
+        with app.app_context():
+            seed_appointments(args.appointments, num_doctors=NUM_DOCTORS, now=now)
+        for writers in (0, args.writers):
+            reads, writes = run_phase(app, args.readers, writers, args.seconds, args.appointments, now)
+            write_rate = len(writes.latencies) / args.seconds
+            write_p95 = f"{percentile(writes.latencies, 95):>9.2f}" if writes.latencies else f"{'-':>9}"
+            print(f"{name:<9} {writers:>7} {len(reads.latencies) / args.seconds:>9.0f} "
+                  f"{percentile(reads.latencies, 50):>9.2f} {percentile(reads.latencies, 95):>9.2f} "
+                  f"{percentile(reads.latencies, 99):>9.2f} {write_rate:>9.0f} {write_p95} "
+                  f"{reads.errors + writes.errors:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# Booking latency of appointment conflict detection as the appointment table grows.
+#
+# Usage: python -m benchmarks.conflict_detection [--sizes 1000 10000 100000] [--bookings 500]
+#
+# For every table size it times the conflict check for random future slots with the old
+# BETWEEN query, find_conflicting_appointment() on the composite index and on the in-process
+# interval index, and a full add_appointment() booking including its commit.
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import db_queries
+from benchmarks.common import create_app, seed_appointments, time_calls, percentile
+from models import db
+
+NUM_DOCTORS = 50
+
+LEGACY_CONFLICT_QUERY = text("""
+    SELECT COUNT(*)
+    FROM appointment
+    WHERE doctor_id = :doctor_id
+    AND (
+        (:from_time BETWEEN from_time AND to_time)
+        OR (:to_time BETWEEN from_time AND to_time)
+        OR (from_time BETWEEN :from_time AND :to_time)
+    )
+""")
+
+
+def booking_calls(count, now, rng):
+    calls = []
+    for _ in range(count):
+        from_time = now + timedelta(days=rng.randint(1, 60), minutes=15 * rng.randint(0, 95))
+        calls.append((rng.randint(1, NUM_DOCTORS), 1, from_time, from_time + timedelta(minutes=30), 'bench'))
+    return calls
+
+
+def legacy_check(doctor_id, patient_id, from_time, to_time, notes):
+    db.session.execute(LEGACY_CONFLICT_QUERY, {
+        'doctor_id': doctor_id, 'from_time': from_time, 'to_time': to_time
+    }).scalar()
+
+
+def conflict_check(doctor_id, patient_id, from_time, to_time, notes):
+    db_queries.find_conflicting_appointment(doctor_id, from_time, to_time)
+
+
+def run(size, bookings):
+    app, _ = create_app()
+    now = datetime.now().replace(second=0, microsecond=0)
+    with app.app_context():
+        seed_appointments(size, num_doctors=NUM_DOCTORS, now=now)
+        rng = random.Random(size)
+        results = {}
+
+        calls = booking_calls(bookings, now, rng)
+
+        db_queries.appointment_index = None
+        results['legacy query'] = time_calls(legacy_check, calls)
+        results['indexed query'] = time_calls(conflict_check, calls)
+
+        db_queries.enable_appointment_index()
+        for doctor_id in range(1, NUM_DOCTORS + 1):
+            db_queries.appointment_index.find_conflict(doctor_id, now, now)
+        results['interval index'] = time_calls(conflict_check, calls)
+        db_queries.appointment_index = None
+
+        results['add_appointment'] = time_calls(db_queries.add_appointment, calls)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--bookings', type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{'appointments':>12}  {'method':<16} {'p50 ms':>8} {'p95 ms':>8}")
+    for size in args.sizes:
+        for method, latencies in run(size, args.bookings).items():
+            print(f"{size:>12}  {method:<16} {percentile(latencies, 50):>8.3f} {percentile(latencies, 95):>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
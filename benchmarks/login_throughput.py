@@ -0,0 +1,103 @@
+# Login throughput of concurrent clients with bcrypt on the request thread against the hasher pool.
+#
+# Usage: python -m benchmarks.login_throughput [--threads 16] [--users 64] [--rounds 10] [--seconds 5]
+#
+# Users are provisioned with PasswordHasher.hash_many, whose time is reported as well. Then every
+# thread logs in as random users through POST /login with its own test client, first with hashing
+# inline (workers=0) and then on pools of growing size up to the CPU count. Reported are logins/s,
+# p50/p99 latency and the logins turned away with 503 because the hasher queue was full.
+import argparse
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+
+from benchmarks.common import percentile
+from benchmarks.concurrency import Stats
+from password_hashing import PasswordHasher
+
+
+def login_client(flask_app, users, start, stop, stats, busy_counts, seed):
+    rng = random.Random(seed)
+    latencies, errors, busy = [], 0, 0
+    client = flask_app.test_client()
+    start.wait()
+    while not stop.is_set():
+        username = rng.choice(users)
+        began = time.perf_counter()
+        response = client.post('/login', data={'username': username, 'password': f'{username}-password'})
+        latencies.append((time.perf_counter() - began) * 1000)
+        if response.status_code == 503:
+            busy += 1
+        elif response.status_code != 302:
+            errors += 1
+    stats.record(latencies, errors)
+    busy_counts.append(busy)
+
+
+def run(app_module, hasher, users, args):
+    app_module.password_hasher = hasher
+    start, stop = threading.Barrier(args.threads), threading.Event()
+    stats, busy_counts = Stats(), []
+    threads = [threading.Thread(target=login_client,
+                                args=(app_module.app, users, start, stop, stats, busy_counts, i))
+               for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    hasher.shutdown()
+    return {
+        'logins_per_sec': (len(stats.latencies) - sum(busy_counts)) / args.seconds,
+        'busy': sum(busy_counts),
+        'errors': stats.errors,
+        'p50_ms': percentile(stats.latencies, 50),
+        'p99_ms': percentile(stats.latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=16, help='Concurrent clients')
+    parser.add_argument('--users', type=int, default=64)
+    parser.add_argument('--rounds', type=int, default=10, help='bcrypt cost')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--max-pending', type=int, default=64)
+    args = parser.parse_args()
+
+    # app.py binds its database on import
+    db_path = os.path.join(tempfile.mkdtemp(prefix='hms-bench-'), 'hospital.db')
+    os.environ['HOSPITAL_DATABASE_URI'] = f'sqlite:///{db_path}'
+    import app as app_module
+    import db_queries
+    # Not one log line per login
+    app_module.app.logger.setLevel(logging.WARNING)
+
+    users = [f'user{i}' for i in range(args.users)]
+    hasher = PasswordHasher(rounds=args.rounds, max_pending=args.max_pending)
+    began = time.perf_counter()
+    hashes = hasher.hash_many([f'{username}-password' for username in users])
+    print(f"hash_many: {len(users)} passwords of cost {args.rounds} on {hasher.workers} workers in "
+          f"{time.perf_counter() - began:.2f}s")
+    hasher.shutdown()
+    with app_module.app.app_context():
+        db_queries.add_users([{'username': username, 'password': hashed, 'is_admin': False}
+                              for username, hashed in zip(users, hashes)])
+
+    cpus = os.cpu_count() or 1
+    pools = sorted({1, max(1, cpus // 2), cpus})
+    print(f"{'hashing':<10} {'logins/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'busy':>5} {'errors':>6}")
+    for workers in [0] + pools:
+        result = run(app_module, PasswordHasher(rounds=args.rounds, workers=workers, max_pending=args.max_pending),
+                     users, args)
+        name = 'inline' if not workers else f'{workers} workers'
+        print(f"{name:<10} {result['logins_per_sec']:>9.1f} {result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+              f"{result['busy']:>5} {result['errors']:>6}")
+
+
+if __name__ == '__main__':
+    main()
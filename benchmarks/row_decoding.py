@@ -0,0 +1,92 @@
+# CPU time and memory of decoding list query rows into dicts against typed records.
+#
+# Usage: python -m benchmarks.row_decoding [--rows 100000] [--repeat 5]
+#
+# The rows of an appointment list and a patient list are fetched once, then decoded the way the
+# list functions used to (row_to_dict, then datetime.fromisoformat on the datetime columns of every
+# dict) and with db_queries.decode_rows. Reported are the CPU time of decoding and of writing the
+# result as JSON, the peak memory allocated while decoding and the memory the decoded list keeps.
+import argparse
+import json
+import time
+import tracemalloc
+from datetime import datetime
+
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import text
+
+import db_queries
+from benchmarks.common import create_app, seed_appointments
+from models import db
+
+QUERIES = {
+    'appointments': ("""
+        SELECT appointment.*, doctor.name AS doctor_name, patient.name AS patient_name
+        FROM appointment
+        LEFT JOIN doctor ON appointment.doctor_id = doctor.id
+        LEFT JOIN patient ON appointment.patient_id = patient.id
+    """, ('from_time', 'to_time')),
+    'patients': ("SELECT * FROM patient", ('dob',)),
+}
+
+
+def decode_dicts(keys, rows, datetime_columns):
+    items = [db_queries.row_to_dict(row) for row in rows]
+    for item in items:
+        for column in datetime_columns:
+            item[column] = datetime.fromisoformat(item[column])
+    return items
+
+
+def decode_records(keys, rows, datetime_columns):
+    return db_queries.decode_rows(keys, rows, datetime_columns)
+
+
+# What app.JSONProvider does for records, Flask's default for everything else
+def json_default(o):
+    if isinstance(o, db_queries.Record):
+        return o.to_json()
+    return DefaultJSONProvider.default(o)
+
+
+def measure(decode, keys, rows, datetime_columns, repeat):
+    cpu = []
+    for _ in range(repeat):
+        began = time.process_time()
+        decode(keys, rows, datetime_columns)
+        cpu.append(time.process_time() - began)
+
+    tracemalloc.start()
+    items = decode(keys, rows, datetime_columns)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    began = time.process_time()
+    json.dumps(items, default=json_default)
+    json_seconds = time.process_time() - began
+    return {'decode_ms': min(cpu) * 1000, 'json_ms': json_seconds * 1000,
+            'peak_mb': peak / 2 ** 20, 'retained_mb': retained / 2 ** 20}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app, _ = create_app()
+    with app.app_context():
+        seed_appointments(args.rows, num_patients=args.rows)
+        print(f"{'list':<13} {'decoder':<8} {'rows':>7} {'decode ms':>10} {'json ms':>8} {'peak MB':>8} "
+              f"{'kept MB':>8}")
+        for name, (query, datetime_columns) in QUERIES.items():
+            result = db.session.execute(text(query))
+            keys, rows = list(result.keys()), result.all()
+            for decoder, decode in (('dicts', decode_dicts), ('records', decode_records)):
+                stats = measure(decode, keys, rows, datetime_columns, args.repeat)
+                print(f"{name:<13} {decoder:<8} {len(rows):>7} {stats['decode_ms']:>10.1f} {stats['json_ms']:>8.1f} "
+                      f"{stats['peak_mb']:>8.1f} {stats['retained_mb']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
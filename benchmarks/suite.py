@@ -0,0 +1,680 @@
+# Latency of every public db_queries function, HTTP route and Dash callback at several data scales.
+#
+# Usage: python -m benchmarks.suite [--sizes 1000 100000 1000000] [--seconds 1] [--output results.json]
+#                                   [--baseline previous.json] [--threshold 1.25] [--data-dir DIR]
+#
+# A size is a number of appointments. Its database is generated once by random_data.py, with the
+# doctors, nurses and patients of that scale, and kept in --data-dir; every run works on a copy.
+# The cases of a size run in a child process, because app.py binds its database when imported.
+# Each case is repeated for --seconds (and at least --min-calls times) and reports its p50, p95, p99
+# and mean latency and the rows it returned per second. Write cases prepare their input outside the
+# timed call, e.g. delete_doctor times deleting a doctor that was created just before.
+# Routes are called through Flask's test client with an admin session, the Dash callbacks directly
+# with the figure cache cleared. Public functions and routes without a case are listed as uncovered.
+#
+# Results are saved as JSON. With --baseline, cases whose p50 grew by more than --threshold times
+# (and by at least --min-delta-ms) are listed as regressions and the exit status is 1.
+import argparse
+import contextlib
+import csv
+import inspect
+import io
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from benchmarks.common import percentile
+
+REPO = Path(__file__).resolve().parents[1]
+ISO_DATE = '%Y-%m-%d'
+
+# Helpers and settings of db_queries that are timed through the functions using them
+NOT_TIMED = {'row_to_dict', 'encode_cursor', 'decode_cursor', 'configure_write_retry', 'enable_appointment_index',
+             'transaction', 'run_in_transaction', 'recurring_slots', 'decode_rows', 'iter_records'}
+# Routes served by Dash and Flask itself
+NOT_TIMED_PREFIXES = ('/dash/', '/static/')
+
+BENCH_USER = 'bench-admin'
+BENCH_PASSWORD = 'bench-password'
+ADDRESS = {'street': '1 Bench St', 'county': 'County', 'city': 'City', 'state': 'State',
+           'country': 'Country', 'zipcode': '12345'}
+
+
+class Case:
+
+    def __init__(self, name, kind, call, prepare=None, rows=None):
+        self.name = name
+        self.kind = kind
+        self.call = call
+        self.prepare = prepare
+        self.rows = rows or count_rows
+
+
+# Rows in a db_queries or callback result: list lengths, page items, one for a single row or id.
+def count_rows(result):
+    if result is None:
+        return 0
+    if isinstance(result, dict):
+        if 'items' in result:
+            return len(result['items'])
+        if 'results' in result:
+            return len(result['results'])
+        if 'slots' in result:
+            return len(result['slots'])
+        return 1
+    if isinstance(result, (list, tuple)) or hasattr(result, '__len__') and not isinstance(result, str):
+        return len(result)
+    return 1
+
+
+def response_rows(response):
+    if response.status_code == 304:
+        return 0
+    if response.is_json:
+        return count_rows(response.get_json())
+    if response.mimetype == 'text/csv':
+        return max(0, response.get_data().count(b'\n') - 1)
+    if response.mimetype == 'application/x-ndjson':
+        return response.get_data().count(b'\n')
+    return 1
+
+
+def figure_points(figure):
+    return sum(len(trace.x) for trace in figure.data if trace.x is not None) if hasattr(figure, 'data') else 0
+
+
+# Runs a case for `seconds` and at least min_calls times.
+#     Returns:
+#         dict: Calls, errors, the first error, latency percentiles in ms and rows per second.
+def run_case(case, seconds, min_calls, max_calls):
+    from models import db
+
+    latencies, rows, errors, first_error = [], 0, 0, None
+    deadline = time.perf_counter() + seconds
+    while len(latencies) < min_calls or (time.perf_counter() < deadline and len(latencies) < max_calls):
+        args = case.prepare() if case.prepare else ()
+        start = time.perf_counter()
+        try:
+            result = case.call(*args)
+            elapsed = time.perf_counter() - start
+            if getattr(result, 'status_code', 200) >= 400:
+                errors += 1
+                first_error = first_error or f"HTTP {result.status_code}: {result.get_data(as_text=True)[:200]}"
+            rows += case.rows(result)
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            errors += 1
+            first_error = first_error or f"{type(e).__name__}: {e}"[:200]
+            db.session.rollback()
+        latencies.append(elapsed * 1000)
+    total = sum(latencies) / 1000
+    return {
+        'kind': case.kind,
+        'calls': len(latencies),
+        'errors': errors,
+        'error': first_error,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(total * 1000 / len(latencies), 3),
+        'rows': rows,
+        'rows_per_sec': round(rows / total, 1) if total else None,
+    }
+
+
+# Ids of the seeded rows and unique inputs for the write cases. Must be created in an app context.
+class Fixtures:
+
+    def __init__(self, app_module, seed):
+        from sqlalchemy import text
+        from models import db
+
+        def ids(query):
+            return db.session.execute(text(query)).scalars().all()
+
+        self.app = app_module
+        self.rng = random.Random(seed)
+        self.counter = 0
+        self.doctor_ids = ids("SELECT id FROM doctor")
+        self.nurse_ids = ids("SELECT id FROM nurse")
+        self.patient_ids = ids("SELECT id FROM patient")
+        self.department_ids = ids("SELECT id FROM department")
+        self.appointment_ids = ids("SELECT id FROM appointment")
+        self.diagnostic_ids = ids("SELECT id FROM diagnostic")
+        self.diagnosed_appointment_ids = ids("SELECT DISTINCT appointment_id FROM diagnostic")
+        self.search_terms = [name.split()[-1] for name in ids("SELECT name FROM patient LIMIT 100")]
+        self.latest = db.session.execute(text("SELECT MAX(from_time) FROM appointment")).scalar()
+        # Bookings of the write cases go after all seeded appointments, 30 minutes apart
+        self.first_slot = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=400)
+        import db_queries
+        self.user_id = db_queries.add_user(BENCH_USER, BENCH_PASSWORD, app_module.password_hasher, True)
+        self.password_hash = db_queries.get_user_by_id(self.user_id).password
+        self.user_ids = ids("SELECT id FROM user")
+
+    def unique(self, prefix):
+        self.counter += 1
+        return f'{prefix}-{self.counter}'
+
+    def pick(self, ids):
+        return self.rng.choice(ids)
+
+    def slot(self):
+        self.counter += 1
+        from_time = self.first_slot + timedelta(minutes=30 * self.counter)
+        return self.pick(self.doctor_ids), self.pick(self.patient_ids), from_time, from_time + timedelta(minutes=30)
+
+    def interval(self):
+        doctor_id, _, from_time, to_time = self.slot()
+        return doctor_id, from_time, to_time
+
+    def doctor(self):
+        return {'name': self.unique('Bench Doctor'), 'phone': '555-0100', 'email': self.unique('doctor') + '@bench.test',
+                'department_id': self.pick(self.department_ids), 'category': 'Medicine', 'experience': 5,
+                'degree': 'PhD', **ADDRESS}
+
+    def nurse(self):
+        return {'name': self.unique('Bench Nurse'), 'phone': '555-0100', 'email': self.unique('nurse') + '@bench.test',
+                'doctor_id': self.pick(self.doctor_ids), **ADDRESS}
+
+    def patient(self):
+        return {'name': self.unique('Bench Patient'), 'dob': '1990-01-01', 'phone': '555-0100',
+                'email': self.unique('patient') + '@bench.test', **ADDRESS}
+
+    def appointment(self):
+        doctor_id, patient_id, from_time, to_time = self.slot()
+        return {'doctor_id': doctor_id, 'patient_id': patient_id, 'from_time': from_time.isoformat(),
+                'to_time': to_time.isoformat(), 'notes': 'bench'}
+
+    # Ten weekly occurrences from the next free slot
+    def appointment_series(self):
+        appointment = self.appointment()
+        rule = {'from_time': appointment.pop('from_time'), 'to_time': appointment.pop('to_time'), 'count': 10}
+        return {**appointment, 'recurrence': rule}
+
+    def import_records(self, entity, count):
+        return [self.patient() if entity == 'patient' else self.appointment() for _ in range(count)]
+
+    def import_rows(self, entity, count):
+        import bulk_import
+        return [bulk_import.validate_record(entity, line, record)[0]
+                for line, record in enumerate(self.import_records(entity, count), start=2)]
+
+    def csv_body(self, entity, count):
+        records = self.import_records(entity, count)
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=list(records[0]))
+        writer.writeheader()
+        writer.writerows(records)
+        return buffer.getvalue().encode('utf-8')
+
+    def month(self):
+        last = datetime.fromisoformat(str(self.latest)) if self.latest else datetime.now()
+        return (last - timedelta(days=30)).strftime(ISO_DATE), last.strftime(ISO_DATE)
+
+
+def db_query_cases(f):
+    import db_queries as q
+
+    def new_doctor():
+        return q.add_doctor(f.doctor())
+
+    def new_patient():
+        return q.add_patient(f.patient())
+
+    def new_appointment(doctor_id=None, patient_id=None, prescription=True):
+        slot_doctor, slot_patient, from_time, to_time = f.slot()
+        result = q.add_appointment(doctor_id or slot_doctor, patient_id or slot_patient, from_time, to_time, 'bench')
+        if prescription:
+            q.add_prescription(result['id'])
+        return result['id']
+
+    def diagnosed_appointment():
+        id = new_appointment()
+        q.add_diagnostic(id, {'test_name': 'ECG', 'test_report': 'bench'})
+        return id
+
+    def with_appointments(create):
+        def prepare():
+            id = create()
+            for _ in range(3):
+                new_appointment(**{'doctor_id' if create is new_doctor else 'patient_id': id})
+            return id,
+        return prepare
+
+    # Ten weekly occurrences from the next free slot
+    def series():
+        doctor_id, patient_id, from_time, to_time = f.slot()
+        return doctor_id, patient_id, q.recurring_slots(from_time, to_time, count=10), 'bench'
+
+    def uncached(*args):
+        def prepare():
+            q.analytics_cache.clear()
+            return args
+        return prepare
+
+    # Entity reads are timed cold; the "(cached)" cases time the same lookups answered by the entity cache
+    def entity_uncached(build=tuple):
+        def prepare():
+            q.entity_cache.clear()
+            return build()
+        return prepare
+
+    def export(entity, **filters):
+        def call():
+            return list(q.export_rows(entity, **filters)[1])
+        return call
+
+    from_date, to_date = f.month()
+    cases = [
+        ('get_all_doctors_with_address_and_dept', q.get_all_doctors_with_address_and_dept, None),
+        ('list_doctors', q.list_doctors, None),
+        ('list_doctors(search)', lambda: q.list_doctors(search=f.pick(f.search_terms)), None),
+        ('get_all_doctors_with_dept', q.get_all_doctors_with_dept, lambda: (f.pick(f.department_ids),)),
+        ('get_all_doctors', q.get_all_doctors, None),
+        ('add_doctor', q.add_doctor, lambda: (f.doctor(),)),
+        ('edit_doctor', q.edit_doctor, lambda: (f.pick(f.doctor_ids), f.doctor())),
+        ('delete_doctor', q.delete_doctor, lambda: (new_doctor(),)),
+        ('get_doctor', q.get_doctor, entity_uncached(lambda: (f.pick(f.doctor_ids),))),
+        ('get_doctor(cached)', q.get_doctor, lambda: (f.pick(f.doctor_ids[:10]),)),
+        ('get_doctor_options', q.get_doctor_options, entity_uncached()),
+        ('get_doctor_options(cached)', q.get_doctor_options, None),
+        ('get_all_nurses', q.get_all_nurses, None),
+        ('list_nurses', q.list_nurses, None),
+        ('add_nurse', q.add_nurse, lambda: (f.nurse(),)),
+        ('edit_nurse', q.edit_nurse, lambda: (f.pick(f.nurse_ids), f.nurse())),
+        ('delete_nurse', q.delete_nurse, lambda: (q.add_nurse(f.nurse()),)),
+        ('get_nurse', q.get_nurse, entity_uncached(lambda: (f.pick(f.nurse_ids),))),
+        ('get_all_patients', q.get_all_patients, None),
+        ('list_patients', q.list_patients, None),
+        ('list_patients(search)', lambda: q.list_patients(search=f.pick(f.search_terms)), None),
+        ('add_patient', q.add_patient, lambda: (f.patient(),)),
+        ('edit_patient', q.edit_patient, lambda: (f.pick(f.patient_ids), f.patient())),
+        ('delete_patient', q.delete_patient, lambda: (new_patient(),)),
+        ('get_patient', q.get_patient, entity_uncached(lambda: (f.pick(f.patient_ids),))),
+        ('get_patient(cached)', q.get_patient, lambda: (f.pick(f.patient_ids[:10]),)),
+        ('get_all_departments', q.get_all_departments, entity_uncached()),
+        ('add_department', q.add_department, lambda: ({'name': f.unique('Bench Department')},)),
+        ('edit_department', q.edit_department,
+         lambda: (q.add_department({'name': f.unique('Bench Department')}), {'name': f.unique('Bench Department')})),
+        ('delete_department', q.delete_department, lambda: (q.add_department({'name': f.unique('Bench Department')}),)),
+        ('get_department', q.get_department, entity_uncached(lambda: (f.pick(f.department_ids),))),
+        ('get_all_appointments', q.get_all_appointments, None),
+        ('list_appointments', q.list_appointments, None),
+        ('list_appointments(doctor)', lambda: q.list_appointments(doctor_id=f.pick(f.doctor_ids)), None),
+        ('list_appointments(month)', lambda: q.list_appointments(from_date=from_date, to_date=to_date), None),
+        ('find_conflicting_appointment', q.find_conflicting_appointment, f.interval),
+        ('find_free_slots', lambda: q.find_free_slots(f.pick(f.doctor_ids), from_date, to_date), None),
+        ('find_department_free_slots',
+         lambda: q.find_department_free_slots(f.pick(f.department_ids), from_date, to_date, limit=1), None),
+        ('add_appointment', q.add_appointment, lambda: f.slot() + ('bench',)),
+        ('add_appointment_series', q.add_appointment_series, series),
+        ('edit_appointment', q.edit_appointment, lambda: (new_appointment(),) + f.slot() + ('bench',)),
+        ('delete_appointment', q.delete_appointment, lambda: (new_appointment(prescription=False),)),
+        ('delete_appointments_for_doctor', q.delete_appointments_for_doctor, with_appointments(new_doctor)),
+        ('delete_appointments_for_patient', q.delete_appointments_for_patient, with_appointments(new_patient)),
+        ('get_appointment', q.get_appointment, lambda: (f.pick(f.appointment_ids),)),
+        ('add_prescription', q.add_prescription, lambda: (new_appointment(prescription=False),)),
+        ('edit_prescription_by_appointment_id', q.edit_prescription_by_appointment_id,
+         lambda: (f.pick(f.appointment_ids), 'bench')),
+        ('delete_prescription_by_appointment_id', q.delete_prescription_by_appointment_id,
+         lambda: (new_appointment(),)),
+        ('get_prescription_by_appointment_id', q.get_prescription_by_appointment_id,
+         lambda: (f.pick(f.appointment_ids),)),
+        ('add_diagnostic', q.add_diagnostic,
+         lambda: (f.pick(f.appointment_ids), {'test_name': 'ECG', 'test_report': 'bench'})),
+        ('delete_diagnostic', q.delete_diagnostic,
+         lambda: (q.add_diagnostic(f.pick(f.appointment_ids), {'test_name': 'ECG', 'test_report': 'bench'})['id'],)),
+        ('delete_diagnostic_by_appointment_id', q.delete_diagnostic_by_appointment_id,
+         lambda: (diagnosed_appointment(),)),
+        ('get_diagnostic', q.get_diagnostic, lambda: (f.pick(f.diagnostic_ids),)),
+        ('get_diagnostic_by_appointment_id', q.get_diagnostic_by_appointment_id,
+         lambda: (f.pick(f.diagnosed_appointment_ids),)),
+        ('add_user', q.add_user, lambda: (f.unique('bench-user'), BENCH_PASSWORD, f.app.password_hasher)),
+        ('add_users', q.add_users, lambda: ([{'username': f.unique('bench-user'), 'password': f.password_hash}
+                                             for _ in range(10)],)),
+        ('get_existing_usernames', q.get_existing_usernames, lambda: ({BENCH_USER, f.unique('bench-user')},)),
+        ('set_user_password', q.set_user_password, lambda: (f.user_id, f.password_hash)),
+        ('get_user_by_username', q.get_user_by_username, lambda: (BENCH_USER,)),
+        ('get_user_by_id', q.get_user_by_id, lambda: (f.user_id,)),
+        ('delete_user', q.delete_user, lambda: (q.add_user(f.unique('bench-user'), BENCH_PASSWORD, f.app.password_hasher),)),
+        ('get_all_users', q.get_all_users, None),
+        ('count_patients_per_doctor', q.count_patients_per_doctor, uncached()),
+        ('count_patients_per_department', q.count_patients_per_department, uncached()),
+        ('count_patients_daily', q.count_patients_daily, uncached()),
+        ('count_patients_monthly', q.count_patients_monthly, uncached()),
+        ('count_patients_yearly', q.count_patients_yearly, uncached()),
+        ('count_top_diagnostics_per_patient', q.count_top_diagnostics_per_patient, uncached(10)),
+        ('get_analytics_snapshot', q.get_analytics_snapshot, None),
+        ('get_analytics_changes', q.get_analytics_changes, lambda: (0,)),
+        ('get_analytics_rollups', q.get_analytics_rollups, None),
+        ('get_analytics_dimensions', q.get_analytics_dimensions, None),
+        ('search', q.search, lambda: (f.pick(f.search_terms),)),
+        ('typeahead_doctors', q.typeahead_doctors, lambda: (f.pick(f.search_terms)[:2],)),
+        ('typeahead_doctors(department)', q.typeahead_doctors,
+         lambda: (f.pick(f.search_terms)[:2], f.pick(f.department_ids))),
+        ('typeahead_patients', q.typeahead_patients, lambda: (f.pick(f.search_terms)[:2],)),
+        ('search(patient)', lambda term: q.search(term, 'patient'), lambda: (f.pick(f.search_terms),)),
+        ('import_people', q.import_people, lambda: ('patient', f.import_rows('patient', 100))),
+        ('import_appointments', q.import_appointments, lambda: (f.import_rows('appointment', 100),)),
+        ('export_rows(patient)', export('patient'), None),
+        ('export_rows(appointment, month)', export('appointment', from_date=from_date, to_date=to_date), None),
+        ('rebuild_rollups', q.rebuild_rollups, None),
+        ('rebuild_search_index', q.rebuild_search_index, None),
+    ]
+    return [Case(name, 'db_queries', call, prepare,
+                 rows=(lambda result: result[0]) if name.startswith('import_') else None)
+            for name, call, prepare in cases]
+
+
+def route_cases(f, client):
+    import db_queries as q
+
+    def login():
+        with client.session_transaction() as session:
+            session.update(user_id=f.user_id, username=BENCH_USER, is_admin=True)
+
+    def request(method, path, **kwargs):
+        response = client.open(path, method=method, **kwargs)
+        response.get_data()
+        return response
+
+    def new_appointment():
+        data = f.appointment()
+        id = q.add_appointment(data['doctor_id'], data['patient_id'], datetime.fromisoformat(data['from_time']),
+                               datetime.fromisoformat(data['to_time']), 'bench')['id']
+        q.add_prescription(id)
+        return id
+
+    def new_diagnostic():
+        return q.add_diagnostic(f.pick(f.appointment_ids), {'test_name': 'ECG', 'test_report': 'bench'})['id']
+
+    def diagnosed_appointment():
+        id = new_appointment()
+        q.add_diagnostic(id, {'test_name': 'ECG', 'test_report': 'bench'})
+        return id
+
+    def new_department():
+        id = q.add_department({'name': f.unique('Bench Department')})
+        doctor = f.doctor()
+        doctor['department_id'] = id
+        q.add_doctor(doctor)
+        return id
+
+    # Reload of an unchanged page or entity, sent with the ETag of the previous response
+    def revalidated(path):
+        def build():
+            return path, {'headers': {'If-None-Match': client.get(path).headers['ETag']}}
+        return build
+
+    from_date, to_date = f.month()
+    # (method, rule, path or a function returning the path and request arguments)
+    cases = [
+        ('GET', '/', lambda: ('/', {})),
+        ('GET', '/login', lambda: ('/login', {})),
+        ('POST', '/login', lambda: ('/login', {'data': {'username': BENCH_USER, 'password': BENCH_PASSWORD}})),
+        ('GET', '/signup', lambda: ('/signup', {})),
+        ('POST', '/signup', lambda: ('/signup', {'data': {'username': f.unique('bench-user'),
+                                                          'password': BENCH_PASSWORD}})),
+        ('GET', '/logout', lambda: ('/logout', {})),
+        ('GET', '/dashboard', lambda: ('/dashboard', {})),
+        ('GET', '/admin', lambda: ('/admin', {})),
+        ('POST', '/admin/create_user', lambda: ('/admin/create_user', {
+            'json': {'username': f.unique('bench-user'), 'password': BENCH_PASSWORD}})),
+        ('POST', '/admin/users/bulk', lambda: ('/admin/users/bulk', {
+            'json': {'users': [{'username': f.unique('bench-user'), 'password': BENCH_PASSWORD}]}})),
+        ('POST', '/admin/delete_user/<int:id>', lambda: (
+            f"/admin/delete_user/{q.add_user(f.unique('bench-user'), BENCH_PASSWORD, f.app.password_hasher)}", {})),
+        ('GET', '/doctors', lambda: ('/doctors', {})),
+        ('GET', '/list_doctors', lambda: ('/list_doctors', {})),
+        ('POST', '/add_doctor', lambda: ('/add_doctor', {'json': f.doctor()})),
+        ('POST', '/edit_doctor/<int:id>', lambda: (f'/edit_doctor/{f.pick(f.doctor_ids)}', {'json': f.doctor()})),
+        ('POST', '/delete_doctor/<int:id>', lambda: (f'/delete_doctor/{q.add_doctor(f.doctor())}', {})),
+        ('GET', '/get_doctor/<int:id>', lambda: (f'/get_doctor/{f.pick(f.doctor_ids)}', {})),
+        ('GET', '/nurses', lambda: ('/nurses', {})),
+        ('GET', '/list_nurses', lambda: ('/list_nurses', {})),
+        ('GET', '/get_nurses', lambda: ('/get_nurses', {})),
+        ('POST', '/add_nurse', lambda: ('/add_nurse', {'json': f.nurse()})),
+        ('POST', '/edit_nurse/<int:id>', lambda: (f'/edit_nurse/{f.pick(f.nurse_ids)}', {'json': f.nurse()})),
+        ('POST', '/delete_nurse/<int:id>', lambda: (f'/delete_nurse/{q.add_nurse(f.nurse())}', {})),
+        ('GET', '/get_nurse/<int:id>', lambda: (f'/get_nurse/{f.pick(f.nurse_ids)}', {})),
+        ('GET', '/patients', lambda: ('/patients', {})),
+        ('GET', '/list_patients', lambda: ('/list_patients', {})),
+        ('POST', '/add_patient', lambda: ('/add_patient', {'json': f.patient()})),
+        ('POST', '/edit_patient/<int:id>', lambda: (f'/edit_patient/{f.pick(f.patient_ids)}', {'json': f.patient()})),
+        ('POST', '/delete_patient/<int:id>', lambda: (f'/delete_patient/{q.add_patient(f.patient())}', {})),
+        ('GET', '/get_patient/<int:id>', lambda: (f'/get_patient/{f.pick(f.patient_ids)}', {})),
+        ('GET', '/appointments', lambda: ('/appointments', {})),
+        ('GET', '/list_appointments', lambda: ('/list_appointments', {})),
+        ('GET', '/doctors/<int:id>/free_slots', lambda: (
+            f'/doctors/{f.pick(f.doctor_ids)}/free_slots?from_date={from_date}&to_date={to_date}', {})),
+        ('GET', '/departments/<int:id>/free_slots', lambda: (
+            f'/departments/{f.pick(f.department_ids)}/free_slots?from_date={from_date}&to_date={to_date}&limit=1', {})),
+        ('POST', '/add_appointment', lambda: ('/add_appointment', {'json': f.appointment()})),
+        ('POST', '/add_appointment_series', lambda: ('/add_appointment_series', {'json': f.appointment_series()})),
+        ('POST', '/edit_appointment/<int:id>', lambda: (f'/edit_appointment/{new_appointment()}',
+                                                        {'json': f.appointment()})),
+        # The route fails for appointments without a diagnostic, so it is timed on one that has
+        ('POST', '/delete_appointment/<int:id>', lambda: (f'/delete_appointment/{diagnosed_appointment()}', {})),
+        ('GET', '/get_appointment/<int:id>', lambda: (f'/get_appointment/{f.pick(f.appointment_ids)}', {})),
+        ('POST', '/edit_prescription/<int:id>', lambda: (f'/edit_prescription/{f.pick(f.appointment_ids)}',
+                                                         {'json': {'prescription_notes': 'bench'}})),
+        ('GET', '/get_prescription/<int:id>', lambda: (f'/get_prescription/{f.pick(f.appointment_ids)}', {})),
+        ('POST', '/add_diagnostic', lambda: ('/add_diagnostic', {'data': {
+            'appointment_id': f.pick(f.appointment_ids), 'test_name': 'ECG', 'test_report': 'bench'}})),
+        ('GET', '/get_diagnostic/<int:id>', lambda: (f'/get_diagnostic/{f.pick(f.diagnosed_appointment_ids)}', {})),
+        ('POST', '/delete_diagnostic/<int:id>', lambda: (f'/delete_diagnostic/{new_diagnostic()}', {})),
+        ('GET', '/departments', lambda: ('/departments', {})),
+        ('POST', '/add_department', lambda: ('/add_department', {'json': {'name': f.unique('Bench Department')}})),
+        ('POST', '/edit_department/<int:id>', lambda: (
+            f"/edit_department/{q.add_department({'name': f.unique('Bench Department')})}",
+            {'json': {'name': f.unique('Bench Department')}})),
+        ('POST', '/delete_department/<int:id>', lambda: (f'/delete_department/{new_department()}', {})),
+        ('GET', '/get_department/<int:id>', lambda: (f'/get_department/{f.pick(f.department_ids)}', {})),
+        ('GET', '/search', lambda: ('/search', {'query_string': {'q': f.pick(f.search_terms)}})),
+        ('GET', '/typeahead/doctors', lambda: ('/typeahead/doctors', {'query_string': {'q': f.pick(f.search_terms)[:2]}})),
+        ('GET', '/typeahead/patients',
+         lambda: ('/typeahead/patients', {'query_string': {'q': f.pick(f.search_terms)[:2]}})),
+        ('GET', '/appointments (304)', revalidated('/appointments')),
+        ('GET', '/list_appointments (304)', revalidated('/list_appointments')),
+        ('GET', '/get_doctor/<int:id> (304)', lambda: revalidated(f'/get_doctor/{f.pick(f.doctor_ids)}')()),
+        ('POST', '/import/<entity>', lambda: ('/import/patient', {
+            'data': f.csv_body('patient', 100), 'content_type': 'text/csv'})),
+        ('GET', '/export/<entity>', lambda: ('/export/appointment', {
+            'query_string': {'from_date': from_date, 'to_date': to_date}})),
+    ]
+
+    def prepare(build):
+        def prepare():
+            login()
+            path, kwargs = build()
+            return path, kwargs
+        return prepare
+
+    return [Case(f'{method} {rule}', 'route', lambda path, kwargs, method=method: request(method, path, **kwargs),
+                 prepare(build), rows=response_rows)
+            for method, rule, build in cases]
+
+
+def dash_cases(f):
+    app = f.app
+
+    def uncached(*args):
+        def prepare():
+            app.figure_cache.clear()
+            return args
+        return prepare
+
+    callbacks = [
+        ('update_doctor_patient_histogram', app.update_doctor_patient_histogram,
+         ('Doctor Name', 'Number of Patients')),
+        ('update_dept_patient_histogram', app.update_dept_patient_histogram, ('Doctor Name',)),
+        ('update_diagnostics_patient_histogram', app.update_diagnostics_patient_histogram, ('Doctor Name',)),
+    ] + [(f'update_time_graph({time_frame})', app.update_time_graph, (time_frame,))
+         for time_frame in ('daily', 'monthly', 'yearly')]
+    return [Case(name, 'dash', callback, uncached(*args), rows=figure_points) for name, callback, args in callbacks]
+
+
+# Public db_queries functions and Flask routes that no case covers.
+def uncovered(cases, app_module):
+    import db_queries
+
+    names = {case.name.split('(')[0] for case in cases if case.kind == 'db_queries'}
+    functions = {name for name, function in inspect.getmembers(db_queries, inspect.isfunction)
+                 if function.__module__ == db_queries.__name__ and not name.startswith('_')}
+    routes = {case.name for case in cases if case.kind == 'route'}
+    rules = {f'{method} {rule.rule}' for rule in app_module.app.url_map.iter_rules()
+             if not rule.rule.startswith(NOT_TIMED_PREFIXES) for method in rule.methods - {'HEAD', 'OPTIONS'}}
+    return sorted(functions - names - NOT_TIMED) + sorted(rules - routes)
+
+
+# Runs all cases of one size against the database at HOSPITAL_DATABASE_URI, in the child process.
+def run_size(args):
+    import app as app_module
+    from models import db
+    from sqlalchemy import text
+
+    # Requests still write the application log file, but not to the console
+    app_module.log_listener.handlers = tuple(handler for handler in app_module.log_listener.handlers
+                                             if isinstance(handler, logging.FileHandler))
+    results = {'size': args.run_size, 'cases': {}}
+    with app_module.app.app_context(), contextlib.redirect_stdout(io.StringIO()):
+        results['tables'] = {table: db.session.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+                             for table in ('department', 'doctor', 'nurse', 'patient', 'appointment', 'diagnostic')}
+        fixtures = Fixtures(app_module, args.seed)
+        client = app_module.app.test_client()
+        cases = dash_cases(fixtures) + db_query_cases(fixtures) + route_cases(fixtures, client)
+        results['uncovered'] = uncovered(cases, app_module)
+        for case in cases:
+            if args.cases and not any(pattern in case.name for pattern in args.cases):
+                continue
+            results['cases'][case.name] = run_case(case, args.seconds, args.min_calls, args.max_calls)
+            print(f"  {case.name}", file=sys.stderr)
+    with open(args.results, 'w') as results_file:
+        json.dump(results, results_file)
+
+
+# Generates the database of a size into data_dir unless it is already there.
+def seeded_database(size, seed, data_dir):
+    from random_data import SCALE_UNIT
+
+    path = Path(data_dir).resolve() / f'hospital-{size}-seed{seed}.db'
+    if not path.exists():
+        partial = path.with_suffix('.partial')
+        print(f"Generating {size} appointments into {path}", file=sys.stderr)
+        subprocess.run([sys.executable, 'random_data.py', '--scale', str(size / SCALE_UNIT['appointments']),
+                        '--seed', str(seed), '--database-uri', f'sqlite:///{partial}'],
+                       cwd=REPO, check=True, stdout=subprocess.DEVNULL)
+        os.replace(partial, path)
+    return path
+
+
+def benchmark_size(size, args):
+    seeded = seeded_database(size, args.seed, args.data_dir)
+    with tempfile.TemporaryDirectory(prefix='hms-suite-') as work_dir:
+        database = Path(work_dir) / 'hospital.db'
+        with sqlite3.connect(seeded) as source, sqlite3.connect(database) as target:
+            source.backup(target)
+        results_path = Path(work_dir) / 'results.json'
+        command = [sys.executable, '-m', 'benchmarks.suite', '--run-size', str(size), '--results', str(results_path),
+                   '--seed', str(args.seed), '--seconds', str(args.seconds), '--min-calls', str(args.min_calls),
+                   '--max-calls', str(args.max_calls)]
+        if args.cases:
+            command += ['--cases', *args.cases]
+        print(f"Benchmarking {size} appointments", file=sys.stderr)
+        subprocess.run(command, cwd=REPO, check=True, stdout=subprocess.DEVNULL,
+                       env={**os.environ, 'HOSPITAL_DATABASE_URI': f'sqlite:///{database}'})
+        with open(results_path) as results_file:
+            return json.load(results_file)
+
+
+# Cases of `results` whose p50 grew by more than threshold times and min_delta_ms against the baseline.
+def regressions(results, baseline, threshold, min_delta_ms):
+    found = []
+    for size, size_results in results['sizes'].items():
+        baseline_cases = baseline.get('sizes', {}).get(size, {}).get('cases', {})
+        for name, case in size_results['cases'].items():
+            before = baseline_cases.get(name)
+            if not before or not before['p50_ms']:
+                continue
+            if case['p50_ms'] > before['p50_ms'] * threshold and case['p50_ms'] - before['p50_ms'] >= min_delta_ms:
+                found.append((size, name, before['p50_ms'], case['p50_ms']))
+    return found
+
+
+def print_report(results, baseline):
+    for size, size_results in results['sizes'].items():
+        baseline_cases = (baseline or {}).get('sizes', {}).get(size, {}).get('cases', {})
+        print(f"\n{size} appointments: {size_results['tables']}")
+        print(f"{'case':<48} {'calls':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rows/s':>11} "
+              f"{'errors':>6} {'vs base':>8}")
+        for name, case in size_results['cases'].items():
+            before = baseline_cases.get(name)
+            change = f"{case['p50_ms'] / before['p50_ms']:>7.2f}x" if before and before['p50_ms'] else f"{'-':>8}"
+            rows_per_sec = f"{case['rows_per_sec']:>11.0f}" if case['rows_per_sec'] is not None else f"{'-':>11}"
+            print(f"{name:<48} {case['calls']:>6} {case['p50_ms']:>9.2f} {case['p95_ms']:>9.2f} "
+                  f"{case['p99_ms']:>9.2f} {rows_per_sec} {case['errors']:>6} {change}")
+        for name, case in size_results['cases'].items():
+            if case['error']:
+                print(f"  {name}: {case['error']}")
+        if size_results['uncovered']:
+            print(f"Not benchmarked: {', '.join(size_results['uncovered'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark db_queries, the routes and the Dash callbacks.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000], help='Appointments')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--seconds', type=float, default=1, help='Time spent on each case')
+    parser.add_argument('--min-calls', type=int, default=3)
+    parser.add_argument('--max-calls', type=int, default=1000)
+    parser.add_argument('--cases', nargs='+', help='Only run cases whose name contains one of these')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'hms-bench-data'),
+                        help='Where the generated databases are kept between runs')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline', help='Results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25, help='p50 ratio reported as a regression')
+    parser.add_argument('--min-delta-ms', type=float, default=0.1, help='Smaller p50 changes are noise')
+    parser.add_argument('--run-size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--results', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_size is not None:
+        run_size(args)
+        return
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'seed': args.seed,
+        'sizes': {str(size): benchmark_size(size, args) for size in args.sizes},
+    }
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_report(results, baseline)
+    print(f"\nResults saved to {args.output}")
+    if baseline:
+        found = regressions(results, baseline, args.threshold, args.min_delta_ms)
+        for size, name, before, after in found:
+            print(f"REGRESSION {size} {name}: p50 {before:.2f} ms -> {after:.2f} ms")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
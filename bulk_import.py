@@ -0,0 +1,208 @@
+import csv
+import io
+import json
+import time
+from datetime import datetime
+from itertools import islice
+
+import db_queries
+
+# Rows validated and written per transaction
+IMPORT_CHUNK_SIZE = 1000
+# Rejected rows listed in a report, the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+IMPORT_ENTITIES = ('patient', 'doctor', 'nurse', 'appointment')
+
+
+def _text(value):
+    value = str(value).strip()
+    return value or None
+
+
+def _integer(value):
+    return int(value)
+
+
+def _datetime(value):
+    return datetime.fromisoformat(str(value).strip())
+
+
+# Fields of each importable entity: (name, converter, required).
+# Optional fields that are missing or empty are stored as NULL.
+_ADDRESS_FIELDS = [(column, _text, False) for column in db_queries.ADDRESS_COLUMNS]
+IMPORT_FIELDS = {
+    'patient': [
+        ('name', _text, True),
+        ('dob', _datetime, True),
+        ('phone', _text, False),
+        ('email', _text, False),
+    ] + _ADDRESS_FIELDS,
+    'doctor': [
+        ('name', _text, True),
+        ('phone', _text, True),
+        ('email', _text, True),
+        ('department_id', _integer, False),
+        ('category', _text, True),
+        ('experience', _integer, True),
+        ('degree', _text, True),
+    ] + _ADDRESS_FIELDS,
+    'nurse': [
+        ('name', _text, True),
+        ('phone', _text, False),
+        ('email', _text, False),
+        ('doctor_id', _integer, False),
+    ] + _ADDRESS_FIELDS,
+    'appointment': [
+        ('doctor_id', _integer, True),
+        ('patient_id', _integer, True),
+        ('from_time', _datetime, True),
+        ('to_time', _datetime, True),
+        ('notes', _text, False),
+    ],
+}
+
+
+class BulkImportError(Exception):
+    # Raised when an import cannot start, e.g. for an unknown entity or format, or cannot read its stream.
+    pass
+
+
+# Picks the import format from an explicit name, a file name or a content type.
+def detect_format(format=None, filename=None, content_type=None):
+    if format:
+        if format not in IMPORT_FORMATS:
+            raise BulkImportError(f"Unsupported format {format}, use one of {', '.join(IMPORT_FORMATS)}")
+        return format
+    if filename and filename.lower().endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    if content_type and ('ndjson' in content_type or 'jsonl' in content_type):
+        return 'ndjson'
+    return 'csv'
+
+
+# Decodes a binary stream one line at a time, so bytes that are not UTF-8 are reported with their line.
+def _decode_lines(stream):
+    for line, content in enumerate(stream, start=1):
+        try:
+            yield content.decode('utf-8-sig' if line == 1 else 'utf-8')
+        except UnicodeDecodeError as e:
+            raise BulkImportError(f"Line {line} is not valid UTF-8: {e.reason}")
+
+
+# Yields (line, record, error) for every record of a CSV or NDJSON stream without reading it whole.
+# Line numbers count the CSV header as line 1. Bytes that are not UTF-8 and CSV the csv module cannot
+# parse stop the import with a BulkImportError.
+def read_records(stream, format):
+    lines = stream if isinstance(stream, io.TextIOBase) else _decode_lines(stream)
+    if format == 'csv':
+        reader = csv.DictReader(lines)
+        while True:
+            try:
+                record = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                raise BulkImportError(f"Malformed CSV on line {reader.reader.line_num}: {e}")
+            if None in record:
+                yield reader.line_num, None, "Row has more values than the header"
+            else:
+                yield reader.line_num, record, None
+    for line, content in enumerate(lines, start=1):
+        if not content.strip():
+            continue
+        try:
+            record = json.loads(content)
+        except ValueError as e:
+            yield line, None, f"Invalid JSON: {e}"
+            continue
+        if isinstance(record, dict):
+            yield line, record, None
+        else:
+            yield line, None, "Each line must be a JSON object"
+
+
+# Converts a record to the typed row the db_queries import functions expect.
+#     Returns:
+#         tuple: The row and None, or None and an error message.
+def validate_record(entity, line, record):
+    row = {'line': line}
+    for name, convert, required in IMPORT_FIELDS[entity]:
+        value = record.get(name)
+        if value is None or str(value).strip() == '':
+            if required:
+                return None, f"Missing {name}"
+            row[name] = None
+            continue
+        try:
+            row[name] = convert(value)
+        except (TypeError, ValueError):
+            return None, f"Invalid {name}: {value!r}"
+    if entity == 'appointment' and row['to_time'] <= row['from_time']:
+        return None, "to_time must be after from_time"
+    return row, None
+
+
+# Imports a CSV or NDJSON stream of one entity, validating and writing IMPORT_CHUNK_SIZE rows at a time.
+# Every chunk is its own transaction, so a failing chunk does not undo the chunks before it.
+#     Args:
+#         entity (str): One of IMPORT_ENTITIES.
+#         stream: A binary or text file object.
+#         format (str): 'csv' or 'ndjson'.
+#         chunk_size (int): Rows per transaction.
+
+#     Returns:
+#         dict: Counts of read, imported and rejected rows, the first MAX_REPORTED_ERRORS errors
+#               as {'line', 'error'} and the elapsed seconds.
+
+#     Raises:
+#         BulkImportError: For an unknown entity or format, or a stream that is not UTF-8 or not
+#                          parseable CSV. Chunks before the failing line stay imported.
+def import_stream(entity, stream, format='csv', chunk_size=IMPORT_CHUNK_SIZE):
+    if entity not in IMPORT_ENTITIES:
+        raise BulkImportError(f"Cannot import {entity}, use one of {', '.join(IMPORT_ENTITIES)}")
+    if format not in IMPORT_FORMATS:
+        raise BulkImportError(f"Unsupported format {format}, use one of {', '.join(IMPORT_FORMATS)}")
+
+    report = {'entity': entity, 'rows': 0, 'imported': 0, 'rejected': 0, 'errors': []}
+
+    def reject(line, error):
+        report['rejected'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'line': line, 'error': error})
+
+    start = time.perf_counter()
+    records = read_records(stream, format)
+    while True:
+        try:
+            chunk = list(islice(records, chunk_size))
+        except BulkImportError as e:
+            raise BulkImportError(f"{e} ({report['imported']} rows were imported before it)")
+        if not chunk:
+            break
+        report['rows'] += len(chunk)
+        rows = []
+        for line, record, error in chunk:
+            row = None
+            if error is None:
+                row, error = validate_record(entity, line, record)
+            if error is None:
+                rows.append(row)
+            else:
+                reject(line, error)
+        if not rows:
+            continue
+        try:
+            if entity == 'appointment':
+                imported, rejected = db_queries.import_appointments(rows)
+            else:
+                imported, rejected = db_queries.import_people(entity, rows)
+        except db_queries.DatabaseError as e:
+            imported, rejected = 0, [(row['line'], str(e)) for row in rows]
+        report['imported'] += imported
+        for line, error in sorted(rejected):
+            reject(line, error)
+    report['errors'].sort(key=lambda error: error['line'])
+    report['seconds'] = round(time.perf_counter() - start, 3)
+    return report
@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+
+# Per-table data version counters.
+# The db_queries write functions bump the tables they modify after every commit, so any cached
+# result keyed by the versions of the tables it read is never served after one of them changed.
+# Versions live in process memory, other processes writing to the same database are not seen.
+# They restart from 0 with the process, values handed out to clients are qualified by `epoch`.
+class DataVersions:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._modified = {}
+        self.started = time.time()
+        self.epoch = f'{os.getpid()}.{time.time_ns()}'
+
+    def bump(self, *tables):
+        with self._lock:
+            now = time.time()
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+                self._modified[table] = now
+
+    def get(self, *tables):
+        with self._lock:
+            return tuple(self._versions.get(table, 0) for table in tables)
+
+    # Wall clock time of the last bump of any of the tables, the process start if there was none.
+    def last_modified(self, *tables):
+        with self._lock:
+            return max([self.started] + [self._modified[table] for table in tables if table in self._modified])
+
+
+data_versions = DataVersions()
+
+
+# Thread-safe LRU cache with a per-entry time to live.
+class ResultCache:
+
+    def __init__(self, max_entries=256, ttl_seconds=300):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, max_entries=None, ttl_seconds=None):
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if ttl_seconds is not None:
+                self.ttl_seconds = ttl_seconds
+            self._evict()
+
+    # Returns (True, value) on a hit and (False, None) on a miss or an expired entry.
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+# Caches a function's results in `cache`, keyed by its arguments and the data versions of `tables`.
+# A hit returns the very object an earlier call returned, so a caller that modifies it changes it for
+# every later hit. `f` should return immutable values (tuples, frozen records); where it cannot, such as
+# the Plotly figures of the Dash callbacks, callers must treat the result as read-only.
+def cached(cache, tables):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            key = (f.__module__, f.__qualname__, args, tuple(sorted(kwargs.items())), data_versions.get(*tables))
+            hit, value = cache.get(key)
+            if not hit:
+                value = f(*args, **kwargs)
+                cache.set(key, value)
+            return value
+
+        return decorated_function
+
+    return decorator
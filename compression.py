@@ -0,0 +1,88 @@
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    # Brotli is optional, without it responses are only gzipped
+    brotli = None
+
+# Response types worth compressing, images and other binary types are already compressed
+COMPRESSIBLE_MIMETYPES = ('text/html', 'application/json', 'text/csv', 'application/x-ndjson', 'text/plain',
+                          'text/css', 'application/javascript', 'text/javascript')
+
+
+# Compresses responses with the best encoding the client accepts, brotli before gzip.
+#     Responses of a compressible type are compressed when their body has at least threshold_bytes.
+#     Streamed responses have no known size and are always compressed, chunk by chunk, each chunk
+#     flushed so the client gets what was rendered so far without waiting for the end.
+class Compression:
+
+    def __init__(self, threshold_bytes=1024, gzip_level=6, brotli_level=4):
+        self.threshold_bytes = threshold_bytes
+        self.gzip_level = gzip_level
+        self.brotli_level = brotli_level
+
+    def encodings(self):
+        return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def install(self, app):
+        app.after_request(self.compress)
+
+    def compress(self, response):
+        if (request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 304)
+                or response.direct_passthrough or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(self.encodings())
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = self._compress_chunks(encoding, response.iter_encoded())
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.threshold_bytes:
+                return response
+            response.set_data(self._compressor(encoding).finish(data))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def _compressor(self, encoding):
+        if encoding == 'br':
+            return _BrotliCompressor(self.brotli_level)
+        return _GzipCompressor(self.gzip_level)
+
+    def _compress_chunks(self, encoding, chunks):
+        compressor = self._compressor(encoding)
+        for chunk in chunks:
+            compressed = compressor.flush(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.finish(b'')
+
+
+class _GzipCompressor:
+
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def flush(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data):
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class _BrotliCompressor:
+
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def flush(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self, data):
+        return self._compressor.process(data) + self._compressor.finish()
@@ -0,0 +1,79 @@
+import hashlib
+import math
+import time
+from functools import wraps
+
+from flask import make_response, request, session
+
+from cache import data_versions
+
+
+# Conditional GET for views whose response depends only on the request, the logged in user and the
+# tables they read.
+#     The ETag and Last-Modified of a response come from the data versions of those tables
+#     (cache.DataVersions), which the db_queries write functions bump on commit. A request whose
+#     If-None-Match or If-Modified-Since still matches is answered with 304 before the view runs,
+#     without a query or a template. Versions only see writes of this process, so the validators
+#     also change every revalidate_seconds to bound how long writes of other processes go unseen.
+class ConditionalGet:
+
+    def __init__(self, revalidate_seconds=60):
+        self.revalidate_seconds = revalidate_seconds
+
+    def configure(self, revalidate_seconds=None):
+        if revalidate_seconds is not None:
+            self.revalidate_seconds = revalidate_seconds
+
+    # ETag and Last-Modified timestamp of the current request over `tables`.
+    #     HTTP dates have no fractions, so Last-Modified is None while the last write is in the
+    #     current second: a later write in the same second would carry the same date.
+    def validators(self, tables):
+        now = time.time()
+        window = int(now // self.revalidate_seconds) if self.revalidate_seconds else 0
+        key = repr((data_versions.epoch, window, request.full_path, session.get('user_id'), session.get('is_admin'),
+                    data_versions.get(*tables)))
+        etag = hashlib.blake2b(key.encode('utf-8'), digest_size=12).hexdigest()
+        modified = data_versions.last_modified(*tables)
+        if self.revalidate_seconds:
+            modified = max(modified, window * self.revalidate_seconds)
+        if math.floor(modified) >= math.floor(now):
+            return etag, None
+        return etag, math.floor(modified)
+
+    # Decorator answering GET requests of a view with 304 while `tables` did not change.
+    # Responses of the view other than 200 are sent as they are, without validators.
+    def __call__(self, tables):
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                # Pending flash messages are shown by the next page that is rendered
+                if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+                    return f(*args, **kwargs)
+                etag, last_modified = self.validators(tables)
+                if _not_modified(etag, last_modified):
+                    response = make_response('', 304)
+                else:
+                    response = make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                # Weak: the body may be compressed on the way out
+                response.set_etag(etag, weak=True)
+                if last_modified is not None:
+                    response.last_modified = last_modified
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+                response.vary.add('Cookie')
+                return response
+
+            return decorated_function
+
+        return decorator
+
+
+# If-None-Match takes precedence over If-Modified-Since when a request carries both.
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        return request.if_modified_since.timestamp() >= last_modified
+    return False
@@ -1,7 +1,23 @@
-from sqlalchemy import text
-from sqlalchemy.exc import SQLAlchemyError
-
-from models import db, User
+import base64
+import heapq
+import html
+import json
+import random
+import re
+import time
+from contextlib import contextmanager
+from dataclasses import make_dataclass
+from datetime import datetime, timedelta
+from functools import lru_cache, partial, wraps
+from itertools import islice, starmap
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import IntegrityError, OperationalError, SQLAlchemyError
+
+from cache import ResultCache, cached, data_versions
+from interval_index import AppointmentIntervalIndex
+from models import (db, User, BOOKING_CONFLICT, SEARCH_SOURCES, SEARCH_ROWID_STRIDE, populate_search_index,
+                    populate_rollups)
 
 
 class DatabaseError(Exception):
@@ -20,11 +36,353 @@ def row_to_dict(row):
     return dict(row._mapping)
 
 
+# Typed rows of list queries.
+#     row_to_dict builds a new dict per row and leaves SQLite's datetime text to be parsed by every
+#     caller. Records are __slots__ objects instead, one class per column list, with their datetime
+#     columns parsed once while the rows are decoded. They read like the dicts they replace
+#     (record.name or record['name']) and app.py's JSON provider writes them through to_json(), with
+#     datetimes in the 'YYYY-MM-DD HH:MM:SS' form SQLite stores them in. Results shared through a
+#     cache are frozen records, which raise on assignment but take longer to build.
+class Record:
+    __slots__ = ()
+    _fields = ()
+
+    def __getitem__(self, name):
+        if name not in self._fields:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        return getattr(self, name) if name in self._fields else default
+
+    def keys(self):
+        return self._fields
+
+    def to_json(self):
+        return {field: _json_value(getattr(self, field)) for field in self._fields}
+
+
+def _json_value(value):
+    return value.isoformat(sep=' ') if isinstance(value, datetime) else value
+
+
+@lru_cache(maxsize=256)
+def _record_type(fields, frozen=False):
+    record_type = make_dataclass('Record', fields, bases=(Record,), slots=True, frozen=frozen)
+    record_type._fields = fields
+    return record_type
+
+
+# Decodes rows into records, parsing the given datetime columns.
+#     Args:
+#         keys (list of str): Column names of the rows, e.g. result.keys().
+#         rows (iterable): The rows, read as they are decoded.
+#         datetime_columns (tuple of str): Columns holding SQLite datetime text.
+#         frozen (bool): Build frozen records.
+
+#     Returns:
+#         iterator of Record: One record per row.
+def iter_records(keys, rows, datetime_columns=(), frozen=False):
+    keys = tuple(keys)
+    record_type = _record_type(keys, frozen)
+    parsed = [index for index, key in enumerate(keys) if key in datetime_columns]
+    if not parsed:
+        return starmap(record_type, rows)
+
+    def decode(row):
+        values = list(row)
+        for index in parsed:
+            values[index] = _to_datetime(values[index])
+        return record_type(*values)
+
+    return map(decode, rows)
+
+
+def decode_rows(keys, rows, datetime_columns=()):
+    return list(iter_records(keys, rows, datetime_columns))
+
+
+# Results of the entity_cache getters are shared by every caller: rows are frozen records and
+# lists are tuples of them.
+def _shared_row(keys, row):
+    return _record_type(tuple(keys), True)(*row)
+
+
+def _shared_rows(keys, rows):
+    return tuple(iter_records(keys, rows, frozen=True))
+
+
+# Commits the current transaction and bumps the data version of the tables it wrote to,
+# which invalidates every cached result that read one of them.
+# Inside a transaction() scope the tables are only recorded, the scope commits once at its end.
+def _commit(*tables):
+    scope = _transaction_scope()
+    if scope is not None:
+        scope['tables'].update(tables)
+        return
+    db.session.commit()
+    data_versions.bump(*tables)
+
+
+# Rolls back the current transaction. Inside a transaction() scope this discards the work of
+# the whole scope, so the scope is marked and will not commit what runs after it.
+def _rollback():
+    db.session.rollback()
+    scope = _transaction_scope()
+    if scope is not None:
+        scope['rolled_back'] = True
+
+
+# Runs `callback` once the current write is committed, e.g. to update in-process indexes, and
+# never if it is rolled back.
+def _after_commit(callback):
+    scope = _transaction_scope()
+    if scope is not None:
+        scope['after_commit'].append(callback)
+    else:
+        callback()
+
+
+def _transaction_scope():
+    return db.session.info.get('transaction_scope')
+
+
+# Unit of work: runs the db_queries calls of the block in one transaction with a single commit.
+#     The write functions called inside do not commit on their own and are not retried on busy errors,
+#     a failure anywhere rolls back all of the block's writes. Nested scopes join the outermost one.
+#     run_in_transaction() reruns a whole block on busy errors.
+
+#     Raises:
+#         DatabaseError: If committing fails, or if a call inside the block rolled back and the block
+#             still completed (its earlier writes are lost, so nothing after them is committed).
+@contextmanager
+def transaction():
+    if _transaction_scope() is not None:
+        yield
+        return
+    scope = db.session.info['transaction_scope'] = {'tables': set(), 'after_commit': [], 'rolled_back': False}
+    try:
+        yield
+        if scope['rolled_back']:
+            raise DatabaseError("Transaction was rolled back by an earlier error")
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise DatabaseError(f"Error committing transaction: {str(e)}")
+    except BaseException:
+        db.session.rollback()
+        raise
+    finally:
+        del db.session.info['transaction_scope']
+    data_versions.bump(*scope['tables'])
+    for callback in scope['after_commit']:
+        callback()
+
+
+# Retries of write functions that failed because another connection held the write lock.
+# SQLite waits up to busy_timeout_ms for the lock itself (see models.ENGINE_PROFILE), but a
+# transaction that read before writing can be refused at once when a newer write committed
+# in between, and only rerunning the whole function helps then. Configured from the
+# `write_retry` section of config.yml.
+write_retry = {'attempts': 3, 'backoff_ms': 20, 'max_backoff_ms': 500}
+
+
+def configure_write_retry(attempts=None, backoff_ms=None, max_backoff_ms=None):
+    for key, value in (('attempts', attempts), ('backoff_ms', backoff_ms), ('max_backoff_ms', max_backoff_ms)):
+        if value is not None:
+            write_retry[key] = value
+
+
+def _is_busy_error(error):
+    while error is not None:
+        if isinstance(error, OperationalError) and (
+                'database is locked' in str(error) or 'database is busy' in str(error)):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+# Reruns a write function with jittered exponential backoff while it fails with a busy error.
+def _retry_on_busy(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return f(*args, **kwargs)
+            except (SQLAlchemyError, DatabaseError) as e:
+                # Inside a transaction() scope the earlier calls of the scope were rolled back too
+                if attempt >= write_retry['attempts'] or not _is_busy_error(e) or _transaction_scope() is not None:
+                    raise
+                db.session.rollback()
+                delay = min(write_retry['max_backoff_ms'], write_retry['backoff_ms'] * 2 ** attempt)
+                time.sleep(random.uniform(delay / 2, delay) / 1000)
+                attempt += 1
+
+    return decorated_function
+
+
+# Runs work() in a transaction() scope and returns its result. The write functions inside a scope
+# leave busy errors to it, so the whole scope is rerun with the backoff of _retry_on_busy; work()
+# must therefore have no effects other than its db_queries calls. Joining an enclosing scope, it
+# is not retried on its own.
+@_retry_on_busy
+def run_in_transaction(work):
+    with transaction():
+        return work()
+
+
+# Single rows and reference lists read over and over by the pages and edit forms. Entries are keyed
+# by the data versions of the tables they read, so the write functions of this process invalidate
+# them when they commit; the TTL bounds how long writes of other processes go unseen.
+# Configured from the `entity_cache` section of config.yml.
+entity_cache = ResultCache(max_entries=4096, ttl_seconds=60)
+
+
+# Default and maximum number of rows returned by one page of the list_* functions.
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+# Cursors are the sort value and id of the last row of a page, encoded as an opaque string.
+def encode_cursor(sort_value, id):
+    return base64.urlsafe_b64encode(json.dumps([sort_value, id]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        sort_value, id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return sort_value, int(id)
+    except (ValueError, TypeError):
+        raise DatabaseError("Invalid cursor")
+
+
+# Fetches one page of a list query using keyset pagination.
+#     Rows are ordered by (sort column, id) and a page starts right after the cursor row, so every
+#     page is a range scan over the sort column's index no matter how deep the client has paged.
+#     Nullable sort columns must be given as COALESCE(column, ''): NULL compares as neither before
+#     nor after a cursor, so a page ending on a NULL would end the list there.
+
+#     Args:
+#         select (str): SELECT ... FROM ... part of the query, without WHERE or ORDER BY.
+#         sort (str): Requested sort key, must be a key of sort_columns.
+#         sort_columns (dict): Maps allowed sort keys (also the row keys) to indexed SQL columns or
+#             expressions.
+#         id_column (str): SQL column of the row id, used as the tie breaker.
+#         conditions (list): SQL filter conditions joined with AND.
+#         params (dict): Bind parameters for the conditions.
+#         cursor (str): next_cursor of the previous page, or None for the first page.
+#         limit (int): Page size, capped at MAX_PAGE_SIZE.
+#         descending (bool): Sort direction.
+#         datetime_columns (tuple of str): Columns decoded to datetimes, see iter_records.
+
+#     Returns:
+#         dict: 'items' with the records of the page and 'next_cursor', None on the last page.
+
+#     Raises:
+#         DatabaseError: If the sort key or the cursor is invalid.
+def _list_page(select, sort, sort_columns, id_column, conditions, params, cursor, limit, descending,
+               datetime_columns=()):
+    if sort not in sort_columns:
+        raise DatabaseError(f"Cannot sort by {sort}")
+    sort_column = sort_columns[sort]
+    limit = max(1, min(int(limit or PAGE_SIZE), MAX_PAGE_SIZE))
+    conditions = list(conditions)
+    params = dict(params)
+    if cursor:
+        params['cursor_value'], params['cursor_id'] = decode_cursor(cursor)
+        comparison = '<' if descending else '>'
+        # The first condition alone lets SQLite seek an expression index to the cursor
+        conditions.append(f"{sort_column} {comparison}= :cursor_value")
+        conditions.append(f"({sort_column}, {id_column}) {comparison} (:cursor_value, :cursor_id)")
+    direction = 'DESC' if descending else 'ASC'
+    query = select
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += f' ORDER BY {sort_column} {direction}, {id_column} {direction} LIMIT :limit'
+    params['limit'] = limit + 1
+
+    result = db.session.execute(text(query), params)
+    rows = result.all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        # From the row as stored, the cursor is compared with the column's SQLite text
+        sort_value = rows[-1]._mapping[sort]
+        next_cursor = encode_cursor('' if sort_value is None else sort_value, rows[-1].id)
+    return {'items': decode_rows(result.keys(), rows, datetime_columns), 'next_cursor': next_cursor}
+
+
+# Adds a case-insensitive substring filter over the given columns to conditions and params.
+def _add_search_condition(search, columns, conditions, params):
+    if search:
+        conditions.append('(' + ' OR '.join(f"{column} LIKE :search" for column in columns) + ')')
+        params['search'] = f"%{search}%"
+
+
+# Restricts a datetime column to the days from_date to to_date (YYYY-MM-DD), both inclusive.
+def _add_date_range_condition(column, from_date, to_date, conditions, params):
+    try:
+        if from_date:
+            conditions.append(f'{column} >= :from_date')
+            params['from_date'] = datetime.strptime(from_date, '%Y-%m-%d').strftime('%Y-%m-%d')
+        if to_date:
+            conditions.append(f'{column} < :before_date')
+            params['before_date'] = (datetime.strptime(to_date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    except ValueError:
+        raise DatabaseError("Dates must be in YYYY-MM-DD format")
+
+
+# Cascading deletes. The schema declares no ON DELETE actions and SQLite does not enforce foreign keys
+# here, so the delete_* functions remove dependent rows themselves: one set-based DELETE per table,
+# all in the caller's transaction, so the cost grows with the rows removed and not with round trips.
+
+# Deletes the appointments matching `where` (SQL over the appointment table) with their
+# prescriptions and diagnostics, and returns the ids of the deleted appointments.
+def _delete_appointments_where(where, params):
+    for table in ('prescription', 'diagnostic'):
+        db.session.execute(text(f"""
+            DELETE FROM {table}
+            WHERE appointment_id IN (SELECT id FROM appointment WHERE {where})
+        """), params)
+    query = text(f"""
+        DELETE FROM appointment WHERE {where}
+        RETURNING id
+    """)
+    return db.session.execute(query, params).scalars().all()
+
+
+# Deletes the doctors matching `where` (SQL over the doctor table) with their addresses, appointments,
+# prescriptions and diagnostics. Their nurses stay on staff without a designated doctor.
+#     Returns the number of deleted doctors and the ids of the deleted appointments.
+def _delete_doctors_where(where, params):
+    doctor_ids = f"SELECT id FROM doctor WHERE {where}"
+    appointment_ids = _delete_appointments_where(f"doctor_id IN ({doctor_ids})", params)
+    db.session.execute(text(f"UPDATE nurse SET doctor_id = NULL WHERE doctor_id IN ({doctor_ids})"), params)
+    db.session.execute(text(f"DELETE FROM address WHERE id IN (SELECT address_id FROM doctor WHERE {where})"), params)
+    result = db.session.execute(text(f"DELETE FROM doctor WHERE {where}"), params)
+    return result.rowcount, appointment_ids
+
+
+# Removes deleted appointments from the interval index, once their transaction committed.
+def _forget_appointments(ids):
+    def forget():
+        for appointment_id in ids:
+            appointment_index.remove(appointment_id)
+
+    if appointment_index is not None:
+        _after_commit(forget)
+
+
+# Tables written by the cascading deletes, their cached results are invalidated on commit
+CASCADE_TABLES = ('appointment', 'prescription', 'diagnostic', 'address')
+
+
 # Get all doctors with their address and department details
 # Retrieves all doctors along with their associated department and address details.
     
 #     Returns:
-#         list of dict: A list of dictionaries where each dictionary contains details of a doctor, their department, and address.
+#         list of Record: Details of each doctor, their department, and address.
 def get_all_doctors_with_address_and_dept():
     query = text("""
         SELECT doctor.*, 
@@ -41,7 +399,42 @@ def get_all_doctors_with_address_and_dept():
         ORDER BY doctor.name
     """)
     result = db.session.execute(query)
-    return [row_to_dict(row) for row in result]
+    return decode_rows(result.keys(), result)
+
+
+# Lists one page of doctors with their address and department details.
+#     Args:
+#         search (str): Matches name, email, phone or department name.
+#         department_id (int): Only doctors of this department.
+#         sort (str): 'name' or 'email'.
+#         descending (bool): Sort direction.
+#         cursor (str): Cursor of the previous page.
+#         limit (int): Page size.
+
+#     Returns:
+#         dict: 'items' and 'next_cursor', see _list_page.
+def list_doctors(search=None, department_id=None, sort='name', descending=False, cursor=None, limit=PAGE_SIZE):
+    conditions, params = [], {}
+    _add_search_condition(search, ['doctor.name', 'doctor.email', 'doctor.phone', 'department.name'],
+                          conditions, params)
+    if department_id:
+        conditions.append('doctor.department_id = :department_id')
+        params['department_id'] = department_id
+    select = """
+        SELECT doctor.*,
+               department.name AS department_name,
+               address.street,
+               address.county,
+               address.city,
+               address.state,
+               address.country,
+               address.zipcode
+        FROM doctor
+        LEFT JOIN department ON doctor.department_id = department.id
+        LEFT JOIN address ON doctor.address_id = address.id
+    """
+    return _list_page(select, sort, {'name': 'doctor.name', 'email': 'doctor.email'}, 'doctor.id',
+                      conditions, params, cursor, limit, descending)
 
 
 # Get all doctors in a specific department by department ID
@@ -51,7 +444,7 @@ def get_all_doctors_with_address_and_dept():
 #         id (int): The ID of the department.
 
 #     Returns:
-#         list of dict: A list of dictionaries where each dictionary contains details of a doctor
+#         list of Record: Details of each doctor
 #                       in the specified department.
 def get_all_doctors_with_dept(id):
     query = text("""
@@ -61,13 +454,13 @@ def get_all_doctors_with_dept(id):
         ORDER BY doctor.name
     """)
     result = db.session.execute(query, {'id': id})
-    return [row_to_dict(row) for row in result]
+    return decode_rows(result.keys(), result)
 
 # Get all doctors without any additional details
 #   Retrieves all doctors without additional details.
     
 #     Returns:
-#         list of dict: A list of dictionaries where each dictionary contains details of a doctor.
+#         list of Record: Details of each doctor.
 def get_all_doctors():
     query = text("""
         SELECT *
@@ -75,7 +468,15 @@ def get_all_doctors():
         ORDER BY doctor.name
     """)
     result = db.session.execute(query)
-    return [row_to_dict(row) for row in result]
+    return decode_rows(result.keys(), result)
+
+# Ids and names of all doctors for the select boxes of the edit forms.
+#     Returns:
+#         tuple of Record: id and name of every doctor, ordered by name, frozen.
+@cached(entity_cache, ('doctor',))
+def get_doctor_options():
+    result = db.session.execute(text("SELECT id, name FROM doctor ORDER BY name"))
+    return _shared_rows(result.keys(), result)
 
 # Add a new doctor with address and other details
     # Adds a new doctor to the database with the provided details, including address.
@@ -88,6 +489,7 @@ def get_all_doctors():
     
     # Raises:
     #     DatabaseError: If there is an error adding the doctor or if the email already exists.
+@_retry_on_busy
 def add_doctor(data):
     try:
         query_check_email = text("""
@@ -117,10 +519,10 @@ def add_doctor(data):
         result_doctor = db.session.execute(query_doctor, data)
         doctor_id = result_doctor.fetchone()[0]
 
-        db.session.commit()
+        _commit('doctor', 'address')
         return doctor_id
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error adding doctor: {str(e)}")
 
 # Edit an existing doctor's details
@@ -132,6 +534,7 @@ def add_doctor(data):
 
 # Raises:
 #     DatabaseError: If there is an error updating the doctor or if the doctor does not exist.
+@_retry_on_busy
 def edit_doctor(id, data):
     try:
 
@@ -156,28 +559,36 @@ def edit_doctor(id, data):
         """)
         db.session.execute(query_address, data)
 
-        db.session.commit()
+        _commit('doctor', 'address')
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error editing doctor: {str(e)}")
 
 # Delete a doctor by ID
-#  Deletes a doctor from the database by their ID.
+#  Deletes a doctor from the database by their ID, with their address, appointments and the
+#  appointments' prescriptions and diagnostics, in one transaction. Their nurses are kept
+#  without a designated doctor.
 #     Args:
 #         id (int): The ID of the doctor to be deleted.
 
+#     Returns:
+#         int: The number of deleted appointments.
+
 #     Raises:
 #         DatabaseError: If there is an error deleting the doctor or if the doctor does not exist.
+@_retry_on_busy
 def delete_doctor(id):
     try:
-        query = text("""
-            DELETE FROM doctor WHERE id = :id
-        """)
-        db.session.execute(query, {'id': id})
+        deleted, appointment_ids = _delete_doctors_where('id = :id', {'id': id})
+        if deleted == 0:
+            _rollback()
+            raise DatabaseError(f"No doctor found with id {id}")
 
-        db.session.commit()
+        _commit('doctor', 'nurse', *CASCADE_TABLES)
+        _forget_appointments(appointment_ids)
+        return len(appointment_ids)
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error deleting doctor: {str(e)}")
 
 # Get a specific doctor's details by ID
@@ -187,10 +598,11 @@ def delete_doctor(id):
 #         id (int): The ID of the doctor to retrieve.
 
 #     Returns:
-#         dict: A dictionary containing the doctor's details and address.
+#         Record: The doctor's details and address, frozen.
 
 #     Raises:
 #         DatabaseError: If there is an error retrieving the doctor or if the doctor does not exist.
+@cached(entity_cache, ('doctor', 'address'))
 def get_doctor(id):
     try:
         query = text("""
@@ -204,7 +616,7 @@ def get_doctor(id):
         doctor = result.fetchone()
         if doctor is None:
             raise DatabaseError(f"No doctor found with id {id}")
-        return row_to_dict(doctor)
+        return _shared_row(result.keys(), doctor)
     except SQLAlchemyError as e:
         raise DatabaseError(f"Error retrieving doctor: {str(e)}")
 
@@ -213,7 +625,7 @@ def get_doctor(id):
 #   Retrieves all nurses with details.
 
 #     Returns:
-#         list of dict: A list of dictionaries where each dictionary contains details of a nurse.
+#         list of Record: Details of each nurse.
 def get_all_nurses():
     query = text("""
         SELECT n.*, 
@@ -230,7 +642,36 @@ def get_all_nurses():
         ORDER BY n.name
     """)
     result = db.session.execute(query)
-    return [row_to_dict(row) for row in result]
+    return decode_rows(result.keys(), result)
+
+# Lists one page of nurses with their address and designated doctor.
+#     Args:
+#         search (str): Matches name, email, phone or the doctor's name.
+#         sort (str): 'name' or 'email'.
+#         descending (bool): Sort direction.
+#         cursor (str): Cursor of the previous page.
+#         limit (int): Page size.
+
+#     Returns:
+#         dict: 'items' and 'next_cursor', see _list_page.
+def list_nurses(search=None, sort='name', descending=False, cursor=None, limit=PAGE_SIZE):
+    conditions, params = [], {}
+    _add_search_condition(search, ['n.name', 'n.email', 'n.phone', 'doctor.name'], conditions, params)
+    select = """
+        SELECT n.*,
+               doctor.name AS doctor_name,
+               address.street,
+               address.county,
+               address.city,
+               address.state,
+               address.country,
+               address.zipcode
+        FROM nurse n
+        LEFT JOIN doctor ON n.doctor_id = doctor.id
+        LEFT JOIN address ON n.address_id = address.id
+    """
+    return _list_page(select, sort, {'name': "COALESCE(n.name, '')", 'email': "COALESCE(n.email, '')"}, 'n.id',
+                      conditions, params, cursor, limit, descending)
 
 # Add a new nurse with address and other details
 # Adds a new nurse to the database with the provided details, including address.
@@ -243,6 +684,7 @@ def get_all_nurses():
 
 # Raises:
 #     DatabaseError: If there is an error adding the nurse or if the email already exists.
+@_retry_on_busy
 def add_nurse(data):
     try:
         query_check_email = text("""
@@ -271,10 +713,10 @@ def add_nurse(data):
         result_nurse = db.session.execute(query_nurse, data)
         nurse_id = result_nurse.fetchone()[0]
 
-        db.session.commit()
+        _commit('nurse', 'address')
         return nurse_id
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error adding nurse: {str(e)}")
 
 # Edit an existing nurse's details
@@ -286,6 +728,7 @@ def add_nurse(data):
 
 # Raises:
 #     DatabaseError: If there is an error updating the nurse or if the nurse does not exist.
+@_retry_on_busy
 def edit_nurse(id, data):
     try:
         query_doctor = text("""
@@ -306,9 +749,9 @@ def edit_nurse(id, data):
         """)
         db.session.execute(query_address, data)
 
-        db.session.commit()
+        _commit('nurse', 'address')
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error editing nurse: {str(e)}")
 
 # Delete a nurse by ID
@@ -318,6 +761,7 @@ def edit_nurse(id, data):
 
 #     Raises:
 #         DatabaseError: If there is an error deleting the nurse or if the nurse does not exist.
+@_retry_on_busy
 def delete_nurse(id):
     try:
         query = text("""
@@ -325,9 +769,9 @@ def delete_nurse(id):
         """)
         db.session.execute(query, {'id': id})
 
-        db.session.commit()
+        _commit('nurse')
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error deleting nurse: {str(e)}")
 
 # Get a specific nurse's details by ID
@@ -337,10 +781,11 @@ def delete_nurse(id):
 #         id (int): The ID of the nurse to retrieve.
 
 #     Returns:
-#         dict: A dictionary containing the nurse's details and address.
+#         Record: The nurse's details and address, frozen.
 
 #     Raises:
 #         DatabaseError: If there is an error retrieving the nurse or if the nurse does not exist.
+@cached(entity_cache, ('nurse', 'doctor', 'address'))
 def get_nurse(id):
     try:
         query = text("""
@@ -355,7 +800,7 @@ def get_nurse(id):
         nurse = result.fetchone()
         if nurse is None:
             raise DatabaseError(f"No nurse found with id {id}")
-        return row_to_dict(nurse)
+        return _shared_row(result.keys(), nurse)
     except SQLAlchemyError as e:
         raise DatabaseError(f"Error retrieving nurse: {str(e)}")
 
@@ -365,7 +810,7 @@ def get_nurse(id):
 # Retrieves all patients along with their address details.
     
 # Returns:
-#     list of dict: A list of dictionaries where each dictionary contains details of a patient
+#     list of Record: Details of each patient
 #                   and their address.
 def get_all_patients():
     query = text("""
@@ -381,7 +826,35 @@ def get_all_patients():
         ORDER BY patient.name
     """)
     result = db.session.execute(query)
-    return [row_to_dict(row) for row in result]
+    return decode_rows(result.keys(), result, ('dob',))
+
+# Lists one page of patients with their address details.
+#     Args:
+#         search (str): Matches name, email or phone.
+#         sort (str): 'name', 'dob' or 'email'.
+#         descending (bool): Sort direction.
+#         cursor (str): Cursor of the previous page.
+#         limit (int): Page size.
+
+#     Returns:
+#         dict: 'items' and 'next_cursor', see _list_page.
+def list_patients(search=None, sort='name', descending=False, cursor=None, limit=PAGE_SIZE):
+    conditions, params = [], {}
+    _add_search_condition(search, ['patient.name', 'patient.email', 'patient.phone'], conditions, params)
+    select = """
+        SELECT patient.*,
+               address.street,
+               address.county,
+               address.city,
+               address.state,
+               address.country,
+               address.zipcode
+        FROM patient
+        LEFT JOIN address ON patient.address_id = address.id
+    """
+    sort_columns = {'name': "COALESCE(patient.name, '')", 'dob': 'patient.dob', 'email': "COALESCE(patient.email, '')"}
+    return _list_page(select, sort, sort_columns, 'patient.id', conditions, params, cursor, limit, descending,
+                      ('dob',))
 
 # Add a new patient with address and other details
 #  Adds a new patient to the database with the provided details, including address.
@@ -394,6 +867,7 @@ def get_all_patients():
     
 #     Raises:
 #         DatabaseError: If there is an error adding the patient or if the email already exists.
+@_retry_on_busy
 def add_patient(data):
     try:
 
@@ -422,10 +896,10 @@ def add_patient(data):
         result_patient = db.session.execute(query_patient, data)
         patient_id = result_patient.fetchone()[0]
 
-        db.session.commit()
+        _commit('patient', 'address')
         return patient_id
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error adding patient: {str(e)}")
 
 # Edit an existing patient's details
@@ -437,6 +911,7 @@ def add_patient(data):
 
 #     Raises:
 #         DatabaseError: If there is an error updating the patient or if the patient does not exist.
+@_retry_on_busy
 def edit_patient(id, data):
     try:
 
@@ -459,34 +934,43 @@ def edit_patient(id, data):
         """)
         db.session.execute(query_address, data)
 
-        db.session.commit()
+        _commit('patient', 'address')
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error editing patient: {str(e)}")
 
 # Delete a patient by ID
 
-#     Deletes a patient from the database by their ID.
+#     Deletes a patient from the database by their ID, with their address, appointments and the
+#     appointments' prescriptions and diagnostics, in one transaction.
     
 #     Args:
 #         id (int): The ID of the patient to be deleted.
 
+#     Returns:
+#         int: The number of deleted appointments.
+
 #     Raises:
 #         DatabaseError: If there is an error deleting the patient or if the patient does not exist.
 
+@_retry_on_busy
 def delete_patient(id):
     try:
-        query = text("""
-            DELETE FROM patient WHERE id = :id
-        """)
-        result = db.session.execute(query, {'id': id})
+        params = {'id': id}
+        appointment_ids = _delete_appointments_where('patient_id = :id', params)
+        db.session.execute(text("DELETE FROM address WHERE id = (SELECT address_id FROM patient WHERE id = :id)"),
+                           params)
+        result = db.session.execute(text("DELETE FROM patient WHERE id = :id"), params)
 
         if result.rowcount == 0:
+            _rollback()
             raise DatabaseError(f"No patient found with id {id}")
 
-        db.session.commit()
+        _commit('patient', *CASCADE_TABLES)
+        _forget_appointments(appointment_ids)
+        return len(appointment_ids)
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error deleting patient: {str(e)}")
 
 
@@ -497,10 +981,11 @@ def delete_patient(id):
 #         id (int): The ID of the patient to retrieve.
 
 #     Returns:
-#         dict: A dictionary containing the patient's details and address.
+#         Record: The patient's details and address, frozen.
 
 #     Raises:
 #         DatabaseError: If there is an error retrieving the patient or if the patient does not exist.
+@cached(entity_cache, ('patient', 'address'))
 def get_patient(id):
     try:
         query = text("""
@@ -513,17 +998,18 @@ def get_patient(id):
         patient = result.fetchone()
         if patient is None:
             raise DatabaseError(f"No patient found with id {id}")
-        return row_to_dict(patient)
+        return _shared_row(result.keys(), patient)
     except SQLAlchemyError as e:
         raise DatabaseError(f"Error retrieving patient: {str(e)}")
 
 
 # Department Queries
 # Get all departments
+@cached(entity_cache, ('department',))
 def get_all_departments():
     query = text("SELECT * FROM department ORDER BY department.name")
     result = db.session.execute(query)
-    return [row_to_dict(row) for row in result]
+    return _shared_rows(result.keys(), result)
 
 # Add a new department
 # Adds a new department to the database if it does not already exist.
@@ -536,6 +1022,7 @@ def get_all_departments():
         
 # Raises:
 #     DatabaseError: If a department with the same name already exists or if there is an error adding the department.
+@_retry_on_busy
 def add_department(data):
     try:
 
@@ -556,10 +1043,10 @@ def add_department(data):
         result_department = db.session.execute(query_department, data)
         department_id = result_department.fetchone()[0]
 
-        db.session.commit()
+        _commit('department')
         return department_id
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error adding department: {str(e)}")
 
 # Edit an existing department's details
@@ -571,6 +1058,7 @@ def add_department(data):
         
 #     Raises:
 #         DatabaseError: If a department with the same name already exists or if there is an error editing the department.
+@_retry_on_busy
 def edit_department(id, data):
     try:
 
@@ -589,22 +1077,29 @@ def edit_department(id, data):
             WHERE id = :id
         """)
         data['id'] = id
-        db.session.execute(query_department, data)
+        result = db.session.execute(query_department, data)
+        if result.rowcount == 0:
+            raise DatabaseError(f"No department found with id {id}")
 
-        db.session.commit()
+        _commit('department')
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error editing department: {str(e)}")
 
 # Delete a department by ID
     
-    # Deletes a department from the database by its ID.
+    # Deletes a department from the database by its ID, with its doctors and everything deleting
+    # a doctor removes (see delete_doctor), in one transaction.
     
     # Args:
     #     id (int): The ID of the department to delete.
+
+    # Returns:
+    #     dict: The number of deleted 'doctors' and 'appointments'.
         
     # Raises:
     #     DatabaseError: If the department does not exist or if there is an error deleting the department.
+@_retry_on_busy
 def delete_department(id):
     try:
         query = text("""
@@ -613,11 +1108,15 @@ def delete_department(id):
         result = db.session.execute(query, {'id': id})
 
         if result.rowcount == 0:
+            _rollback()
             raise DatabaseError(f"No department found with id {id}")
 
-        db.session.commit()
+        doctors, appointment_ids = _delete_doctors_where('department_id = :id', {'id': id})
+        _commit('department', 'doctor', 'nurse', *CASCADE_TABLES)
+        _forget_appointments(appointment_ids)
+        return {'doctors': doctors, 'appointments': len(appointment_ids)}
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error deleting department: {str(e)}")
 
 # Get a specific department's details by ID
@@ -627,10 +1126,11 @@ def delete_department(id):
 #         id (int): The ID of the department to retrieve.
         
 #     Returns:
-#         dict: A dictionary containing the department's details.
+#         Record: The department's details, frozen.
         
 #     Raises:
 #         DatabaseError: If the department does not exist or if there is an error retrieving the department.
+@cached(entity_cache, ('department',))
 def get_department(id):
     try:
         query = text("""
@@ -642,7 +1142,7 @@ def get_department(id):
         department = result.fetchone()
         if department is None:
             raise DatabaseError(f"No department found with id {id}")
-        return row_to_dict(department)
+        return _shared_row(result.keys(), department)
     except SQLAlchemyError as e:
         raise DatabaseError(f"Error retrieving department: {str(e)}")
 
@@ -651,23 +1151,278 @@ def get_department(id):
 # Retrieves all appointments along with associated doctor and patient details.
     
 #     Returns:
-#         list: A list of dictionaries, each containing details of an appointment along with the doctor's and patient's names and IDs.
+#         list of Record: Details of each appointment along with the doctor's and patient's names.
 def get_all_appointments():
     query = text("""
-        SELECT appointment.*, 
+        SELECT appointment.*,
                doctor.name AS doctor_name,
-               doctor.id AS doctor_id,
-               patient.name AS patient_name,
-               patient.id AS patient_id
+               patient.name AS patient_name
         FROM appointment
         LEFT JOIN doctor ON appointment.doctor_id = doctor.id
         LEFT JOIN patient ON appointment.patient_id = patient.id
         ORDER BY appointment.from_time DESC
     """)
     result = db.session.execute(query)
-    return [row_to_dict(row) for row in result]
+    return decode_rows(result.keys(), result, ('from_time', 'to_time'))
+
+# Lists one page of appointments with the doctor's and patient's names.
+#     Args:
+#         search (str): Matches doctor name, patient name or notes.
+#         from_date (str): YYYY-MM-DD, only appointments starting on or after this day.
+#         to_date (str): YYYY-MM-DD, only appointments starting on or before this day.
+#         doctor_id (int): Only appointments of this doctor.
+#         patient_id (int): Only appointments of this patient.
+#         sort (str): 'from_time'.
+#         descending (bool): Sort direction, latest first by default.
+#         cursor (str): Cursor of the previous page.
+#         limit (int): Page size.
+
+#     Returns:
+#         dict: 'items' and 'next_cursor', see _list_page.
+
+#     Raises:
+#         DatabaseError: If a date is not in YYYY-MM-DD format, or the sort key or cursor is invalid.
+def list_appointments(search=None, from_date=None, to_date=None, doctor_id=None, patient_id=None,
+                      sort='from_time', descending=True, cursor=None, limit=PAGE_SIZE):
+    conditions, params = [], {}
+    _add_search_condition(search, ['doctor.name', 'patient.name', 'appointment.notes'], conditions, params)
+    _add_date_range_condition('appointment.from_time', from_date, to_date, conditions, params)
+    if doctor_id:
+        conditions.append('appointment.doctor_id = :doctor_id')
+        params['doctor_id'] = doctor_id
+    if patient_id:
+        conditions.append('appointment.patient_id = :patient_id')
+        params['patient_id'] = patient_id
+    select = """
+        SELECT appointment.*,
+               doctor.name AS doctor_name,
+               patient.name AS patient_name
+        FROM appointment
+        LEFT JOIN doctor ON appointment.doctor_id = doctor.id
+        LEFT JOIN patient ON appointment.patient_id = patient.id
+    """
+    return _list_page(select, sort, {'from_time': 'appointment.from_time'}, 'appointment.id',
+                      conditions, params, cursor, limit, descending, ('from_time', 'to_time'))
+
+
+# Optional in-process interval index used for conflict checks, see enable_appointment_index().
+appointment_index = None
+
+
+# Turns on the in-process AppointmentIntervalIndex for appointment conflict checks.
+#     The index is kept in sync by the appointment write functions in this module, so it is only
+#     safe when a single process writes to the database.
+def enable_appointment_index():
+    global appointment_index
+    appointment_index = AppointmentIntervalIndex(_load_doctor_intervals)
+
+
+def _load_doctor_intervals(doctor_id):
+    query = text("""
+        SELECT id, from_time, to_time
+        FROM appointment
+        WHERE doctor_id = :doctor_id
+    """)
+    result = db.session.execute(query, {'doctor_id': doctor_id})
+    return [(row.id, _to_datetime(row.from_time), _to_datetime(row.to_time)) for row in result]
+
+
+def _to_datetime(value):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+# Finds an appointment of the doctor that overlaps the given time range.
+#     Ranges are half-open, so an appointment ending at 10:30 does not conflict with one
+#     starting at 10:30. The query is answered from ix_appointment_doctor_interval, or from
+#     the in-process interval index when it is enabled.
+
+#     Args:
+#         doctor_id (int): The ID of the doctor.
+#         from_time (datetime): Start of the range.
+#         to_time (datetime): End of the range.
+#         exclude_id (int): An appointment to ignore, used when editing it. Defaults to None.
+
+#     Returns:
+#         int: The ID of a conflicting appointment, or None if the range is free.
+def find_conflicting_appointment(doctor_id, from_time, to_time, exclude_id=None):
+    if appointment_index is not None:
+        return appointment_index.find_conflict(doctor_id, from_time, to_time, exclude_id)
+    query = text("""
+        SELECT id
+        FROM appointment
+        WHERE doctor_id = :doctor_id
+        AND to_time > :from_time
+        AND from_time < :to_time
+        AND id IS NOT :exclude_id
+        LIMIT 1
+    """)
+    result = db.session.execute(query, {
+        'doctor_id': doctor_id,
+        'from_time': from_time,
+        'to_time': to_time,
+        'exclude_id': exclude_id
+    })
+    return result.scalar()
+
+
+# Free slot search defaults, and the largest date range and number of slots one search may return.
+FREE_SLOT_MINUTES = 30
+WORKING_HOURS = ('09:00', '17:00')
+FREE_SLOT_LIMIT = 50
+MAX_FREE_SLOT_LIMIT = 1000
+MAX_FREE_SLOT_DAYS = 31
+
+
+# Validates the arguments of a free slot search.
+#     Returns:
+#         tuple: The working windows as (open, close) datetimes, one per day from from_date to to_date
+#             (today and the 6 days after it by default), the slot length as a timedelta and the limit.
+def _free_slot_windows(from_date, to_date, slot_minutes, day_start, day_end, limit):
+    try:
+        first_day = datetime.strptime(from_date, '%Y-%m-%d') if from_date else \
+            datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        last_day = datetime.strptime(to_date, '%Y-%m-%d') if to_date else first_day + timedelta(days=6)
+        opens, closes = (datetime.strptime(value, '%H:%M') for value in (day_start, day_end))
+    except ValueError:
+        raise DatabaseError("Dates must be in YYYY-MM-DD format and working hours in HH:MM format")
+    if last_day < first_day or (last_day - first_day).days >= MAX_FREE_SLOT_DAYS:
+        raise DatabaseError(f"The date range must cover 1 to {MAX_FREE_SLOT_DAYS} days")
+    slot = timedelta(minutes=slot_minutes)
+    opens = timedelta(hours=opens.hour, minutes=opens.minute)
+    closes = timedelta(hours=closes.hour, minutes=closes.minute)
+    if slot_minutes <= 0 or closes - opens < slot:
+        raise DatabaseError("Working hours must be longer than one slot")
+    if limit <= 0:
+        raise DatabaseError("limit must be positive")
+    windows = [(first_day + timedelta(days=offset) + opens, first_day + timedelta(days=offset) + closes)
+               for offset in range((last_day - first_day).days + 1)]
+    return windows, slot, min(limit, MAX_FREE_SLOT_LIMIT)
+
+
+# Appointments of the doctors matching `where` (SQL over the doctor table) that overlap start..end, as
+# {doctor_id: [(from_time, to_time), ...]} sorted by from_time. One range scan of
+# ix_appointment_doctor_interval per doctor.
+def _busy_intervals(where, params, start, end):
+    query = text(f"""
+        SELECT doctor_id, from_time, to_time
+        FROM appointment
+        WHERE doctor_id IN (SELECT id FROM doctor WHERE {where})
+        AND to_time > :start
+        AND from_time < :end
+        ORDER BY doctor_id, from_time
+    """)
+    busy = {}
+    for doctor_id, from_time, to_time in db.session.execute(query, {**params, 'start': start, 'end': end}):
+        busy.setdefault(doctor_id, []).append((_to_datetime(from_time), _to_datetime(to_time)))
+    return busy
+
+
+# First slot start of the window's grid at or after `moment`.
+def _next_slot_start(window_open, moment, slot):
+    return window_open + -((window_open - moment) // slot) * slot
+
+
+# Yields the free slots of one doctor in time order, as (from_time, to_time).
+#     Slots lie on a grid of `slot` steps from each window's opening time and start no earlier than
+#     `not_before`. A single sweep over the busy intervals, sorted by start, skips to the first grid
+#     slot after the end of each run of busy intervals.
+def _sweep_free_slots(busy, windows, slot, not_before):
+    index = 0
+    busy_until = None
+    for window_open, window_close in windows:
+        start = _next_slot_start(window_open, max(window_open, not_before), slot)
+        while start + slot <= window_close:
+            # End of the busy intervals starting before this slot ends, the slot is taken if it is later than start
+            while index < len(busy) and busy[index][0] < start + slot:
+                busy_until = busy[index][1] if busy_until is None else max(busy_until, busy[index][1])
+                index += 1
+            if busy_until is not None and busy_until > start:
+                start = _next_slot_start(window_open, busy_until, slot)
+                continue
+            yield start, start + slot
+            start += slot
+
+
+# Finds the free appointment slots of a doctor.
+#     Args:
+#         doctor_id (int): The ID of the doctor.
+#         from_date (str): First day (YYYY-MM-DD), today by default.
+#         to_date (str): Last day (YYYY-MM-DD), inclusive, 6 days after from_date by default.
+#         slot_minutes (int): Length of a slot, slots start every slot_minutes from the opening time.
+#         day_start (str): Opening time (HH:MM) of every day.
+#         day_end (str): Closing time (HH:MM), the last slot ends by then.
+#         limit (int): Maximum number of slots returned, capped at MAX_FREE_SLOT_LIMIT.
+
+#     Returns:
+#         dict: 'doctor_id' and 'slots', the earliest free slots with their 'from_time' and 'to_time'.
+#             Slots in the past are left out.
+
+#     Raises:
+#         DatabaseError: If the doctor does not exist or the arguments are invalid.
+def find_free_slots(doctor_id, from_date=None, to_date=None, slot_minutes=FREE_SLOT_MINUTES,
+                    day_start=WORKING_HOURS[0], day_end=WORKING_HOURS[1], limit=FREE_SLOT_LIMIT):
+    windows, slot, limit = _free_slot_windows(from_date, to_date, slot_minutes, day_start, day_end, limit)
+    if db.session.execute(text("SELECT 1 FROM doctor WHERE id = :id"), {'id': doctor_id}).scalar() is None:
+        raise DatabaseError(f"No doctor found with id {doctor_id}")
+    busy = _busy_intervals('id = :doctor_id', {'doctor_id': doctor_id}, windows[0][0], windows[-1][1])
+    slots = islice(_sweep_free_slots(busy.get(doctor_id, []), windows, slot, datetime.now()), limit)
+    return {
+        'doctor_id': doctor_id,
+        'slots': [{'from_time': from_time.isoformat(), 'to_time': to_time.isoformat()} for from_time, to_time in slots]
+    }
+
+
+# Finds the earliest free appointment slots across all doctors of a department, e.g. limit=1 for the
+# first available slot. Takes the arguments of find_free_slots(). The sweeps of the doctors are merged
+# lazily, so only the slots returned are computed.
+#     Returns:
+#         dict: 'department_id' and 'slots' in time order, each with the 'doctor_id' and 'doctor_name'
+#             it is free for.
+
+#     Raises:
+#         DatabaseError: If the department does not exist or the arguments are invalid.
+def find_department_free_slots(department_id, from_date=None, to_date=None, slot_minutes=FREE_SLOT_MINUTES,
+                               day_start=WORKING_HOURS[0], day_end=WORKING_HOURS[1], limit=FREE_SLOT_LIMIT):
+    windows, slot, limit = _free_slot_windows(from_date, to_date, slot_minutes, day_start, day_end, limit)
+    if db.session.execute(text("SELECT 1 FROM department WHERE id = :id"), {'id': department_id}).scalar() is None:
+        raise DatabaseError(f"No department found with id {department_id}")
+    doctors = dict(db.session.execute(text("SELECT id, name FROM doctor WHERE department_id = :department_id"),
+                                      {'department_id': department_id}).fetchall())
+    busy = _busy_intervals('department_id = :department_id', {'department_id': department_id},
+                           windows[0][0], windows[-1][1])
+    now = datetime.now()
+
+    def doctor_slots(doctor_id):
+        for from_time, to_time in _sweep_free_slots(busy.get(doctor_id, []), windows, slot, now):
+            yield from_time, to_time, doctor_id
+
+    sweeps = [doctor_slots(doctor_id) for doctor_id in doctors]
+    return {
+        'department_id': department_id,
+        'slots': [
+            {'doctor_id': doctor_id, 'doctor_name': doctors[doctor_id], 'from_time': from_time.isoformat(),
+             'to_time': to_time.isoformat()}
+            for from_time, to_time, doctor_id in islice(heapq.merge(*sweeps), limit)
+        ]
+    }
+
+
+# Result of a booking rejected by the booking guard trigger (see models.booking_guard_ddl), which
+# catches overlaps the check above missed because another booking committed in between.
+# The trigger only undid the rejected statement: outside a transaction() scope the write transaction
+# it opened is ended, a scope may go on with other work.
+def _booking_conflict(error):
+    if BOOKING_CONFLICT not in str(error.orig):
+        return None
+    if _transaction_scope() is None:
+        db.session.rollback()
+    return {'success': False, 'message': BOOKING_CONFLICT}
 
 #  Adds a new appointment to the database after checking for conflicts.
+#     The check is repeated atomically by the booking guard trigger when the row is inserted, so
+#     concurrent bookings of the same slot cannot both succeed.
     
 #     Args:
 #         doctor_id (int): The ID of the doctor for the appointment.
@@ -681,28 +1436,12 @@ def get_all_appointments():
         
 #     Raises:
 #         DatabaseError: If there is an error adding the appointment or if a conflicting appointment exists.
+@_retry_on_busy
 def add_appointment(doctor_id, patient_id, from_time, to_time, notes):
     try:
         # Check for conflicting appointments
-        conflict_check_query = text("""
-        SELECT COUNT(*) 
-        FROM appointment 
-        WHERE doctor_id = :doctor_id 
-        AND (
-            (:from_time BETWEEN from_time AND to_time)
-            OR (:to_time BETWEEN from_time AND to_time)
-            OR (from_time BETWEEN :from_time AND :to_time)
-        )
-        """)
-
-        result = db.session.execute(conflict_check_query, {
-            'doctor_id': doctor_id,
-            'from_time': from_time,
-            'to_time': to_time
-        })
-
-        if result.scalar() > 0:
-            return {'success': False, 'message': 'Conflicting appointment exists'}
+        if find_conflicting_appointment(doctor_id, from_time, to_time) is not None:
+            return {'success': False, 'message': BOOKING_CONFLICT}
 
         # If no conflict, add the new appointment
         insert_query = text("""
@@ -720,9 +1459,17 @@ def add_appointment(doctor_id, patient_id, from_time, to_time, notes):
         })
 
         new_id = result.scalar()
-        db.session.commit()
+        _commit('appointment')
+        if appointment_index is not None:
+            _after_commit(partial(appointment_index.add, new_id, doctor_id, from_time, to_time))
 
         return {'success': True, 'id': new_id}
+    except IntegrityError as e:
+        conflict = _booking_conflict(e)
+        if conflict is None:
+            _rollback()
+            raise DatabaseError(f"Error adding an appointment: {str(e)}")
+        return conflict
     except SQLAlchemyError as e:
         raise DatabaseError(f"Error adding an appointment: {str(e)}")
 
@@ -741,30 +1488,12 @@ def add_appointment(doctor_id, patient_id, from_time, to_time, notes):
         
 #     Raises:
 #         DatabaseError: If there is an error editing the appointment or if a conflicting appointment exists.
+@_retry_on_busy
 def edit_appointment(appointment_id, doctor_id, patient_id, from_time, to_time, notes):
     try:
         # Check for conflicting appointments, excluding the current appointment
-        conflict_check_query = text("""
-        SELECT COUNT(*) 
-        FROM appointment 
-        WHERE doctor_id = :doctor_id 
-        AND id != :appointment_id
-        AND (
-            (:from_time BETWEEN from_time AND to_time)
-            OR (:to_time BETWEEN from_time AND to_time)
-            OR (from_time BETWEEN :from_time AND :to_time)
-        )
-        """)
-
-        result = db.session.execute(conflict_check_query, {
-            'doctor_id': doctor_id,
-            'appointment_id': appointment_id,
-            'from_time': from_time,
-            'to_time': to_time
-        })
-
-        if result.scalar() > 0:
-            return {'success': False, 'message': 'Conflicting appointment exists'}
+        if find_conflicting_appointment(doctor_id, from_time, to_time, appointment_id) is not None:
+            return {'success': False, 'message': BOOKING_CONFLICT}
 
         # If no conflict, update the appointment
         update_query = text("""
@@ -791,70 +1520,205 @@ def edit_appointment(appointment_id, doctor_id, patient_id, from_time, to_time,
         if updated_id is None:
             return {'success': False, 'message': 'Appointment not found'}
 
-        db.session.commit()
+        _commit('appointment')
+        if appointment_index is not None:
+            _after_commit(partial(appointment_index.add, updated_id, doctor_id, from_time, to_time))
 
         return {'success': True, 'id': updated_id}
+    except IntegrityError as e:
+        conflict = _booking_conflict(e)
+        if conflict is None:
+            _rollback()
+            raise DatabaseError(f"Error editing an appointment: {str(e)}")
+        return conflict
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error editing an appointment: {str(e)}")
 
-# Deletes an appointment from the database by its ID.
+# Longest appointment series one request may book.
+MAX_SERIES_OCCURRENCES = 200
+RECURRENCE_FREQUENCIES = {'daily': timedelta(days=1), 'weekly': timedelta(weeks=1)}
+SERIES_OVERLAP = 'Overlaps an earlier occurrence of the series'
+
+
+# Expands a recurrence rule into the (from_time, to_time) of its occurrences.
+#     Args:
+#         from_time (datetime): Start of the first occurrence.
+#         to_time (datetime): End of the first occurrence.
+#         frequency (str): 'daily' or 'weekly'.
+#         interval (int): Occurs every interval days or weeks.
+#         count (int): Number of occurrences.
+#         until (datetime): Last possible start, used when count is not given.
+
+#     Raises:
+#         DatabaseError: If the rule is invalid or has more than MAX_SERIES_OCCURRENCES occurrences.
+def recurring_slots(from_time, to_time, frequency='weekly', interval=1, count=None, until=None):
+    if frequency not in RECURRENCE_FREQUENCIES:
+        raise DatabaseError(f"frequency must be one of {', '.join(RECURRENCE_FREQUENCIES)}")
+    if interval < 1 or (count is None) == (until is None):
+        raise DatabaseError("A recurrence needs a positive interval and either count or until")
+    step = RECURRENCE_FREQUENCIES[frequency] * interval
+    if count is None:
+        count = (until - from_time) // step + 1 if until >= from_time else 0
+    if not 0 < count <= MAX_SERIES_OCCURRENCES:
+        raise DatabaseError(f"A series must have 1 to {MAX_SERIES_OCCURRENCES} occurrences")
+    return [(from_time + step * occurrence, to_time + step * occurrence) for occurrence in range(count)]
+
+
+# Merges intervals sorted by start into disjoint busy blocks.
+def _merge_intervals(intervals):
+    blocks = []
+    for from_time, to_time in intervals:
+        if blocks and from_time < blocks[-1][1]:
+            blocks[-1][1] = max(blocks[-1][1], to_time)
+        else:
+            blocks.append([from_time, to_time])
+    return blocks
+
+
+#  Books a series of appointments for one doctor and patient, e.g. the occurrences of recurring_slots().
+#     All proposed slots are checked with one range read of the doctor's appointments over the
+#     series and one sorted merge against them. Slots that overlap an existing appointment or an
+#     earlier slot of the series are skipped, the others are inserted with their empty prescriptions
+#     in one transaction. The booking guard trigger still rejects slots booked concurrently.
+
+#     Args:
+#         doctor_id (int): The ID of the doctor.
+#         patient_id (int): The ID of the patient.
+#         slots (list of tuple): (from_time, to_time) datetimes of the occurrences.
+#         notes (str): Notes of every appointment.
+
+#     Returns:
+#         dict: 'booked' with the 'id', 'from_time' and 'to_time' of each new appointment and
+#             'conflicts' with the 'from_time', 'to_time' and 'message' of each skipped slot.
+
+#     Raises:
+#         DatabaseError: If a slot is invalid, there are too many, or there is an error adding them.
+@_retry_on_busy
+def add_appointment_series(doctor_id, patient_id, slots, notes):
+    if not 0 < len(slots) <= MAX_SERIES_OCCURRENCES:
+        raise DatabaseError(f"A series must have 1 to {MAX_SERIES_OCCURRENCES} occurrences")
+    if any(to_time <= from_time for from_time, to_time in slots):
+        raise DatabaseError("Every slot must end after it starts")
+    proposed = sorted(slots)
+    try:
+        busy = _merge_intervals(_busy_intervals('id = :doctor_id', {'doctor_id': doctor_id}, proposed[0][0],
+                                                max(to_time for _, to_time in proposed)).get(doctor_id, []))
+        accepted, conflicts = [], []
+        index = 0
+        series_until = None
+        for from_time, to_time in proposed:
+            while index < len(busy) and busy[index][1] <= from_time:
+                index += 1
+            if index < len(busy) and busy[index][0] < to_time:
+                conflicts.append((from_time, to_time, BOOKING_CONFLICT))
+            elif series_until is not None and from_time < series_until:
+                conflicts.append((from_time, to_time, SERIES_OVERLAP))
+            else:
+                accepted.append((from_time, to_time))
+                series_until = to_time
+
+        insert_query = text("""
+        INSERT INTO appointment (doctor_id, patient_id, from_time, to_time, notes)
+        VALUES (:doctor_id, :patient_id, :from_time, :to_time, :notes)
+        RETURNING id
+        """)
+        booked = []
+        for from_time, to_time in accepted:
+            try:
+                booked.append((db.session.execute(insert_query, {
+                    'doctor_id': doctor_id,
+                    'patient_id': patient_id,
+                    'from_time': from_time,
+                    'to_time': to_time,
+                    'notes': notes
+                }).scalar(), from_time, to_time))
+            except IntegrityError as e:
+                # Booked by someone else since the range read, only this insert was undone
+                if BOOKING_CONFLICT not in str(e.orig):
+                    raise
+                conflicts.append((from_time, to_time, BOOKING_CONFLICT))
+        if booked:
+            db.session.execute(text("""
+                INSERT INTO prescription (appointment_id, prescription_notes)
+                VALUES (:appointment_id, '')
+            """), [{'appointment_id': id} for id, _, _ in booked])
+            _commit('appointment', 'prescription')
+        elif _transaction_scope() is None:
+            # Ends the write transaction opened by inserts the booking guard rejected
+            db.session.rollback()
+        if appointment_index is not None:
+            for id, from_time, to_time in booked:
+                _after_commit(partial(appointment_index.add, id, doctor_id, from_time, to_time))
+
+        return {
+            'booked': [{'id': id, 'from_time': from_time.isoformat(), 'to_time': to_time.isoformat()}
+                       for id, from_time, to_time in booked],
+            'conflicts': [{'from_time': from_time.isoformat(), 'to_time': to_time.isoformat(), 'message': message}
+                          for from_time, to_time, message in sorted(conflicts)]
+        }
+    except SQLAlchemyError as e:
+        _rollback()
+        raise DatabaseError(f"Error adding an appointment series: {str(e)}")
+
+# Deletes an appointment from the database by its ID, with its prescription and diagnostics.
     
 #     Args:
 #         id (int): The ID of the appointment to delete.
         
 #     Raises:
 #         DatabaseError: If the appointment does not exist or if there is an error deleting the appointment.
+@_retry_on_busy
 def delete_appointment(id):
     try:
-        query = text("""
-            DELETE FROM appointment WHERE id = :id
-        """)
-        result = db.session.execute(query, {'id': id})
+        deleted_ids = _delete_appointments_where('id = :id', {'id': id})
 
-        if result.rowcount == 0:
+        if not deleted_ids:
+            _rollback()
             raise DatabaseError(f"No appointment found with id {id}")
 
-        db.session.commit()
+        _commit('appointment', 'prescription', 'diagnostic')
+        _forget_appointments(deleted_ids)
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error deleting appointment: {str(e)}")
 
-#  Deletes all appointments associated with a specific doctor by their ID.
+#  Deletes all appointments associated with a specific doctor by their ID, with their
+#  prescriptions and diagnostics.
     
 #     Args:
 #         id (int): The ID of the doctor whose appointments are to be deleted.
         
 #     Raises:
 #         DatabaseError: If there is an error deleting the appointments.
+@_retry_on_busy
 def delete_appointments_for_doctor(id):
     try:
-        query = text("""
-            DELETE FROM appointment WHERE doctor_id = :id
-        """)
-        db.session.execute(query, {'id': id})
+        _delete_appointments_where('doctor_id = :id', {'id': id})
 
-        db.session.commit()
+        _commit('appointment', 'prescription', 'diagnostic')
+        if appointment_index is not None:
+            _after_commit(partial(appointment_index.discard_doctor, id))
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error deleting appointment: {str(e)}")
 
-#   Deletes all appointments associated with a specific patient by their ID.
+#   Deletes all appointments associated with a specific patient by their ID, with their
+#   prescriptions and diagnostics.
     
 #     Args:
 #         id (int): The ID of the patient whose appointments are to be deleted.
         
 #     Raises:
 #         DatabaseError: If there is an error deleting the appointments.
+@_retry_on_busy
 def delete_appointments_for_patient(id):
     try:
-        query = text("""
-            DELETE FROM appointment WHERE patient_id = :id
-        """)
-        db.session.execute(query, {'id': id})
-        db.session.commit()
+        deleted_ids = _delete_appointments_where('patient_id = :id', {'id': id})
+        _commit('appointment', 'prescription', 'diagnostic')
+        _forget_appointments(deleted_ids)
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error deleting appointment: {str(e)}")
 
 #   Retrieves the details of a specific appointment by its ID.
@@ -870,8 +1734,10 @@ def delete_appointments_for_patient(id):
 def get_appointment(id):
     try:
         query = text("""
-            SELECT*
+            SELECT appointment.*, doctor.name AS doctor_name, patient.name AS patient_name
             FROM appointment
+            LEFT JOIN doctor ON doctor.id = appointment.doctor_id
+            LEFT JOIN patient ON patient.id = appointment.patient_id
             WHERE appointment.id = :id
         """)
         result = db.session.execute(query, {'id': id})
@@ -894,6 +1760,7 @@ def get_appointment(id):
 
 #     Raises:
 #         DatabaseError: If there is an error adding the prescription
+@_retry_on_busy
 def add_prescription(id):
     try:
         prescription_notes = ''
@@ -909,10 +1776,10 @@ def add_prescription(id):
         result_prescription = db.session.execute(query_prescription, data)
         prescription_id = result_prescription.fetchone()[0]
 
-        db.session.commit()
+        _commit('prescription')
         return prescription_id
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error adding prescription: {str(e)}")
 
 # Edit an existing prescription's details for appointment ID
@@ -924,6 +1791,7 @@ def add_prescription(id):
 
 #     Raises:
 #         DatabaseError: If there is an error updating the prescription or if the prescription does not exist.
+@_retry_on_busy
 def edit_prescription_by_appointment_id(id, prescription_notes):
     try:
         data = {
@@ -937,10 +1805,10 @@ def edit_prescription_by_appointment_id(id, prescription_notes):
         """)
         db.session.execute(query_prescription, data)
 
-        db.session.commit()
+        _commit('prescription')
         return {'success': True}
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error editing prescription: {str(e)}")
 
 # Delete a prescription by appointment ID
@@ -953,6 +1821,7 @@ def edit_prescription_by_appointment_id(id, prescription_notes):
 #     Raises:
 #         DatabaseError: If there is an error deleting the prescription or if the prescription does not exist.
 
+@_retry_on_busy
 def delete_prescription_by_appointment_id(id):
     try:
         query = text("""
@@ -963,9 +1832,9 @@ def delete_prescription_by_appointment_id(id):
         if result.rowcount == 0:
             raise DatabaseError(f"No prescription found with id {id}")
 
-        db.session.commit()
+        _commit('prescription')
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error deleting prescription: {str(e)}")
 
 
@@ -1009,6 +1878,7 @@ def get_prescription_by_appointment_id(id):
 
 #     Raises:
 #         DatabaseError: If there is an error adding the diagnostic
+@_retry_on_busy
 def add_diagnostic(id, data):
     try:
         print(data)
@@ -1025,10 +1895,10 @@ def add_diagnostic(id, data):
         result_diagnostic = db.session.execute(query_diagnostic, diagnostic_input)
         diagnostic_id = result_diagnostic.fetchone()[0]
 
-        db.session.commit()
+        _commit('diagnostic')
         return {'success': True, 'id': diagnostic_id}
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error adding diagnostic: {str(e)}")
 
 
@@ -1042,6 +1912,7 @@ def add_diagnostic(id, data):
 #     Raises:
 #         DatabaseError: If there is an error deleting the diagnostic or if the diagnostic does not exist.
 
+@_retry_on_busy
 def delete_diagnostic(id):
     try:
         query = text("""
@@ -1052,9 +1923,9 @@ def delete_diagnostic(id):
         if result.rowcount == 0:
             raise DatabaseError(f"No diagnostic found with id {id}")
 
-        db.session.commit()
+        _commit('diagnostic')
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error deleting diagnostic: {str(e)}")
 
 
@@ -1069,6 +1940,7 @@ def delete_diagnostic(id):
 #     Raises:
 #         DatabaseError: If there is an error deleting the diagnostic or if the diagnostic does not exist.
 
+@_retry_on_busy
 def delete_diagnostic_by_appointment_id(id):
     try:
         query = text("""
@@ -1079,9 +1951,9 @@ def delete_diagnostic_by_appointment_id(id):
         if result.rowcount == 0:
             raise DatabaseError(f"No diagnostic found with id {id}")
 
-        db.session.commit()
+        _commit('diagnostic')
     except SQLAlchemyError as e:
-        db.session.rollback()
+        _rollback()
         raise DatabaseError(f"Error deleting diagnostic: {str(e)}")
 
 
@@ -1139,7 +2011,7 @@ def get_diagnostic_by_appointment_id(id):
 #     Args:
 #         username (str): The username of the new user.
 #         password (str): The plain text password for the new user.
-#         bcrypt: The bcrypt object used for hashing passwords.
+#         hasher (PasswordHasher): Hashes the password, see password_hashing.py.
 #         is_admin (bool): Whether the user is an admin. Defaults to False.
 
 #     Returns:
@@ -1148,14 +2020,68 @@ def get_diagnostic_by_appointment_id(id):
 #     Raises:
 #         DatabaseError: If there is an error adding the user to the database.
     
-def add_user(username, password, bcrypt, is_admin=False):
-    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+@_retry_on_busy
+def add_user(username, password, hasher, is_admin=False):
+    hashed_password = hasher.hash(password)
     user = User(username=username, password=hashed_password, is_admin=is_admin)
     db.session.add(user)
-    db.session.commit()
+    # Assigns the id, which _commit() does not inside a transaction() scope
+    db.session.flush()
+    _commit('user')
     return user.id
 
 
+# Adds many users whose passwords were already hashed, in one transaction.
+#     Args:
+#         users (list of dict): username, password (the bcrypt hash) and is_admin of each user.
+
+#     Returns:
+#         list of int: The ids of the new users, in the order of users.
+
+#     Raises:
+#         DatabaseError: If a username is taken or there is an error adding the users, none are added.
+@_retry_on_busy
+def add_users(users):
+    try:
+        ids = []
+        for user in users:
+            result = db.session.execute(text("""
+                INSERT INTO user (username, password, is_admin) VALUES (:username, :password, :is_admin)
+            """), {'username': user['username'], 'password': user['password'], 'is_admin': bool(user.get('is_admin'))})
+            ids.append(result.lastrowid)
+        _commit('user')
+        return ids
+    except IntegrityError:
+        _rollback()
+        raise DatabaseError("A username is already taken")
+    except SQLAlchemyError as e:
+        _rollback()
+        raise DatabaseError(f"Error adding users: {str(e)}")
+
+
+# Usernames of the given ones that already exist.
+def get_existing_usernames(usernames):
+    if not usernames:
+        return set()
+    query = text("SELECT username FROM user WHERE username IN :usernames").bindparams(
+        bindparam('usernames', expanding=True))
+    return {row.username for row in db.session.execute(query, {'usernames': list(usernames)})}
+
+
+# Replaces the password hash of a user, e.g. with one of the current bcrypt cost after a login.
+#     Raises:
+#         DatabaseError: If there is an error updating the user.
+@_retry_on_busy
+def set_user_password(id, hashed_password):
+    try:
+        db.session.execute(text("UPDATE user SET password = :password WHERE id = :id"),
+                           {'id': id, 'password': hashed_password})
+        _commit('user')
+    except SQLAlchemyError as e:
+        _rollback()
+        raise DatabaseError(f"Error updating password: {str(e)}")
+
+
 # Retrieves a user from the database by their username.
 
 # Args:
@@ -1184,11 +2110,12 @@ def get_user_by_id(id):
 #     Raises:
 #         DatabaseError: If no user is found with the given ID or if there is an error deleting the user.
     
+@_retry_on_busy
 def delete_user(user_id):
     user = User.query.get(user_id)
     if user:
         db.session.delete(user)
-        db.session.commit()
+        _commit('user')
     else:
         raise DatabaseError("No user found with the given ID")
 
@@ -1200,113 +2127,181 @@ def delete_user(user_id):
 def get_all_users():
     return User.query.all()
 
+# Results of the dashboard analytics functions below, invalidated by writes to ANALYTICS_TABLES.
+ANALYTICS_TABLES = ('appointment', 'patient', 'doctor', 'department', 'diagnostic')
+analytics_cache = ResultCache()
+
+
 # Counts the number of patients per doctor.
+#     Reads the per-doctor rows of appointment_rollup, see models.ROLLUP_BUCKETS.
 
 #     Returns:
-#         list: A list of dictionaries with doctor ID, name, and patient count.
+#         tuple: Frozen records with doctor ID, name, and patient count, shared by all callers.
+@cached(analytics_cache, ANALYTICS_TABLES)
 def count_patients_per_doctor():
     query = text("""
         SELECT 
             doctor.id AS doctor_id, 
             doctor.name AS doctor_name,
-            COUNT(DISTINCT patient.id) AS patient_count
+            COALESCE(rollup.patient_count, 0) AS patient_count
         FROM 
             doctor
         LEFT JOIN 
-            appointment ON doctor.id = appointment.doctor_id
-        LEFT JOIN 
-            patient ON appointment.patient_id = patient.id
-        GROUP BY 
-            doctor.id, doctor.name
+            appointment_rollup rollup
+            ON rollup.bucket = 'doctor' AND rollup.period = '' AND rollup.doctor_id = doctor.id
         ORDER BY 
             doctor.id
     """)
     result = db.session.execute(query)
-    return [row_to_dict(row) for row in result]
+    return _shared_rows(result.keys(), result)
 
 # Counts the number of patients per department.
+#     Sums the per-doctor appointment counts of appointment_rollup over each department's doctors.
 
 #     Returns:
-#         list: A list of dictionaries with department name and patient count.
+#         tuple: Frozen records with department name and patient count, shared by all callers.
 
 #     Raises:
 #         DatabaseError: If there is an error retrieving the data.
+@cached(analytics_cache, ANALYTICS_TABLES)
 def count_patients_per_department():
     try:
         query = text("""
-        SELECT d.name AS department_name, COUNT(p.id) AS patient_count
+        SELECT d.name AS department_name, COALESCE(SUM(rollup.appointment_count), 0) AS patient_count
         FROM Department d
         LEFT JOIN Doctor doc ON d.id = doc.department_id
-        LEFT JOIN Appointment a ON doc.id = a.doctor_id
-        LEFT JOIN Patient p ON a.patient_id = p.id
+        LEFT JOIN appointment_rollup rollup
+            ON rollup.bucket = 'doctor' AND rollup.period = '' AND rollup.doctor_id = doc.id
         GROUP BY d.name
         """)
         result = db.session.execute(query)
-        rows = result.mappings().all()
-        
-        data = [{'department_name': row['department_name'], 'patient_count': row['patient_count']} for row in rows]
-        return data
+        return _shared_rows(result.keys(), result)
     except Exception as e:
         raise DatabaseError(f"An error occurred: {e}")
 
+
+# Reads the distinct patient count per period of a time bucket ('day', 'month' or 'year') from appointment_rollup.
+def _count_patients_per_period(bucket):
+    query = text("""
+    SELECT period AS date, patient_count
+    FROM appointment_rollup
+    WHERE bucket = :bucket AND doctor_id = 0
+    ORDER BY period
+    """)
+    result = db.session.execute(query, {'bucket': bucket})
+    return _shared_rows(result.keys(), result)
+
 # Counts the number of patients on a daily basis.
 
 #     Returns:
-#         list: A list of dictionaries with date and patient count.
+#         tuple: Frozen records with date and patient count, shared by all callers.
+@cached(analytics_cache, ANALYTICS_TABLES)
 def count_patients_daily():
-    query = text("""
-    SELECT DATE(a.from_time) AS date, COUNT(DISTINCT p.id) AS patient_count
-    FROM Appointment a
-    JOIN Patient p ON a.patient_id = p.id
-    GROUP BY DATE(a.from_time)
-    ORDER BY DATE(a.from_time)
-    """)
-    result = db.session.execute(query)
-    rows = result.mappings().all()
-    return [{'date': row['date'], 'patient_count': row['patient_count']} for row in rows]
+    return _count_patients_per_period('day')
 
 # Counts the number of patients on a monthly basis.
 
 #     Returns:
-#         list: A list of dictionaries with month and year, and patient count.
+#         tuple: Frozen records with month and year, and patient count, shared by all callers.
+@cached(analytics_cache, ANALYTICS_TABLES)
 def count_patients_monthly():
-    query = text("""
-    SELECT strftime('%Y-%m', a.from_time) AS date, COUNT(DISTINCT p.id) AS patient_count
-    FROM Appointment a
-    JOIN Patient p ON a.patient_id = p.id
-    GROUP BY strftime('%Y-%m', a.from_time)
-    ORDER BY strftime('%Y-%m', a.from_time)
-    """)
-    result = db.session.execute(query)
-    rows = result.mappings().all()
-    return [{'date': row['date'], 'patient_count': row['patient_count']} for row in rows]
+    return _count_patients_per_period('month')
 
 # Counts the number of patients on a yearly basis.
 
 #     Returns:
-#         list: A list of dictionaries with year and patient count.
+#         tuple: Frozen records with year and patient count, shared by all callers.
 
+@cached(analytics_cache, ANALYTICS_TABLES)
 def count_patients_yearly():
-    query = text("""
-    SELECT strftime('%Y', a.from_time) AS date, COUNT(DISTINCT p.id) AS patient_count
-    FROM Appointment a
-    JOIN Patient p ON a.patient_id = p.id
-    GROUP BY strftime('%Y', a.from_time)
-    ORDER BY strftime('%Y', a.from_time)
-    """)
-    result = db.session.execute(query)
-    rows = result.mappings().all()
-    return [{'date': row['date'], 'patient_count': row['patient_count']} for row in rows]
+    return _count_patients_per_period('year')
+
+
+# Loads the analytics input rows of every appointment for the AnalyticsEngine.
+#     Returns:
+#         tuple: The latest appointment_change_log sequence number, the column names, and the rows
+#                (id, patient_id, diagnostic_count).
+def get_analytics_snapshot():
+    seq = db.session.execute(text("SELECT COALESCE(MAX(seq), 0) FROM appointment_change_log")).scalar()
+    result = db.session.execute(text("""
+        SELECT a.id, a.patient_id, COALESCE(d.diagnostic_count, 0) AS diagnostic_count
+        FROM appointment a
+        LEFT JOIN (
+            SELECT appointment_id, COUNT(*) AS diagnostic_count FROM diagnostic GROUP BY appointment_id
+        ) d ON d.appointment_id = a.id
+    """))
+    return seq, list(result.keys()), result.fetchall()
+
+
+# Loads the current analytics input rows of appointments changed after a change log sequence number.
+#     Deleted appointments come back with a NULL patient_id.
+
+#     Args:
+#         seq (int): Sequence number returned by the previous snapshot or change load.
+
+#     Returns:
+#         tuple: The column names and the rows (id, patient_id, diagnostic_count, seq, first_seq),
+#                where first_seq is the oldest sequence number still in the log.
+def get_analytics_changes(seq):
+    result = db.session.execute(text("""
+        SELECT changed.appointment_id AS id, a.patient_id,
+               (SELECT COUNT(*) FROM diagnostic d WHERE d.appointment_id = changed.appointment_id) AS diagnostic_count,
+               changed.seq,
+               (SELECT MIN(seq) FROM appointment_change_log) AS first_seq
+        FROM (
+            SELECT appointment_id, MAX(seq) AS seq
+            FROM appointment_change_log
+            WHERE seq > :seq
+            GROUP BY appointment_id
+        ) changed
+        LEFT JOIN appointment a ON a.id = changed.appointment_id
+    """), {'seq': seq})
+    return list(result.keys()), result.fetchall()
+
+
+# Loads every row of appointment_rollup for the AnalyticsEngine.
+#     Returns:
+#         tuple: The column names and the rows (bucket, period, doctor_id, patient_count, appointment_count).
+def get_analytics_rollups():
+    result = db.session.execute(text("""
+        SELECT bucket, period, doctor_id, patient_count, appointment_count FROM appointment_rollup
+    """))
+    return list(result.keys()), result.fetchall()
+
+
+# Loads the doctor, department and patient dimensions of the analytics engine.
+#     Returns:
+#         tuple: Rows (id, name, department_id) of all doctors, rows (id, name) of all departments
+#                and rows (id, name) of all patients.
+def get_analytics_dimensions():
+    doctors = db.session.execute(text("SELECT id, name, department_id FROM doctor ORDER BY id")).fetchall()
+    departments = db.session.execute(text("SELECT id, name FROM department ORDER BY name")).fetchall()
+    patients = db.session.execute(text("SELECT id, name FROM patient")).fetchall()
+    return doctors, departments, patients
+
+
+# Recomputes the dashboard rollup tables from the appointment table.
+#     Raises:
+#         DatabaseError: If there is an error rebuilding the rollups.
+@_retry_on_busy
+def rebuild_rollups():
+    try:
+        populate_rollups()
+        data_versions.bump('appointment')
+    except SQLAlchemyError as e:
+        _rollback()
+        raise DatabaseError(f"Error rebuilding rollups: {str(e)}")
 
 
 
 # Counts the number of diagnostics per patient and return top ones.
 #
 # Returns:
-#     list: A list of dictionaries with patient name and diagnostics count.
+#     tuple: Frozen records with patient name and diagnostics count, shared by all callers.
 #
 # Raises:
 #     DatabaseError: If there is an error retrieving the data.
+@cached(analytics_cache, ANALYTICS_TABLES)
 def count_top_diagnostics_per_patient(count):
     try:
         query = text("""
@@ -1319,10 +2314,403 @@ def count_top_diagnostics_per_patient(count):
         LIMIT :count
         """)
         result = db.session.execute(query, {'count': count})
-        rows = result.mappings().all()
-
-        data = [{'patient_name': row['patient_name'], 'diagnostics_count': row['diagnostics_count']} for row in rows]
-        return data
+        return _shared_rows(result.keys(), result)
     except Exception as e:
         raise DatabaseError(f"An error occurred: {e}")
 
+
+SEARCH_ENTITIES = {code: table for table, (code, _, _, _) in SEARCH_SOURCES.items()}
+_SNIPPET_START, _SNIPPET_END = '\x02', '\x03'
+
+
+# Turns free text typed by a user into an FTS5 query: every word must match as a prefix,
+# and FTS5 operators typed by the user are treated as plain text.
+def _fts_query(search):
+    words = re.findall(r"\w+", search)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+# Full-text search over patients, doctors, nurses, appointment notes, prescriptions and diagnostics.
+#     Args:
+#         search (str): Words to look for, each word matches as a prefix.
+#         entity (str): Restrict hits to one of SEARCH_SOURCES, e.g. 'patient'. Defaults to all.
+#         limit (int): Maximum number of hits.
+
+#     Returns:
+#         list of dict: Hits ordered by relevance with entity, id, title, an HTML snippet where
+#                       matches are wrapped in <mark>, and appointment details for clinical notes.
+
+#     Raises:
+#         DatabaseError: If the entity is unknown or there is an error running the search.
+def search(search, entity=None, limit=20):
+    match = _fts_query(search or '')
+    if not match:
+        return []
+    params = {'match': match, 'limit': max(1, min(int(limit), MAX_PAGE_SIZE)), 'stride': SEARCH_ROWID_STRIDE}
+    entity_condition = ''
+    if entity:
+        if entity not in SEARCH_SOURCES:
+            raise DatabaseError(f"Cannot search {entity}")
+        entity_condition = 'AND search_index.rowid % :stride = :code'
+        params['code'] = SEARCH_SOURCES[entity][0]
+    try:
+        query = text(f"""
+            SELECT search_index.rowid AS rowid,
+                   search_index.title,
+                   search_index.appointment_id,
+                   snippet(search_index, -1, '{_SNIPPET_START}', '{_SNIPPET_END}', '...', 12) AS snippet,
+                   appointment.from_time,
+                   doctor.name AS doctor_name,
+                   patient.name AS patient_name
+            FROM search_index
+            LEFT JOIN appointment ON appointment.id = search_index.appointment_id
+            LEFT JOIN doctor ON doctor.id = appointment.doctor_id
+            LEFT JOIN patient ON patient.id = appointment.patient_id
+            WHERE search_index MATCH :match {entity_condition}
+            ORDER BY bm25(search_index, 5.0, 1.0)
+            LIMIT :limit
+        """)
+        hits = []
+        for row in db.session.execute(query, params):
+            hit = row_to_dict(row)
+            rowid = hit.pop('rowid')
+            hit['entity'] = SEARCH_ENTITIES[rowid % SEARCH_ROWID_STRIDE]
+            hit['id'] = rowid // SEARCH_ROWID_STRIDE
+            hit['snippet'] = html.escape(hit['snippet']).replace(_SNIPPET_START, '<mark>').replace(_SNIPPET_END, '</mark>')
+            hits.append(hit)
+        return hits
+    except SQLAlchemyError as e:
+        raise DatabaseError(f"Error searching: {str(e)}")
+
+
+# Default and maximum number of entities returned by the typeahead functions.
+TYPEAHEAD_LIMIT = 10
+MAX_TYPEAHEAD_LIMIT = 50
+# Columns matched by prefix, in the order their matches are listed. Each has a NOCASE index (models.py).
+TYPEAHEAD_COLUMNS = ('name', 'email', 'phone')
+
+
+# Entities of a table whose name, email or phone starts with prefix, ignoring case.
+#     Each column is matched by its own LIMITed range scan over its NOCASE index, so the cost is bounded
+#     by the limit and not by the size of the table. Name matches come first, then email and phone
+#     matches, each ordered by the matched column. An empty prefix lists the first entities by name.
+def _typeahead(table, prefix, limit, conditions=(), params=None):
+    limit = max(1, min(int(limit or TYPEAHEAD_LIMIT), MAX_TYPEAHEAD_LIMIT))
+    params = {**(params or {}), 'limit': limit}
+    prefix = (prefix or '').strip()
+    columns = TYPEAHEAD_COLUMNS
+    if prefix:
+        params['prefix'] = re.sub(r'([\\%_])', r'\\\1', prefix) + '%'
+    else:
+        columns = ('name',)
+    selects = []
+    for column in columns:
+        where = list(conditions)
+        if prefix:
+            where.append(f"{column} LIKE :prefix ESCAPE '\\'")
+        selects.append(f"""
+            SELECT * FROM (
+                SELECT id, name, email, phone FROM {table}
+                {'WHERE ' + ' AND '.join(where) if where else ''}
+                ORDER BY {column} COLLATE NOCASE
+                LIMIT :limit
+            )""")
+    try:
+        entities = {}
+        for row in db.session.execute(text(' UNION ALL '.join(selects)), params):
+            entities.setdefault(row.id, row_to_dict(row))
+        return list(entities.values())[:limit]
+    except SQLAlchemyError as e:
+        raise DatabaseError(f"Error searching {table}s: {str(e)}")
+
+
+# Doctors whose name, email or phone starts with prefix, for the doctor fields of the dialogs.
+#     Args:
+#         prefix (str): What the user typed so far.
+#         department_id (int): Only list doctors of this department. Defaults to all.
+#         limit (int): Maximum number of doctors, capped at MAX_TYPEAHEAD_LIMIT.
+
+#     Returns:
+#         list of dict: id, name, email and phone of the matching doctors.
+
+#     Raises:
+#         DatabaseError: If there is an error running the search.
+def typeahead_doctors(prefix, department_id=None, limit=TYPEAHEAD_LIMIT):
+    if department_id is None:
+        return _typeahead('doctor', prefix, limit)
+    return _typeahead('doctor', prefix, limit, ['department_id = :department_id'], {'department_id': department_id})
+
+
+# Patients whose name, email or phone starts with prefix, for the patient fields of the dialogs.
+#     Args:
+#         prefix (str): What the user typed so far.
+#         limit (int): Maximum number of patients, capped at MAX_TYPEAHEAD_LIMIT.
+
+#     Returns:
+#         list of dict: id, name, email and phone of the matching patients.
+
+#     Raises:
+#         DatabaseError: If there is an error running the search.
+def typeahead_patients(prefix, limit=TYPEAHEAD_LIMIT):
+    return _typeahead('patient', prefix, limit)
+
+
+# Rebuilds the full-text search index from the source tables.
+@_retry_on_busy
+def rebuild_search_index():
+    try:
+        populate_search_index()
+    except SQLAlchemyError as e:
+        _rollback()
+        raise DatabaseError(f"Error rebuilding search index: {str(e)}")
+
+
+# Columns written by the bulk import functions, see bulk_import.py for how rows are validated.
+ADDRESS_COLUMNS = ('street', 'county', 'city', 'state', 'country', 'zipcode')
+IMPORT_COLUMNS = {
+    'patient': ('name', 'dob', 'phone', 'email'),
+    'doctor': ('name', 'phone', 'email', 'department_id', 'category', 'experience', 'degree'),
+    'nurse': ('name', 'phone', 'email', 'doctor_id'),
+}
+# Tables an imported row must reference, by column
+_IMPORT_REFERENCES = {
+    'doctor': {'department_id': 'department'},
+    'nurse': {'doctor_id': 'doctor'},
+    'appointment': {'doctor_id': 'doctor', 'patient_id': 'patient'},
+}
+
+
+# Returns the values of `column` in `rows` that do not exist as ids of `table`, with one query.
+def _missing_references(table, column, rows):
+    ids = {row[column] for row in rows if row.get(column) is not None}
+    if not ids:
+        return set()
+    query = text(f"SELECT id FROM {table} WHERE id IN :ids").bindparams(bindparam('ids', expanding=True))
+    return ids - set(db.session.execute(query, {'ids': list(ids)}).scalars())
+
+
+# Splits rows into the ones whose references exist and (line, error) pairs for the others.
+def _check_references(entity, rows):
+    rejected = []
+    for column, table in _IMPORT_REFERENCES.get(entity, {}).items():
+        missing = _missing_references(table, column, rows)
+        if missing:
+            rejected += [(row['line'], f"No {table} found with id {row[column]}") for row in rows if row[column] in missing]
+            rows = [row for row in rows if row[column] not in missing]
+    return rows, rejected
+
+
+# Imports one chunk of validated patients, doctors or nurses in a single transaction.
+#     Emails are checked against the table and within the chunk with one query, addresses and
+#     entities are inserted with one executemany each.
+
+#     Args:
+#         entity (str): 'patient', 'doctor' or 'nurse'.
+#         rows (list of dict): Rows with a 'line' number, the IMPORT_COLUMNS of the entity and ADDRESS_COLUMNS.
+
+#     Returns:
+#         tuple: The number of imported rows and a list of (line, error) pairs for rejected rows.
+
+#     Raises:
+#         DatabaseError: If there is an error writing the chunk, nothing of it is imported then.
+@_retry_on_busy
+def import_people(entity, rows):
+    try:
+        rows, rejected = _check_references(entity, rows)
+        emails = [row['email'] for row in rows if row.get('email')]
+        existing = set()
+        if emails:
+            query = text(f"SELECT email FROM {entity} WHERE email IN :emails").bindparams(
+                bindparam('emails', expanding=True))
+            existing = set(db.session.execute(query, {'emails': emails}).scalars())
+        accepted = []
+        for row in rows:
+            if row.get('email') in existing:
+                rejected.append((row['line'], "Email already exists in the database."))
+                continue
+            if row.get('email'):
+                existing.add(row['email'])
+            accepted.append(row)
+        if not accepted:
+            return 0, rejected
+
+        # RETURNING on a multi-row insert keeps the parameter order, so ids line up with the rows
+        address_table = db.metadata.tables['address']
+        address_ids = db.session.execute(
+            address_table.insert().returning(address_table.c.id, sort_by_parameter_order=True),
+            [{column: row.get(column) for column in ADDRESS_COLUMNS} for row in accepted]
+        ).scalars().all()
+
+        columns = IMPORT_COLUMNS[entity] + ('address_id',)
+        query = text(f"""
+            INSERT INTO {entity} ({', '.join(columns)})
+            VALUES ({', '.join(':' + column for column in columns)})
+        """)
+        db.session.execute(query, [
+            {**{column: row.get(column) for column in IMPORT_COLUMNS[entity]}, 'address_id': address_id}
+            for row, address_id in zip(accepted, address_ids)
+        ])
+        _commit(entity, 'address')
+        return len(accepted), rejected
+    except SQLAlchemyError as e:
+        _rollback()
+        raise DatabaseError(f"Error importing {entity} rows: {str(e)}")
+
+
+_IMPORT_SLOT_CONFLICT = """
+    EXISTS (
+        SELECT 1 FROM appointment
+        WHERE appointment.doctor_id = slot.doctor_id
+        AND appointment.to_time > slot.from_time
+        AND appointment.from_time < slot.to_time
+    )
+"""
+
+
+# Imports one chunk of validated appointments, each with an empty prescription like /add_appointment.
+#     Rows overlapping an existing appointment of their doctor are found with one query over a
+#     temporary table, rows overlapping an earlier row of the same chunk with one sort.
+
+#     Args:
+#         rows (list of dict): Rows with a 'line' number, doctor_id, patient_id, from_time, to_time and notes.
+
+#     Returns:
+#         tuple: The number of imported rows and a list of (line, error) pairs for rejected rows.
+
+#     Raises:
+#         DatabaseError: If there is an error writing the chunk, nothing of it is imported then.
+@_retry_on_busy
+def import_appointments(rows):
+    try:
+        rows, rejected = _check_references('appointment', rows)
+        accepted = []
+        last_end = {}
+        for row in sorted(rows, key=lambda row: (row['doctor_id'], row['from_time'])):
+            if last_end.get(row['doctor_id']) is not None and last_end[row['doctor_id']] > row['from_time']:
+                rejected.append((row['line'], BOOKING_CONFLICT))
+                continue
+            last_end[row['doctor_id']] = row['to_time']
+            accepted.append(row)
+        if not accepted:
+            return 0, rejected
+
+        db.session.execute(text("""
+            CREATE TEMP TABLE IF NOT EXISTS import_slot (
+                line INTEGER, doctor_id INTEGER, patient_id INTEGER, from_time DATETIME, to_time DATETIME, notes TEXT
+            )
+        """))
+        db.session.execute(text("""
+            INSERT INTO import_slot (line, doctor_id, patient_id, from_time, to_time, notes)
+            VALUES (:line, :doctor_id, :patient_id, :from_time, :to_time, :notes)
+        """), [{key: row.get(key) for key in ('line', 'doctor_id', 'patient_id', 'from_time', 'to_time', 'notes')}
+               for row in accepted])
+        conflicts = set(db.session.execute(text(f"""
+            SELECT line FROM import_slot slot WHERE {_IMPORT_SLOT_CONFLICT}
+        """)).scalars())
+        rejected += [(row['line'], BOOKING_CONFLICT) for row in accepted if row['line'] in conflicts]
+        inserted = db.session.execute(text(f"""
+            INSERT INTO appointment (doctor_id, patient_id, from_time, to_time, notes)
+            SELECT doctor_id, patient_id, from_time, to_time, notes
+            FROM import_slot slot
+            WHERE NOT {_IMPORT_SLOT_CONFLICT}
+            ORDER BY line
+            RETURNING id, doctor_id, from_time, to_time
+        """)).fetchall()
+        db.session.execute(text("DELETE FROM import_slot"))
+        if inserted:
+            db.session.execute(text("""
+                INSERT INTO prescription (appointment_id, prescription_notes)
+                VALUES (:appointment_id, '')
+            """), [{'appointment_id': row.id} for row in inserted])
+        _commit('appointment', 'prescription')
+        if appointment_index is not None:
+            for row in inserted:
+                _after_commit(partial(appointment_index.add, row.id, row.doctor_id, _to_datetime(row.from_time),
+                                      _to_datetime(row.to_time)))
+        return len(inserted), rejected
+    except SQLAlchemyError as e:
+        _rollback()
+        raise DatabaseError(f"Error importing appointment rows: {str(e)}")
+
+
+_ADDRESS_SELECT = ', '.join(f'address.{column}' for column in ADDRESS_COLUMNS)
+
+# Per exportable entity: the select, the column the date range applies to (None if it has none),
+# the department filter and the ordering. Orderings follow an index, so rows stream without a sort.
+EXPORT_QUERIES = {
+    'patient': (f"""
+        SELECT patient.id, patient.name, patient.dob, patient.phone, patient.email, {_ADDRESS_SELECT}
+        FROM patient
+        LEFT JOIN address ON patient.address_id = address.id
+    """, 'patient.dob', """patient.id IN (
+        SELECT appointment.patient_id FROM appointment JOIN doctor ON doctor.id = appointment.doctor_id
+        WHERE doctor.department_id = :department_id
+    )""", 'patient.id'),
+    'doctor': (f"""
+        SELECT doctor.id, doctor.name, doctor.phone, doctor.email, doctor.department_id,
+               department.name AS department_name, doctor.category, doctor.experience, doctor.degree,
+               {_ADDRESS_SELECT}
+        FROM doctor
+        LEFT JOIN department ON doctor.department_id = department.id
+        LEFT JOIN address ON doctor.address_id = address.id
+    """, None, 'doctor.department_id = :department_id', 'doctor.id'),
+    'nurse': (f"""
+        SELECT nurse.id, nurse.name, nurse.phone, nurse.email, nurse.doctor_id, doctor.name AS doctor_name,
+               {_ADDRESS_SELECT}
+        FROM nurse
+        LEFT JOIN doctor ON nurse.doctor_id = doctor.id
+        LEFT JOIN address ON nurse.address_id = address.id
+    """, None, 'doctor.department_id = :department_id', 'nurse.id'),
+    'appointment': ("""
+        SELECT appointment.id, appointment.doctor_id, doctor.name AS doctor_name,
+               appointment.patient_id, patient.name AS patient_name, doctor.department_id,
+               appointment.from_time, appointment.to_time, appointment.notes
+        FROM appointment
+        LEFT JOIN doctor ON appointment.doctor_id = doctor.id
+        LEFT JOIN patient ON appointment.patient_id = patient.id
+    """, 'appointment.from_time',
+        # The unary + keeps SQLite on the from_time index instead of the doctor's appointments plus a sort
+        '+appointment.doctor_id IN (SELECT id FROM doctor WHERE department_id = :department_id)',
+        'appointment.from_time, appointment.id'),
+}
+# Rows fetched from SQLite at a time while exporting
+EXPORT_BATCH_SIZE = 1000
+
+
+# Streams every row of an entity for export, without loading them all into memory.
+#     The rows are read through a streaming result, so the caller must consume them
+#     while the session is open.
+
+#     Args:
+#         entity (str): One of EXPORT_QUERIES.
+#         from_date (str): YYYY-MM-DD, see _add_date_range_condition. Appointment start or patient date of birth.
+#         to_date (str): YYYY-MM-DD, inclusive.
+#         department_id (int): Doctors of the department, their nurses and appointments,
+#                              or patients with an appointment in it.
+
+#     Returns:
+#         tuple: The column names and an iterator over the rows.
+
+#     Raises:
+#         DatabaseError: If the entity or a filter is invalid, or there is an error running the query.
+def export_rows(entity, from_date=None, to_date=None, department_id=None):
+    if entity not in EXPORT_QUERIES:
+        raise DatabaseError(f"Cannot export {entity}")
+    select, date_column, department_condition, order_by = EXPORT_QUERIES[entity]
+    conditions, params = [], {}
+    if from_date or to_date:
+        if date_column is None:
+            raise DatabaseError(f"Cannot filter {entity} by date")
+        _add_date_range_condition(date_column, from_date, to_date, conditions, params)
+    if department_id:
+        conditions.append(department_condition)
+        params['department_id'] = department_id
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    try:
+        result = db.session.execute(
+            text(f"{select} {where} ORDER BY {order_by}"), params,
+            execution_options={'stream_results': True, 'yield_per': EXPORT_BATCH_SIZE}
+        )
+        return list(result.keys()), (tuple(row) for row in result)
+    except SQLAlchemyError as e:
+        raise DatabaseError(f"Error exporting {entity}: {str(e)}")
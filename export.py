@@ -0,0 +1,55 @@
+import csv
+import io
+import json
+
+import db_queries
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+# Rows serialized per chunk of the response body
+EXPORT_CHUNK_ROWS = 500
+
+
+def _csv_chunks(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_chunks(columns, rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row)), default=str))
+        if len(lines) == EXPORT_CHUNK_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+# Serializes an export of db_queries.export_rows() as CSV or NDJSON, one chunk of rows at a time.
+#     Args:
+#         entity (str): One of db_queries.EXPORT_QUERIES.
+#         format (str): One of EXPORT_FORMATS.
+#         **filters: from_date, to_date and department_id, see db_queries.export_rows().
+
+#     Returns:
+#         tuple: The mimetype and a generator of text chunks, to be consumed while the session is open.
+
+#     Raises:
+#         DatabaseError: If the format, entity or a filter is invalid.
+def export_entity(entity, format='csv', **filters):
+    if format not in EXPORT_FORMATS:
+        raise db_queries.DatabaseError(f"Unsupported format {format}, use one of {', '.join(EXPORT_FORMATS)}")
+    columns, rows = db_queries.export_rows(entity, **filters)
+    chunks = _csv_chunks if format == 'csv' else _ndjson_chunks
+    return EXPORT_FORMATS[format], chunks(columns, rows)
@@ -0,0 +1,94 @@
+import bisect
+import threading
+from datetime import timedelta
+
+
+# In-process index of appointment intervals, one sorted list per doctor.
+#
+# Each doctor's intervals are kept sorted by start time together with the longest interval
+# seen for that doctor. Any interval overlapping [from_time, to_time) must start after
+# from_time - longest, so a lookup is a bisect plus a scan over that short window.
+# Doctors are loaded lazily through `loader(doctor_id)`, which returns (id, from_time, to_time)
+# tuples, and the index has to be told about every write (see db_queries).
+class AppointmentIntervalIndex:
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._lock = threading.RLock()
+        self._doctors = {}
+        self._appointments = {}
+
+    def _doctor(self, doctor_id):
+        doctor = self._doctors.get(doctor_id)
+        if doctor is None:
+            doctor = _DoctorIntervals()
+            for appointment_id, from_time, to_time in self._loader(doctor_id):
+                doctor.insert(appointment_id, from_time, to_time)
+                self._appointments[appointment_id] = (doctor_id, from_time, to_time)
+            self._doctors[doctor_id] = doctor
+        return doctor
+
+    # Returns the id of an appointment of this doctor overlapping [from_time, to_time), or None.
+    def find_conflict(self, doctor_id, from_time, to_time, exclude_id=None):
+        with self._lock:
+            return self._doctor(doctor_id).find_conflict(from_time, to_time, exclude_id)
+
+    def add(self, appointment_id, doctor_id, from_time, to_time):
+        with self._lock:
+            self.remove(appointment_id)
+            if doctor_id in self._doctors:
+                self._doctors[doctor_id].insert(appointment_id, from_time, to_time)
+                self._appointments[appointment_id] = (doctor_id, from_time, to_time)
+
+    def remove(self, appointment_id):
+        with self._lock:
+            entry = self._appointments.pop(appointment_id, None)
+            if entry is not None:
+                doctor_id, from_time, to_time = entry
+                self._doctors[doctor_id].delete(appointment_id, from_time)
+
+    # Forgets everything about a doctor, the next lookup reloads it from the database.
+    def discard_doctor(self, doctor_id):
+        with self._lock:
+            doctor = self._doctors.pop(doctor_id, None)
+            if doctor is not None:
+                for appointment_id in doctor.ids:
+                    self._appointments.pop(appointment_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._doctors.clear()
+            self._appointments.clear()
+
+
+class _DoctorIntervals:
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.ids = []
+        self.longest = timedelta(0)
+
+    def insert(self, appointment_id, from_time, to_time):
+        position = bisect.bisect_right(self.starts, from_time)
+        self.starts.insert(position, from_time)
+        self.ends.insert(position, to_time)
+        self.ids.insert(position, appointment_id)
+        self.longest = max(self.longest, to_time - from_time)
+
+    def delete(self, appointment_id, from_time):
+        position = bisect.bisect_left(self.starts, from_time)
+        while self.ids[position] != appointment_id:
+            position += 1
+        del self.starts[position]
+        del self.ends[position]
+        del self.ids[position]
+
+    def find_conflict(self, from_time, to_time, exclude_id=None):
+        position = bisect.bisect_left(self.starts, to_time) - 1
+        lower_bound = from_time - self.longest
+        while position >= 0 and self.starts[position] >= lower_bound:
+            if self.ends[position] > from_time and self.ids[position] != exclude_id:
+                return self.ids[position]
+            position -= 1
+        return None
@@ -0,0 +1,288 @@
+import bisect
+import ipaddress
+import threading
+import time
+from functools import wraps
+
+from flask import g, request
+
+# Upper bounds of the latency histogram buckets in seconds: the Prometheus client defaults with
+# sub-millisecond buckets added, most routes here answer in about a millisecond
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+# Upper bounds of the response size buckets in bytes
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+# Label of requests that matched no route
+UNMATCHED_ROUTE = '<unmatched>'
+
+
+# Counts of observations per bucket, with a last bucket for values above the largest bound.
+# Not thread-safe on its own, the Metrics registry serializes the updates.
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Estimates a quantile by linear interpolation inside its bucket, like Prometheus' histogram_quantile.
+    # Quantiles in the last bucket are reported as the largest bound.
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    # Cumulative (upper bound, count) pairs as exposed by Prometheus, ending with +Inf.
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+class RouteStats:
+
+    def __init__(self):
+        self.statuses = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+        self.in_flight = 0
+
+
+class CallbackStats:
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.errors = 0
+
+
+# Request and Dash callback metrics of this process.
+# Updates take one lock and a bisect, cheap enough to leave on for every request.
+class Metrics:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._callbacks = {}
+        self.started = time.time()
+
+    def _route(self, route, method):
+        key = (route, method)
+        stats = self._routes.get(key)
+        if stats is None:
+            stats = self._routes[key] = RouteStats()
+        return stats
+
+    def start_request(self, route, method):
+        with self._lock:
+            self._route(route, method).in_flight += 1
+
+    def finish_request(self, route, method, status, size, seconds):
+        with self._lock:
+            stats = self._route(route, method)
+            stats.in_flight -= 1
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.latency.observe(seconds)
+            stats.size.observe(size)
+
+    def observe_callback(self, name, seconds, error=False):
+        with self._lock:
+            stats = self._callbacks.get(name)
+            if stats is None:
+                stats = self._callbacks[name] = CallbackStats()
+            stats.latency.observe(seconds)
+            stats.errors += error
+
+    # Decorator recording the latency and errors of a Dash callback under the function's name.
+    def timed_callback(self, f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            start = time.perf_counter()
+            error = True
+            try:
+                value = f(*args, **kwargs)
+                error = False
+                return value
+            finally:
+                self.observe_callback(f.__name__, time.perf_counter() - start, error)
+
+        return decorated_function
+
+    # All metrics in the Prometheus text exposition format.
+    def render_prometheus(self):
+        with self._lock:
+            routes = sorted(self._routes.items())
+            callbacks = sorted(self._callbacks.items())
+            lines = [
+                '# HELP http_requests_total Finished requests by route, method and status.',
+                '# TYPE http_requests_total counter',
+            ]
+            for (route, method), stats in routes:
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(f'http_requests_total{{route="{_escape(route)}",method="{method}",'
+                                 f'status="{status}"}} {count}')
+            lines += ['# HELP http_requests_in_flight Requests being processed or streamed.',
+                      '# TYPE http_requests_in_flight gauge']
+            for (route, method), stats in routes:
+                lines.append(f'http_requests_in_flight{{route="{_escape(route)}",method="{method}"}} '
+                             f'{stats.in_flight}')
+            for name, help, attribute in (
+                ('http_request_duration_seconds', 'Time until the response body was sent.', 'latency'),
+                ('http_response_size_bytes', 'Size of the response body.', 'size'),
+            ):
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} histogram']
+                for (route, method), stats in routes:
+                    labels = f'route="{_escape(route)}",method="{method}"'
+                    lines += _histogram_lines(name, labels, getattr(stats, attribute))
+            lines += ['# HELP dash_callback_duration_seconds Time spent in a Dash callback.',
+                      '# TYPE dash_callback_duration_seconds histogram']
+            for name, stats in callbacks:
+                lines += _histogram_lines('dash_callback_duration_seconds', f'callback="{name}"', stats.latency)
+            lines += ['# HELP dash_callback_errors_total Dash callbacks that raised.',
+                      '# TYPE dash_callback_errors_total counter']
+            for name, stats in callbacks:
+                lines.append(f'dash_callback_errors_total{{callback="{name}"}} {stats.errors}')
+        return '\n'.join(lines) + '\n'
+
+    # Per route and callback counts, estimated latency percentiles in ms and mean response sizes.
+    def summary(self):
+        with self._lock:
+            return {
+                'uptime_seconds': round(time.time() - self.started, 1),
+                'routes': [
+                    {
+                        'route': route,
+                        'method': method,
+                        'requests': stats.latency.count,
+                        'in_flight': stats.in_flight,
+                        'statuses': {str(status): count for status, count in sorted(stats.statuses.items())},
+                        **_latency_summary(stats.latency),
+                        'mean_bytes': round(stats.size.sum / stats.size.count) if stats.size.count else None,
+                    }
+                    for (route, method), stats in sorted(self._routes.items())
+                ],
+                'callbacks': [
+                    {'callback': name, 'calls': stats.latency.count, 'errors': stats.errors,
+                     **_latency_summary(stats.latency)}
+                    for name, stats in sorted(self._callbacks.items())
+                ],
+            }
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram_lines(name, labels, histogram):
+    lines = [f'{name}_bucket{{{labels},le="{"+Inf" if bound == float("inf") else bound}"}} {count}'
+             for bound, count in histogram.cumulative()]
+    lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+    return lines
+
+
+def _latency_summary(histogram):
+    def ms(seconds):
+        return round(seconds * 1000, 2) if seconds is not None else None
+
+    return {
+        'mean_ms': ms(histogram.sum / histogram.count) if histogram.count else None,
+        'p50_ms': ms(histogram.quantile(0.5)),
+        'p95_ms': ms(histogram.quantile(0.95)),
+        'p99_ms': ms(histogram.quantile(0.99)),
+    }
+
+
+# Networks allowed to scrape /metrics when none are configured: the local host only.
+SCRAPE_NETWORKS = ('127.0.0.0/8', '::1/128')
+
+
+def parse_networks(networks):
+    return [ipaddress.ip_network(network, strict=False) for network in networks]
+
+
+# True when the client address is in one of the networks. Behind a reverse proxy this is the
+# proxy's address unless the app is wrapped in werkzeug's ProxyFix.
+def address_allowed(address, networks):
+    try:
+        address = ipaddress.ip_address(address)
+    except (TypeError, ValueError):
+        return False
+    return any(address in network for network in networks)
+
+
+# Hits, misses and entries of result caches (cache.ResultCache) by name, in the Prometheus text format.
+def render_cache_metrics(caches):
+    stats = sorted((name, cache.stats()) for name, cache in caches.items())
+    lines = []
+    for name, type, help, key in (
+        ('cache_hits_total', 'counter', 'Lookups answered from the cache.', 'hits'),
+        ('cache_misses_total', 'counter', 'Lookups that ran the cached function.', 'misses'),
+        ('cache_entries', 'gauge', 'Results held by the cache.', 'entries'),
+    ):
+        lines += [f'# HELP {name} {help}', f'# TYPE {name} {type}']
+        lines += [f'{name}{{cache="{cache}"}} {values[key]}' for cache, values in stats]
+    return '\n'.join(lines) + '\n'
+
+
+# Records every request of `app` in `metrics`, labelled with its URL rule so ids do not create new series.
+# Streamed responses are finished after their last chunk was sent (or the response was closed),
+# so their latency and size cover the whole body.
+def instrument(app, metrics):
+
+    @app.before_request
+    def start_request():
+        g.metrics_request = (request.url_rule.rule if request.url_rule else UNMATCHED_ROUTE, request.method,
+                             time.perf_counter())
+        metrics.start_request(*g.metrics_request[:2])
+
+    @app.after_request
+    def finish_request(response):
+        route, method, start = g.pop('metrics_request', (None, None, None))
+        if route is None:
+            return response
+        status = response.status_code
+        if not response.is_streamed:
+            metrics.finish_request(route, method, status, response.content_length or 0, time.perf_counter() - start)
+            return response
+
+        sent = [0]
+        finished = []
+
+        def finish():
+            if not finished:
+                finished.append(True)
+                metrics.finish_request(route, method, status, sent[0], time.perf_counter() - start)
+
+        def count_bytes(chunks):
+            try:
+                for chunk in chunks:
+                    sent[0] += len(chunk)
+                    yield chunk
+            finally:
+                finish()
+
+        response.response = count_bytes(response.iter_encoded())
+        response.call_on_close(finish)
+        return response
+
+    # Requests that failed before after_request ran are still finished, as errors
+    @app.teardown_request
+    def abandon_request(error):
+        route, method, start = g.pop('metrics_request', (None, None, None))
+        if route is not None:
+            metrics.finish_request(route, method, 500, 0, time.perf_counter() - start)
@@ -1,12 +1,351 @@
+import re
+from functools import partial
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, text
+from sqlalchemy.schema import CreateIndex
 
 db = SQLAlchemy()
 
 
-def init_app(app):
+# SQLite connection settings, overridden by the `database` section of config.yml.
+# WAL lets readers run while a write is in flight; synchronous=NORMAL is durable across
+# application crashes in WAL mode and only loses the last commits on power failure.
+# cache_size is in pages, or in KiB when negative.
+ENGINE_PROFILE = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': -65536,
+    'mmap_size': 268435456,
+    'temp_store': 'memory',
+    'busy_timeout_ms': 5000,
+    'pool_size': 10,
+    'max_overflow': 10,
+    'pool_timeout': 30,
+}
+
+_PRAGMAS = ('journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store')
+_PRAGMA_VALUE = re.compile(r'^-?\w+$')
+
+
+def init_app(app, engine_profile=None):
+    profile = {**ENGINE_PROFILE, **(engine_profile or {})}
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {
+        'pool_size': profile['pool_size'],
+        'max_overflow': profile['max_overflow'],
+        'pool_timeout': profile['pool_timeout'],
+        # Connections move between the pool's threads, each is only used by one at a time
+        'connect_args': {'check_same_thread': False},
+    })
     db.init_app(app)
     with app.app_context():
+        event.listen(db.engine, 'connect', partial(_apply_pragmas, profile))
         db.create_all()
+        create_missing_indexes()
+        create_search_index()
+        create_rollups()
+        create_change_log()
+        create_booking_guard()
+
+
+# Runs on every new pool connection, pragmas other than journal_mode are per connection.
+def _apply_pragmas(profile, dbapi_connection, connection_record):
+    pragmas = {name: profile[name] for name in _PRAGMAS if profile.get(name) is not None}
+    pragmas['busy_timeout'] = profile['busy_timeout_ms']
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        if not _PRAGMA_VALUE.match(str(value)):
+            raise ValueError(f"Invalid value for PRAGMA {name}: {value!r}")
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+# create_all() skips tables that already exist, so indexes added to a model after the
+# database was first created are created here instead. IF NOT EXISTS rather than checkfirst,
+# which does not see indexes on expressions.
+def create_missing_indexes():
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+# Full-text search over people and clinical notes, kept in sync by triggers.
+# Every indexed row gets the FTS rowid `id * SEARCH_ROWID_STRIDE + code`, so triggers can update
+# and delete entries by rowid and search hits can be mapped back to their table and id.
+# Each source is (code, title expression, body expression, appointment id expression).
+SEARCH_ROWID_STRIDE = 8
+SEARCH_SOURCES = {
+    'patient': (1, "{r}.name", "coalesce({r}.email, '') || ' ' || coalesce({r}.phone, '') || ' ' || {digits}",
+                "NULL"),
+    'doctor': (2, "{r}.name", "coalesce({r}.email, '') || ' ' || coalesce({r}.phone, '') || ' ' || {digits} || ' ' || "
+                              "coalesce({r}.category, '') || ' ' || coalesce({r}.degree, '')", "NULL"),
+    'nurse': (3, "{r}.name", "coalesce({r}.email, '') || ' ' || coalesce({r}.phone, '') || ' ' || {digits}", "NULL"),
+    'appointment': (4, "''", "coalesce({r}.notes, '')", "{r}.id"),
+    'prescription': (5, "''", "coalesce({r}.prescription_notes, '')", "{r}.appointment_id"),
+    'diagnostic': (6, "coalesce({r}.test_name, '')", "coalesce({r}.test_report, '')", "{r}.appointment_id"),
+}
+
+# Phone numbers are also indexed with separators stripped, so '5551234567' finds '555-123-4567'.
+_PHONE_DIGITS = "replace(replace(replace(replace(replace(coalesce({r}.phone, ''), '-', ''), ' ', ''), '(', ''), ')', '')," \
+                " '.', '')"
+
+
+def _search_columns(table, row):
+    code, title, body, appointment_id = SEARCH_SOURCES[table]
+    digits = _PHONE_DIGITS.format(r=row)
+    rowid = f"{row}.id * {SEARCH_ROWID_STRIDE} + {code}"
+    return rowid, title.format(r=row), body.format(r=row, digits=digits), appointment_id.format(r=row)
+
+
+def _search_insert(table, row):
+    rowid, title, body, appointment_id = _search_columns(table, row)
+    return f"INSERT INTO search_index (rowid, title, body, appointment_id) VALUES ({rowid}, {title}, {body}, " \
+           f"{appointment_id});"
+
+
+def _search_delete(table, row):
+    rowid = _search_columns(table, row)[0]
+    return f"DELETE FROM search_index WHERE rowid = {rowid};"
+
+
+def search_index_ddl():
+    statements = ["""
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            title, body, appointment_id UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )
+    """]
+    for table in SEARCH_SOURCES:
+        statements += [
+            f"CREATE TRIGGER IF NOT EXISTS search_{table}_insert AFTER INSERT ON {table} BEGIN "
+            f"{_search_insert(table, 'new')} END",
+            f"CREATE TRIGGER IF NOT EXISTS search_{table}_update AFTER UPDATE ON {table} BEGIN "
+            f"{_search_delete(table, 'old')} {_search_insert(table, 'new')} END",
+            f"CREATE TRIGGER IF NOT EXISTS search_{table}_delete AFTER DELETE ON {table} BEGIN "
+            f"{_search_delete(table, 'old')} END",
+        ]
+    return statements
+
+
+# Fills search_index from the source tables, used when the index is first created and to rebuild it.
+def populate_search_index():
+    db.session.execute(text("DELETE FROM search_index"))
+    for table in SEARCH_SOURCES:
+        rowid, title, body, appointment_id = _search_columns(table, table)
+        db.session.execute(text(f"""
+            INSERT INTO search_index (rowid, title, body, appointment_id)
+            SELECT {rowid}, {title}, {body}, {appointment_id} FROM {table}
+        """))
+    db.session.execute(text("INSERT INTO search_index (search_index) VALUES ('optimize')"))
+    db.session.commit()
+
+
+def create_search_index():
+    is_new = not inspect(db.engine).has_table('search_index')
+    for statement in search_index_ddl():
+        db.session.execute(text(statement))
+    db.session.commit()
+    if is_new:
+        populate_search_index()
+
+
+# Dashboard rollups of appointments, kept up to date by triggers on the appointment table.
+# appointment_rollup_patient counts appointments per (bucket, period, doctor_id, patient_id) and
+# appointment_rollup holds the distinct patient and appointment counts per (bucket, period, doctor_id),
+# so the dashboard reads one row per day/month/year/doctor instead of aggregating appointments.
+# Each bucket is (period expression, doctor id expression), doctor id 0 means all doctors.
+ROLLUP_BUCKETS = {
+    'day': ("DATE({r}.from_time)", "0"),
+    'month': ("strftime('%Y-%m', {r}.from_time)", "0"),
+    'year': ("strftime('%Y', {r}.from_time)", "0"),
+    'doctor': ("''", "{r}.doctor_id"),
+}
+
+ROLLUP_TABLES_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS appointment_rollup_patient (
+        bucket TEXT NOT NULL,
+        period TEXT NOT NULL,
+        doctor_id INTEGER NOT NULL,
+        patient_id INTEGER NOT NULL,
+        appointment_count INTEGER NOT NULL,
+        PRIMARY KEY (bucket, period, doctor_id, patient_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS appointment_rollup (
+        bucket TEXT NOT NULL,
+        period TEXT NOT NULL,
+        doctor_id INTEGER NOT NULL,
+        patient_count INTEGER NOT NULL,
+        appointment_count INTEGER NOT NULL,
+        PRIMARY KEY (bucket, period, doctor_id)
+    ) WITHOUT ROWID
+    """,
+]
+
+
+def _rollup_add(bucket, row):
+    period, doctor_id = (expression.format(r=row) for expression in ROLLUP_BUCKETS[bucket])
+    key = f"bucket = '{bucket}' AND period = {period} AND doctor_id = {doctor_id}"
+    return f"""
+        INSERT INTO appointment_rollup_patient VALUES ('{bucket}', {period}, {doctor_id}, {row}.patient_id, 1)
+            ON CONFLICT DO UPDATE SET appointment_count = appointment_count + 1;
+        INSERT INTO appointment_rollup VALUES ('{bucket}', {period}, {doctor_id}, 0, 0) ON CONFLICT DO NOTHING;
+        UPDATE appointment_rollup
+        SET appointment_count = appointment_count + 1,
+            patient_count = patient_count + (SELECT appointment_count = 1 FROM appointment_rollup_patient
+                                             WHERE {key} AND patient_id = {row}.patient_id)
+        WHERE {key};
+    """
+
+
+def _rollup_remove(bucket, row):
+    period, doctor_id = (expression.format(r=row) for expression in ROLLUP_BUCKETS[bucket])
+    key = f"bucket = '{bucket}' AND period = {period} AND doctor_id = {doctor_id}"
+    return f"""
+        UPDATE appointment_rollup_patient SET appointment_count = appointment_count - 1
+        WHERE {key} AND patient_id = {row}.patient_id;
+        UPDATE appointment_rollup
+        SET appointment_count = appointment_count - 1,
+            patient_count = patient_count - (SELECT appointment_count = 0 FROM appointment_rollup_patient
+                                             WHERE {key} AND patient_id = {row}.patient_id)
+        WHERE {key};
+        DELETE FROM appointment_rollup_patient WHERE {key} AND patient_id = {row}.patient_id AND appointment_count = 0;
+        DELETE FROM appointment_rollup WHERE {key} AND appointment_count = 0;
+    """
+
+
+def rollup_ddl():
+    add = ''.join(_rollup_add(bucket, 'new') for bucket in ROLLUP_BUCKETS)
+    remove = ''.join(_rollup_remove(bucket, 'old') for bucket in ROLLUP_BUCKETS)
+    return ROLLUP_TABLES_DDL + [
+        f"CREATE TRIGGER IF NOT EXISTS rollup_appointment_insert AFTER INSERT ON appointment BEGIN {add} END",
+        f"CREATE TRIGGER IF NOT EXISTS rollup_appointment_update AFTER UPDATE OF doctor_id, patient_id, from_time "
+        f"ON appointment WHEN old.doctor_id IS NOT new.doctor_id OR old.patient_id IS NOT new.patient_id "
+        f"OR old.from_time IS NOT new.from_time BEGIN {remove} {add} END",
+        f"CREATE TRIGGER IF NOT EXISTS rollup_appointment_delete AFTER DELETE ON appointment BEGIN {remove} END",
+    ]
+
+
+# Recomputes both rollup tables from the appointment table.
+def populate_rollups():
+    db.session.execute(text("DELETE FROM appointment_rollup_patient"))
+    db.session.execute(text("DELETE FROM appointment_rollup"))
+    for bucket, (period, doctor_id) in ROLLUP_BUCKETS.items():
+        period, doctor_id = period.format(r='appointment'), doctor_id.format(r='appointment')
+        db.session.execute(text(f"""
+            INSERT INTO appointment_rollup_patient
+            SELECT '{bucket}', {period}, {doctor_id}, patient_id, COUNT(*)
+            FROM appointment
+            GROUP BY 2, 3, 4
+        """))
+    db.session.execute(text("""
+        INSERT INTO appointment_rollup
+        SELECT bucket, period, doctor_id, COUNT(*), SUM(appointment_count)
+        FROM appointment_rollup_patient
+        GROUP BY bucket, period, doctor_id
+    """))
+    db.session.commit()
+
+
+def create_rollups():
+    is_new = not inspect(db.engine).has_table('appointment_rollup')
+    for statement in rollup_ddl():
+        db.session.execute(text(statement))
+    db.session.commit()
+    if is_new:
+        populate_rollups()
+
+
+# Ids of appointments whose analytics inputs changed, in commit order, so the analytics engine can
+# reload only those rows. Diagnostics log their appointment's id. Only the newest
+# CHANGE_LOG_RETENTION entries are kept; a reader that fell further behind reloads everything.
+CHANGE_LOG_RETENTION = 100000
+
+_CHANGE_LOG_TRIM = f"""
+    DELETE FROM appointment_change_log
+    WHERE seq <= (SELECT MAX(seq) FROM appointment_change_log) - {CHANGE_LOG_RETENTION};
+"""
+
+
+def change_log_ddl():
+    statements = ["""
+        CREATE TABLE IF NOT EXISTS appointment_change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            appointment_id INTEGER NOT NULL
+        )
+    """]
+    for table, key in (('appointment', 'id'), ('diagnostic', 'appointment_id')):
+        log_new = f"INSERT INTO appointment_change_log (appointment_id) VALUES (new.{key});"
+        log_old = f"INSERT INTO appointment_change_log (appointment_id) VALUES (old.{key});"
+        statements += [
+            f"CREATE TRIGGER IF NOT EXISTS change_log_{table}_insert AFTER INSERT ON {table} BEGIN "
+            f"{log_new} {_CHANGE_LOG_TRIM} END",
+            f"CREATE TRIGGER IF NOT EXISTS change_log_{table}_update AFTER UPDATE ON {table} BEGIN "
+            f"{log_old} {log_new} {_CHANGE_LOG_TRIM} END",
+            f"CREATE TRIGGER IF NOT EXISTS change_log_{table}_delete AFTER DELETE ON {table} BEGIN "
+            f"{log_old} {_CHANGE_LOG_TRIM} END",
+        ]
+    return statements
+
+
+def create_change_log():
+    for statement in change_log_ddl():
+        db.session.execute(text(statement))
+    db.session.commit()
+
+
+# Rejects appointments that overlap another appointment of the same doctor. The check runs inside the
+# INSERT or UPDATE, while SQLite holds the write lock, so two bookings racing for one slot cannot both
+# pass it the way they can both pass db_queries.find_conflicting_appointment() before writing.
+# The lookup is a range scan of ix_appointment_doctor_interval.
+BOOKING_CONFLICT = 'Conflicting appointment exists'
+
+_OVERLAPPING_APPOINTMENT = """
+    SELECT 1 FROM appointment
+    WHERE doctor_id = new.doctor_id AND to_time > new.from_time AND from_time < new.to_time {exclude}
+"""
+
+
+def booking_guard_ddl():
+    reject = f"SELECT RAISE(ABORT, '{BOOKING_CONFLICT}');"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS booking_guard_insert BEFORE INSERT ON appointment "
+        f"WHEN EXISTS ({_OVERLAPPING_APPOINTMENT.format(exclude='')}) BEGIN {reject} END",
+        f"CREATE TRIGGER IF NOT EXISTS booking_guard_update BEFORE UPDATE OF doctor_id, from_time, to_time "
+        f"ON appointment WHEN EXISTS ({_OVERLAPPING_APPOINTMENT.format(exclude='AND id != old.id')}) "
+        f"BEGIN {reject} END",
+    ]
+
+
+def create_booking_guard():
+    for statement in booking_guard_ddl():
+        db.session.execute(text(statement))
+    db.session.commit()
+
+
+# Bulk loads into the source tables run without the triggers above and rebuild the derived
+# tables once at the end, which is much faster than maintaining them row by row.
+def drop_triggers():
+    for name in db.session.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'")).scalars().all():
+        db.session.execute(text(f'DROP TRIGGER "{name}"'))
+    db.session.commit()
+
+
+def restore_triggers():
+    for statement in search_index_ddl() + rollup_ddl() + change_log_ddl() + booking_guard_ddl():
+        db.session.execute(text(statement))
+    # Replace the change log with one entry after a gap, so analytics readers reload their whole snapshot
+    db.session.execute(text("""
+        INSERT INTO appointment_change_log (seq, appointment_id)
+        SELECT COALESCE(MAX(seq), 0) + 2, 0 FROM appointment_change_log
+    """))
+    db.session.execute(text("DELETE FROM appointment_change_log WHERE seq < (SELECT MAX(seq) FROM appointment_change_log)"))
+    db.session.commit()
+    populate_search_index()
+    populate_rollups()
 
 
 class User(db.Model):
@@ -16,12 +355,27 @@ class User(db.Model):
     is_admin = db.Column(db.Boolean, default=False)
 
 
+# Indexes for the case-insensitive prefix matches of the typeahead endpoints: LIKE 'prefix%' only
+# becomes a range scan on an index with NOCASE collation.
+def _typeahead_indexes(table):
+    return tuple(db.Index(f'ix_{table}_{column}_nocase', text(f'{column} COLLATE NOCASE'))
+                 for column in ('name', 'email', 'phone'))
+
+
+# Indexes for the keyset pagination of the list endpoints over nullable columns, which sort by
+# COALESCE(column, '') so that rows without a value can be paged past (see db_queries._list_page).
+def _sort_indexes(table, columns):
+    return tuple(db.Index(f'ix_{table}_{column}_sort', text(f"COALESCE({column}, '')")) for column in columns)
+
+
 class Doctor(db.Model):
+    __table_args__ = _typeahead_indexes('doctor')
+
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False, index=True)
     phone = db.Column(db.String(20), nullable=False)
     email = db.Column(db.String(100), unique=True, nullable=False)
-    department_id = db.Column(db.Integer, db.ForeignKey('department.id'))
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), index=True)
     department = db.relationship('Department', backref='doctors')
     category = db.Column(db.String(20), nullable=False)
     experience = db.Column(db.Integer, nullable=False)
@@ -44,11 +398,13 @@ class Address(db.Model):
 
 
 class Patient(db.Model):
+    __table_args__ = _typeahead_indexes('patient') + _sort_indexes('patient', ('name', 'email'))
+
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100))
+    name = db.Column(db.String(100), index=True)
     phone = db.Column(db.String(20))
     email = db.Column(db.String(100), unique=True)
-    dob = db.Column(db.DateTime, nullable=False)
+    dob = db.Column(db.DateTime, nullable=False, index=True)
     address_id = db.Column(db.Integer, db.ForeignKey('address.id'))
     address = db.relationship('Address', backref='patients')
 
@@ -57,8 +413,10 @@ class Patient(db.Model):
 
 
 class Nurse(db.Model):
+    __table_args__ = _sort_indexes('nurse', ('name', 'email'))
+
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100))
+    name = db.Column(db.String(100), index=True)
     phone = db.Column(db.String(20))
     email = db.Column(db.String(100), unique=True)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'))
@@ -71,10 +429,17 @@ class Nurse(db.Model):
 
 
 class Appointment(db.Model):
+    # Conflict detection looks for `to_time > :from AND from_time < :to` per doctor. Leading with
+    # to_time keeps that range scan to the doctor's appointments ending after the requested start,
+    # so it does not grow with the doctor's history, and from_time makes the index covering.
+    __table_args__ = (
+        db.Index('ix_appointment_doctor_interval', 'doctor_id', 'to_time', 'from_time'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
-    from_time = db.Column(db.DateTime, nullable=False)
+    from_time = db.Column(db.DateTime, nullable=False, index=True)
     to_time = db.Column(db.DateTime, nullable=False)
     notes = db.Column(db.Text)
 
@@ -84,7 +449,7 @@ class Appointment(db.Model):
 
 class Prescription(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False, index=True)
     prescription_notes = db.Column(db.Text)
 
     appointment = db.relationship('Appointment', backref='prescriptions')
@@ -92,7 +457,7 @@ class Prescription(db.Model):
 
 class Diagnostic(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False, index=True)
     test_name = db.Column(db.Text)
     test_report = db.Column(db.Text)
 
@@ -0,0 +1,92 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+# bcrypt cost (log2 of the key expansion rounds), the Flask-Bcrypt default
+ROUNDS = 12
+
+
+class HasherBusy(Exception):
+    # Raised when max_pending hashes are already queued for longer than the queue timeout.
+    pass
+
+
+# bcrypt hashing and verification on a bounded pool of worker threads.
+#     bcrypt releases the GIL while it runs, so the workers hash on as many cores as there are and
+#     requests that do not log in keep their threads. At most `workers` hashes run at once and at most
+#     max_pending wait for a worker; callers beyond that wait up to queue_timeout_seconds for a place
+#     and then get HasherBusy, so a burst of logins queues instead of taking over every request thread.
+#     With workers=0 hashes run on the calling thread.
+#     Hashes are compatible with Flask-Bcrypt's, and hashes of another cost are verified as they are
+#     and reported by needs_rehash().
+class PasswordHasher:
+
+    def __init__(self, rounds=ROUNDS, workers=None, max_pending=64, queue_timeout_seconds=5):
+        self.rounds = rounds
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self._slots = threading.BoundedSemaphore(self.workers + max_pending)
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='password-hasher') if self.workers else None
+
+    def hash(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    def verify(self, password, hashed):
+        return self._run(_verify, password, hashed)
+
+    # True when hashed was made with another cost than the configured one.
+    def needs_rehash(self, hashed):
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    # Hashes all passwords on all workers in parallel. At most `workers` of them are queued at a
+    # time, so logins arriving meanwhile wait behind a few hashes and not behind the whole batch.
+    def hash_many(self, passwords):
+        if self._executor is None:
+            return [_hash(password, self.rounds) for password in passwords]
+        hashes, pending = [], deque()
+        for password in passwords:
+            if len(pending) >= self.workers:
+                hashes.append(pending.popleft().result())
+            pending.append(self._submit(_hash, password, self.rounds))
+        hashes.extend(future.result() for future in pending)
+        return hashes
+
+    def _run(self, function, *args):
+        if self._executor is None:
+            return function(*args)
+        return self._submit(function, *args).result()
+
+    def _submit(self, function, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout_seconds):
+            raise HasherBusy("Too many password checks are waiting, try again")
+        try:
+            future = self._executor.submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+
+
+def _hash(password, rounds):
+    if not password:
+        raise ValueError('Password must be non-empty.')
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _verify(password, hashed):
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    except ValueError:
+        # Not a bcrypt hash
+        return False
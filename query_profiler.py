@@ -0,0 +1,204 @@
+import logging
+import sqlite3
+import sys
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+# Module whose functions statements are attributed to, other callers are named module.function
+QUERY_MODULE = 'db_queries'
+# Frames of these modules are skipped when looking for the caller of a statement
+_LIBRARY_MODULES = ('sqlalchemy', 'flask_sqlalchemy', __name__)
+NO_ROUTE = '<no request>'
+# Statements listed by QueryProfiler.summary()
+SUMMARY_LIMIT = 50
+
+slow_query_logger = logging.getLogger('hospital.slow_queries')
+
+
+# Cursors that count the rows fetched from them into the statement and request totals of their query.
+# SQLAlchemy events fire when a statement is executed, rows are only known once they are fetched.
+class ProfilingCursor(sqlite3.Cursor):
+    profile = None
+
+    def _count(self, rows):
+        if self.profile is not None and rows:
+            self.profile(len(rows))
+        return rows
+
+    def fetchone(self):
+        row = super().fetchone()
+        if self.profile is not None and row is not None:
+            self.profile(1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        return self._count(super().fetchmany(*args, **kwargs))
+
+    def fetchall(self):
+        return self._count(super().fetchall())
+
+
+class ProfilingConnection(sqlite3.Connection):
+
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+
+
+class StatementStats:
+    __slots__ = ('calls', 'seconds', 'max_seconds', 'rows')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+
+
+# Times every statement of an engine and attributes it to the db_queries function that ran it and
+# the route of the current request.
+#     Statement totals are kept per (function, route, statement). The query count, DB time and rows
+#     of the current request are kept in flask.g for the X-Query-* response headers. Statements
+#     slower than slow_query_ms are logged to slow_query_logger with their EXPLAIN QUERY PLAN.
+#     The time of a statement is its execution up to the first row: SQLite sorts, groups and writes
+#     inside that step, but rows of a plain scan are produced while they are fetched.
+class QueryProfiler:
+
+    def __init__(self, slow_query_ms=100, explain=True):
+        self._lock = threading.Lock()
+        self._statements = {}
+        self.slow_query_ms = slow_query_ms
+        self.explain = explain
+
+    # Listens to the engine's statements. New SQLite connections get cursors that also count fetched
+    # rows, so the pooled connections opened before are closed.
+    def install(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'do_connect', _use_profiling_connection)
+            engine.dispose()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context.profiler_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - context.profiler_start
+        function = _caller()
+        route = NO_ROUTE
+        request_totals = None
+        if has_request_context():
+            route = request.url_rule.rule if request.url_rule else NO_ROUTE
+            request_totals = g.get('query_profile')
+            if request_totals is None:
+                request_totals = g.query_profile = [0, 0.0, 0]
+            request_totals[0] += 1
+            request_totals[1] += seconds
+        rows = max(cursor.rowcount, 0)
+        with self._lock:
+            key = (function, route, statement)
+            stats = self._statements.get(key)
+            if stats is None:
+                stats = self._statements[key] = StatementStats()
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.rows += rows
+        if request_totals is not None:
+            request_totals[2] += rows
+        if isinstance(cursor, ProfilingCursor):
+            cursor.profile = self._row_counter(stats, request_totals)
+        if seconds * 1000 >= self.slow_query_ms:
+            self._log_slow_query(cursor, statement, parameters, executemany, function, route, seconds)
+
+    def _row_counter(self, stats, request_totals):
+        def count(rows):
+            with self._lock:
+                stats.rows += rows
+            if request_totals is not None:
+                request_totals[2] += rows
+
+        return count
+
+    def _log_slow_query(self, cursor, statement, parameters, executemany, function, route, seconds):
+        plan = ''
+        if self.explain and not executemany and isinstance(cursor, sqlite3.Cursor):
+            try:
+                steps = cursor.connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+                plan = '\n'.join(f"    {step[-1]}" for step in steps)
+            except sqlite3.Error as e:
+                plan = f"    (no plan: {e})"
+        # Parameters are left out, they hold patient details
+        slow_query_logger.warning(f"Slow query {seconds * 1000:.1f} ms in {function} for {route}\n"
+                                  f"{' '.join(statement.split())}" + (f"\n{plan}" if plan else ''))
+
+    # Query count, DB time and rows of the current request so far, None outside of requests.
+    def request_totals(self):
+        if not has_request_context():
+            return None
+        queries, seconds, rows = g.get('query_profile') or (0, 0.0, 0)
+        return {'queries': queries, 'seconds': seconds, 'rows': rows}
+
+    # Statement totals ordered by total time, and totals per function and route.
+    def summary(self, limit=SUMMARY_LIMIT):
+        with self._lock:
+            statements = [(key, stats.calls, stats.seconds, stats.max_seconds, stats.rows)
+                          for key, stats in self._statements.items()]
+        functions, routes = {}, {}
+        for (function, route, _), calls, seconds, _, rows in statements:
+            for totals, name in ((functions, function), (routes, route)):
+                entry = totals.setdefault(name, {'calls': 0, 'ms': 0.0, 'rows': 0})
+                entry['calls'] += calls
+                entry['ms'] += seconds * 1000
+                entry['rows'] += rows
+        statements.sort(key=lambda entry: entry[2], reverse=True)
+
+        def ordered(totals, label):
+            return [{label: name, **entry, 'ms': round(entry['ms'], 2)}
+                    for name, entry in sorted(totals.items(), key=lambda item: item[1]['ms'], reverse=True)]
+
+        return {
+            'statements': [
+                {'function': function, 'route': route, 'statement': ' '.join(statement.split()), 'calls': calls,
+                 'total_ms': round(seconds * 1000, 2), 'mean_ms': round(seconds * 1000 / calls, 3),
+                 'max_ms': round(max_seconds * 1000, 2), 'rows': rows}
+                for (function, route, statement), calls, seconds, max_seconds, rows in statements[:limit]
+            ],
+            'functions': ordered(functions, 'function'),
+            'routes': ordered(routes, 'route'),
+        }
+
+
+def _use_profiling_connection(dialect, connection_record, cargs, cparams):
+    cparams.setdefault('factory', ProfilingConnection)
+
+
+# Name of the public db_queries function running the current statement, so statements of helpers like
+# _list_page count for their caller, or module.function of the first caller outside SQLAlchemy when
+# it does not come from db_queries.
+def _caller():
+    frame = sys._getframe(2)
+    fallback = None
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module == QUERY_MODULE and not frame.f_code.co_name.startswith('_'):
+            return frame.f_code.co_name
+        if fallback is None and not module.startswith(_LIBRARY_MODULES):
+            fallback = f'{module}.{frame.f_code.co_name}'
+        frame = frame.f_back
+    return fallback or '<unknown>'
+
+
+# Adds the query count, DB time and fetched rows of each request to its response headers.
+def add_response_headers(app, profiler):
+
+    @app.after_request
+    def query_headers(response):
+        totals = profiler.request_totals()
+        if totals is not None:
+            response.headers['X-Query-Count'] = str(totals['queries'])
+            response.headers['X-Query-Time-Ms'] = f"{totals['seconds'] * 1000:.2f}"
+            response.headers['X-Query-Rows'] = str(totals['rows'])
+        return response
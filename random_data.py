@@ -1,156 +1,311 @@
-import random
+# Generates a synthetic hospital dataset for demos and load testing.
+#
+# Usage: python random_data.py [--scale 1] [--seed 42] [--workers 4] [--years 1] [--database-uri URI]
+#
+# Every unit of --scale adds SCALE_UNIT rows of each table (10,000 appointments per unit, so
+# --scale 1000 builds a 10M appointment database). Appointments span --years up to 30 days from
+# today, and on a given day the same --seed produces the same data whatever the number of workers.
+#
+# To look realistic for query plans and dashboards the data is skewed: doctor popularity follows
+# a Zipf distribution, appointment volume follows the season, weekday and hour of day, and each
+# doctor's appointments are distinct 30 minute working-hour slots, so they never overlap.
+# Names, contacts and addresses come from Faker in a process pool. Rows are bulk inserted with
+# executemany, and the search index, rollups and change log triggers are suspended during the load
+# and rebuilt once at the end.
+import argparse
 import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+
+import numpy as np
+import yaml
 from faker import Faker
-from models import db, User, Doctor, Address, Patient, Nurse, Appointment, Prescription, Diagnostic, Department
-from models import init_app
 from flask import Flask
-from flask_bcrypt import Bcrypt
+from sqlalchemy import text
 
-fake = Faker()
-
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.urandom(24)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///hospital.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-bcrypt = Bcrypt(app)
-init_app(app)
+from models import db, init_app, drop_triggers, restore_triggers
+from password_hashing import PasswordHasher
 
 DEPARTMENTS = ['Cardiology', 'Neurology', 'Orthopedics', 'Pediatrics', 'Oncology']
 CATEGORIES = ['Medicine', 'Surgery', 'Radiologist']
 DEGREES = ['PhD', 'PG', 'Masters', 'Bachelors', 'Specialization']
+TEST_NAMES = ['Blood test', 'X-Ray', 'MRI', 'CT scan', 'ECG', 'Ultrasound', 'Urinalysis', 'Biopsy']
 
-def insert_random_departments():
-    with app.app_context():
-        departments = []
-        for name in DEPARTMENTS:
-            existing_department = Department.query.filter_by(name=name).first()
-            if existing_department:
-                departments.append(existing_department)
-            else:
-                department = Department(name=name)
-                db.session.add(department)
-                departments.append(department)
-        db.session.commit()
-        return departments
-
-def insert_random_addresses(num_addresses):
-    addresses = []
-    for _ in range(num_addresses):
-        address = Address(
-            street=fake.street_address(),
-            county=fake.city(),
-            city=fake.city(),
-            state=fake.state(),
-            country=fake.country(),
-            zipcode=fake.zipcode()
-        )
-        db.session.add(address)
-        addresses.append(address)
-    db.session.commit()
-    return addresses
-
-def insert_random_users(num_users):
-    for _ in range(num_users):
-        username = fake.user_name()
-        password = bcrypt.generate_password_hash(fake.password()).decode('utf-8')
-        is_admin = random.choice([True, False])
-        user = User(username=username, password=password, is_admin=is_admin)
-        db.session.add(user)
-    db.session.commit()
+# Rows added per unit of --scale
+SCALE_UNIT = {
+    'doctors': 50,
+    'nurses': 100,
+    'patients': 2000,
+    'appointments': 10000,
+}
+USERS = 5
+# Zipf exponents of doctor popularity and patient visit frequency
+DOCTOR_POPULARITY = 1.1
+PATIENT_FREQUENCY = 0.6
+# Share of appointments with a diagnostic, each appointment gets a prescription like /add_appointment
+DIAGNOSTIC_RATE = 0.3
+# Working hours: slots of SLOT_MINUTES from OPENING_HOUR to CLOSING_HOUR, Monday to Saturday
+SLOT_MINUTES = 30
+OPENING_HOUR = 8
+CLOSING_HOUR = 18
+# Notes are drawn from a pool of Faker sentences, generating one per appointment would dominate the run
+TEXT_POOL_SIZE = 1000
+FAKER_POOL_SIZE = 500
+# Rows generated per Faker task and inserted per executemany
+PEOPLE_CHUNK = 20000
+DOCTOR_BATCH = 500
+INSERT_CHUNK = 50000
 
-def insert_random_doctors(num_doctors, departments, addresses):
-    with app.app_context():
-        departments = Department.query.all()
-        for _ in range(num_doctors):
-            doctor = Doctor(
-                name=fake.name(),
-                phone=fake.phone_number(),
-                email=fake.email(),
-                department_id=random.choice(departments).id,
-                category=random.choice(CATEGORIES),
-                experience=random.randint(1, 30),
-                degree=random.choice(DEGREES),
-                address_id=random.choice(addresses).id
-            )
-            db.session.add(doctor)
-        db.session.commit()
+SQLITE_DATETIME = '%Y-%m-%d %H:%M:%S'
 
-def insert_random_patients(num_patients, addresses):
-    for _ in range(num_patients):
-        patient = Patient(
-            name=fake.name(),
-            phone=fake.phone_number(),
-            email=fake.email(),
-            dob=fake.date_of_birth(minimum_age=0, maximum_age=100),
-            address_id=random.choice(addresses).id
-        )
-        db.session.add(patient)
-    db.session.commit()
+fake = Faker()
 
-def insert_random_nurses(num_nurses, doctors, addresses):
-    for _ in range(num_nurses):
-        nurse = Nurse(
-            name=fake.name(),
-            phone=fake.phone_number(),
-            email=fake.email(),
-            doctor_id=random.choice(doctors).id,
-            address_id=random.choice(addresses).id
-        )
-        db.session.add(nurse)
+
+def create_app(database_uri=None):
+    with open('configurations/config.yml', 'r') as config_file:
+        database_config = dict(yaml.safe_load(config_file).get('database', {}))
+    uri = database_config.pop('uri', 'sqlite:///hospital.db')
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = os.urandom(24)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri or uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Nothing is lost by a crash during generation that the next run would not redo
+    init_app(app, {**database_config, 'synchronous': 'off'})
+    return app
+
+
+def insert_rows(statement, rows):
+    for start in range(0, len(rows), INSERT_CHUNK):
+        db.session.execute(text(statement), rows[start:start + INSERT_CHUNK])
+
+
+def next_id(table):
+    return db.session.execute(text(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}")).scalar()
+
+
+def insert_departments():
+    for name in DEPARTMENTS:
+        db.session.execute(text("INSERT INTO department (name) VALUES (:name) ON CONFLICT DO NOTHING"), {'name': name})
     db.session.commit()
+    return db.session.execute(text("SELECT id FROM department ORDER BY id")).scalars().all()
 
-def insert_random_appointments(num_appointments, doctors, patients):
-    with app.app_context():
-        for _ in range(num_appointments):
-            from_time = fake.date_time_between(start_date='-1y', end_date='now')
-            to_time = from_time + timedelta(minutes=30)
-            appointment = Appointment(
-                doctor_id=random.choice(doctors).id,
-                patient_id=random.choice(patients).id,
-                from_time=from_time,
-                to_time=to_time,
-                notes=fake.text()
-            )
-            db.session.add(appointment)
-        db.session.commit()
 
-def insert_random_prescriptions(num_prescriptions, appointments):
-    for _ in range(num_prescriptions):
-        prescription = Prescription(
-            appointment_id=random.choice(appointments).id,
-            prescription_notes=fake.text()
-        )
-        db.session.add(prescription)
+def insert_users(seed):
+    fake.seed_instance(seed)
+    rng = np.random.default_rng(seed)
+    hasher = PasswordHasher()
+    hashes = hasher.hash_many([fake.password() for _ in range(USERS)])
+    hasher.shutdown()
+    for hashed in hashes:
+        db.session.execute(text("""
+            INSERT INTO user (username, password, is_admin) VALUES (:username, :password, :is_admin)
+            ON CONFLICT DO NOTHING
+        """), {
+            'username': fake.unique.user_name(),
+            'password': hashed,
+            'is_admin': bool(rng.integers(2))
+        })
     db.session.commit()
 
-def insert_random_diagnostics(num_diagnostics, appointments):
-    for _ in range(num_diagnostics):
-        diagnostic = Diagnostic(
-            appointment_id=random.choice(appointments).id,
-            test_name=fake.word(),
-            test_report=fake.text()
-        )
-        db.session.add(diagnostic)
+
+# Runs in the worker processes: details of `count` people with ids from first_id, each with their
+# own address id. Faker's name and place providers are slow, so every chunk draws those fields from
+# pools of FAKER_POOL_SIZE Faker values. Emails embed the id, so they stay unique at any scale.
+# Every chunk has its own seed, so the output does not depend on which worker generates it.
+def fake_people(kind, first_id, first_address_id, count, seed):
+    fake.seed_instance(seed)
+    rng = random.Random(seed)
+    pools = {field: [getattr(fake, field)() for _ in range(FAKER_POOL_SIZE)]
+             for field in ('first_name', 'last_name', 'street_address', 'city', 'phone_number')}
+    people, addresses = [], []
+    for offset in range(count):
+        first_name, last_name = rng.choice(pools['first_name']), rng.choice(pools['last_name'])
+        addresses.append({
+            'id': first_address_id + offset,
+            'street': rng.choice(pools['street_address']),
+            'county': rng.choice(pools['city']),
+            'city': rng.choice(pools['city']),
+            'state': fake.state(),
+            'country': fake.country(),
+            'zipcode': fake.zipcode()
+        })
+        person = {
+            'id': first_id + offset,
+            'name': f"{first_name} {last_name}",
+            'phone': rng.choice(pools['phone_number']),
+            'email': f"{first_name}.{last_name}.{kind}{first_id + offset}@{fake.free_email_domain()}".lower(),
+            'address_id': first_address_id + offset
+        }
+        if kind == 'patient':
+            person['dob'] = fake.date_of_birth(minimum_age=0, maximum_age=100).strftime(SQLITE_DATETIME)
+        people.append(person)
+    return people, addresses
+
+
+# Generates and inserts `count` people of a kind, `extra(rows, rng)` adds the kind's own columns.
+# Returns the ids of the new rows.
+def insert_people(pool, kind, count, seed, columns, extra=None):
+    first_id, first_address_id = next_id(kind), next_id('address')
+    tasks = [
+        pool.submit(fake_people, kind, first_id + start, first_address_id + start,
+                    min(PEOPLE_CHUNK, count - start), f'{seed}-{start}')
+        for start in range(0, count, PEOPLE_CHUNK)
+    ]
+    rng = np.random.default_rng(seed)
+    for task in tasks:
+        people, addresses = task.result()
+        if extra is not None:
+            extra(people, rng)
+        insert_rows("""
+            INSERT INTO address (id, street, county, city, state, country, zipcode)
+            VALUES (:id, :street, :county, :city, :state, :country, :zipcode)
+        """, addresses)
+        insert_rows(f"INSERT INTO {kind} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})",
+                    people)
     db.session.commit()
+    return np.arange(first_id, first_id + count)
+
+
+# Zipf weights over n items in a random order, so the popular ones are not simply the lowest ids.
+def zipf_weights(n, exponent, rng):
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+# Start times of all working slots in [start, end) and their relative booking volume:
+# a winter peak, quieter Saturdays and a late morning peak.
+def working_slots(start, end):
+    slots_per_day = (CLOSING_HOUR - OPENING_HOUR) * 60 // SLOT_MINUTES
+    days = np.arange(np.datetime64(start.date()), np.datetime64(end.date()), dtype='datetime64[D]')
+    weekday = (days.astype('int64') + 3) % 7
+    days = days[weekday < 6]
+    offsets = np.timedelta64(OPENING_HOUR * 60, 'm') + np.arange(slots_per_day) * np.timedelta64(SLOT_MINUTES, 'm')
+    times = (days[:, None] + offsets[None, :]).ravel()
+
+    day_of_year = (times.astype('datetime64[D]') - times.astype('datetime64[Y]')).astype('int64')
+    weekday = (times.astype('datetime64[D]').astype('int64') + 3) % 7
+    hour = (times - times.astype('datetime64[D]')).astype('timedelta64[m]').astype('int64') / 60
+    season = 1 + 0.3 * np.cos(2 * np.pi * (day_of_year - 15) / 365)
+    weekday_volume = np.where(weekday == 5, 0.5, 1.0) * np.where(weekday == 0, 1.2, 1.0)
+    hour_volume = 1 + 0.5 * np.exp(-((hour - 10.5) ** 2) / 4)
+    return times, season * weekday_volume * hour_volume
+
+
+# Appointments per doctor: a multinomial draw over the popularity weights, with the bookings that
+# exceed a doctor's number of slots moved to doctors with free slots.
+def appointments_per_doctor(total, weights, capacity, rng):
+    if total > capacity * len(weights):
+        raise ValueError(f"{total} appointments do not fit into {len(weights)} doctors with {capacity} slots each")
+    counts = rng.multinomial(total, weights)
+    while (counts > capacity).any():
+        overflow = int(np.maximum(counts - capacity, 0).sum())
+        counts = np.minimum(counts, capacity)
+        free = np.where(counts < capacity, weights, 0)
+        counts += rng.multinomial(overflow, free / free.sum())
+    return counts
+
+
+def text_pool(seed):
+    fake.seed_instance(seed)
+    return [fake.sentence(nb_words=8) for _ in range(TEXT_POOL_SIZE)]
+
+
+# Books each doctor's share of appointments into distinct slots, weighted by slot volume
+# (weighted sampling without replacement with exponential keys), a batch of doctors at a time.
+def insert_appointments(doctor_ids, patient_ids, total, start, end, seed):
+    rng = np.random.default_rng(seed)
+    notes = text_pool(seed)
+    times, volume = working_slots(start, end)
+    counts = appointments_per_doctor(total, zipf_weights(len(doctor_ids), DOCTOR_POPULARITY, rng), len(times), rng)
+    patient_cdf = np.cumsum(zipf_weights(len(patient_ids), PATIENT_FREQUENCY, rng))
+    slot_text = np.datetime_as_string(times, unit='s')
+    slot_end_text = np.datetime_as_string(times + np.timedelta64(SLOT_MINUTES, 'm'), unit='s')
+    now = np.datetime64(datetime.now())
+
+    appointment_id = next_id('appointment')
+    for batch_start in range(0, len(doctor_ids), DOCTOR_BATCH):
+        batch_counts = counts[batch_start:batch_start + DOCTOR_BATCH]
+        keys = rng.exponential(size=(len(batch_counts), len(times))) / volume
+        slots = np.concatenate([np.argpartition(row, count - 1)[:count] if count else np.empty(0, dtype=np.int64)
+                                for row, count in zip(keys, batch_counts)])
+        doctors = np.repeat(doctor_ids[batch_start:batch_start + DOCTOR_BATCH], batch_counts)
+        patients = patient_ids[np.minimum(np.searchsorted(patient_cdf, rng.random(len(slots))), len(patient_ids) - 1)]
+        note_ids = rng.integers(len(notes), size=(len(slots), 2))
+        ids = np.arange(appointment_id, appointment_id + len(slots))
+        appointment_id += len(slots)
+
+        insert_rows("""
+            INSERT INTO appointment (id, doctor_id, patient_id, from_time, to_time, notes)
+            VALUES (:id, :doctor_id, :patient_id, :from_time, :to_time, :notes)
+        """, [{
+            'id': int(ids[i]), 'doctor_id': int(doctors[i]), 'patient_id': int(patients[i]),
+            'from_time': slot_text[slots[i]].replace('T', ' '), 'to_time': slot_end_text[slots[i]].replace('T', ' '),
+            'notes': notes[note_ids[i, 0]]
+        } for i in range(len(slots))])
+        # Appointments that have not happened yet have an empty prescription, like new bookings
+        past = times[slots] < now
+        insert_rows("""
+            INSERT INTO prescription (appointment_id, prescription_notes) VALUES (:appointment_id, :notes)
+        """, [{'appointment_id': int(ids[i]), 'notes': notes[note_ids[i, 1]] if past[i] else ''}
+              for i in range(len(slots))])
+        diagnosed = np.flatnonzero(past & (rng.random(len(slots)) < DIAGNOSTIC_RATE))
+        insert_rows("""
+            INSERT INTO diagnostic (appointment_id, test_name, test_report) VALUES (:appointment_id, :test_name, :report)
+        """, [{'appointment_id': int(ids[i]), 'test_name': TEST_NAMES[note_ids[i, 0] % len(TEST_NAMES)],
+               'report': notes[note_ids[i, 1]]} for i in diagnosed])
+        db.session.commit()
+        print(f"  appointments: {int(counts[:batch_start + len(batch_counts)].sum())} of {total}", end='\r', flush=True)
+    print()
+
 
 def main():
-    with app.app_context():
-        departments = insert_random_departments()
-        addresses = insert_random_addresses(20)
-        insert_random_users(5)
-        insert_random_doctors(15, departments, addresses)
-        insert_random_patients(20, addresses)
+    parser = argparse.ArgumentParser(description='Generate a synthetic hospital dataset.')
+    parser.add_argument('--scale', type=float, default=1, help='Multiples of 10,000 appointments and their people')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Faker processes')
+    parser.add_argument('--years', type=float, default=1, help='Years of history, plus 30 days ahead')
+    parser.add_argument('--database-uri', default=None, help='Defaults to the uri of the database configuration')
+    args = parser.parse_args()
+
+    sizes = {table: max(1, round(count * args.scale)) for table, count in SCALE_UNIT.items()}
+    end = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=30)
+    start = end - timedelta(days=round(365 * args.years) + 30)
+    app = create_app(args.database_uri)
+    began = time.perf_counter()
+    with app.app_context(), ProcessPoolExecutor(max_workers=args.workers) as pool:
+        drop_triggers()
+        try:
+            departments = np.array(insert_departments())
+            insert_users(args.seed)
+
+            def doctor_details(doctors, rng):
+                for doctor in doctors:
+                    doctor.update(department_id=int(rng.choice(departments)), category=str(rng.choice(CATEGORIES)),
+                                  experience=int(rng.integers(1, 31)), degree=str(rng.choice(DEGREES)))
+
+            doctor_ids = insert_people(pool, 'doctor', sizes['doctors'], args.seed + 1, [
+                'id', 'name', 'phone', 'email', 'department_id', 'category', 'experience', 'degree', 'address_id'
+            ], doctor_details)
+
+            def nurse_details(nurses, rng):
+                for nurse in nurses:
+                    nurse['doctor_id'] = int(rng.choice(doctor_ids))
 
-        doctors = Doctor.query.all()
-        patients = Patient.query.all()
+            insert_people(pool, 'nurse', sizes['nurses'], args.seed + 2,
+                          ['id', 'name', 'phone', 'email', 'doctor_id', 'address_id'], nurse_details)
+            patient_ids = insert_people(pool, 'patient', sizes['patients'], args.seed + 3,
+                                        ['id', 'name', 'dob', 'phone', 'email', 'address_id'])
+            print(f"People generated in {time.perf_counter() - began:.1f}s")
 
-        insert_random_nurses(10, doctors, addresses)
-        insert_random_appointments(30, doctors, patients)
+            insert_appointments(doctor_ids, patient_ids, sizes['appointments'], start, end, args.seed + 4)
+            print(f"Appointments generated in {time.perf_counter() - began:.1f}s")
+        finally:
+            restore_triggers()
+    print(f"Done in {time.perf_counter() - began:.1f}s: {sizes}")
 
-        appointments = Appointment.query.all()
-        insert_random_prescriptions(20, appointments)
-        insert_random_diagnostics(15, appointments)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -18,6 +18,26 @@ function isValidDate(appointmentDate) {
 document.addEventListener('DOMContentLoaded', function() {
   addModal = new bootstrap.Modal(document.getElementById('addModal'));
   editModal = new bootstrap.Modal(document.getElementById('editModal'));
+  attachTypeahead({
+    input: document.getElementById('patientSearch'),
+    select: document.getElementById('patient'),
+    url: '/typeahead/patients',
+  });
+  attachTypeahead({
+    input: document.getElementById('doctorSearch'),
+    select: document.getElementById('doctor'),
+    url: '/typeahead/doctors',
+  });
+  attachTypeahead({
+    input: document.getElementById('editPatientSearch'),
+    select: document.getElementById('editPatient'),
+    url: '/typeahead/patients',
+  });
+  attachTypeahead({
+    input: document.getElementById('editDoctorSearch'),
+    select: document.getElementById('editDoctor'),
+    url: '/typeahead/doctors',
+  });
 
   const patientInput = document.getElementById('patient');
   const departmentSelect = document.getElementById('department');
@@ -116,52 +136,25 @@ document.addEventListener('DOMContentLoaded', function() {
 
 
     const searchInput = document.getElementById('searchInput');
-    const table = document.getElementById('appointmentsTable');
-    const rows = table.getElementsByTagName('tr');
-
     const fromDateInput = document.getElementById('fromDate');
     const toDateInput = document.getElementById('toDate');
 
-    function filterAppointments() {
-        const searchTerm = searchInput.value.toLowerCase();
-        const fromDate = fromDateInput.value ? new Date(fromDateInput.value+'T00:00:00') : null;
-        const toDate = toDateInput.value ? new Date(toDateInput.value+'T23:59:59') : null;
-
-        for (let i = 1; i < rows.length; i++) {
-            const row = rows[i];
-            const cells = row.getElementsByTagName('td');
-            let found = false;
-            let dateInRange = true;
-
-            for (let j = 0; j < cells.length; j++) {
-                const cellText = cells[j].textContent.toLowerCase();
-                if (cellText.includes(searchTerm)) {
-                    found = true;
-                }
-
-                // Check if the appointment date is within the selected range
-                if (j === 2) {
-                    const appointmentDate = new Date(cellText);
-                    if (fromDate && appointmentDate < fromDate) {
-                        dateInRange = false;
-                    }
-                    if (toDate && appointmentDate > toDate) {
-                        dateInRange = false;
-                    }
-                }
-            }
-
-            if (found && dateInRange) {
-                row.style.display = '';
-            } else {
-                row.style.display = 'none';
-            }
-        }
-    }
+    const appointmentsTable = new PagedTable({
+        url: '/list_appointments',
+        table: document.getElementById('appointmentsTable'),
+        loadMoreButton: document.getElementById('loadMoreButton'),
+        renderRow: renderAppointmentRow,
+        params: () => ({
+            q: searchInput.value.trim(),
+            from_date: fromDateInput.value,
+            to_date: toDateInput.value,
+        }),
+    });
 
-    searchInput.addEventListener('keyup', filterAppointments);
-    fromDateInput.addEventListener('change', filterAppointments);
-    toDateInput.addEventListener('change', filterAppointments);
+    searchInput.addEventListener('keyup', debounce(() => appointmentsTable.reload(), 250));
+    fromDateInput.addEventListener('change', () => appointmentsTable.reload());
+    toDateInput.addEventListener('change', () => appointmentsTable.reload());
+    appointmentsTable.reload();
 
     const fromTimeInput = document.getElementById('from_time');
     const toTimeInput = document.getElementById('to_time');
@@ -190,7 +183,34 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 });
 
+function renderAppointmentRow(appointment) {
+    return `
+        <tr>
+            <td>${escapeHtml(appointment.doctor_name)}</td>
+            <td>${escapeHtml(appointment.patient_name)}</td>
+            <td>${formatDate(appointment.from_time, true)}</td>
+            <td>${formatDate(appointment.to_time, true)}</td>
+            <td>${escapeHtml(appointment.notes)}</td>
+            <td>
+                <button class="btn btn-sm btn-success" onclick="openPrescriptionModal(${appointment.id})">Show <i class="fas fa-file-medical"></i></button>
+            </td>
+            <td>
+                <button class="btn btn-sm btn-primary" onclick="showDiagnosticModal(${appointment.id})">Show <i class="fas fa-prescription"></i></button>
+            </td>
+            <td>
+                <button class="btn btn-sm btn-warning" onclick="openEditModal(${appointment.id})">Edit</button>
+            </td>
+            <td>
+                <button class="btn btn-sm btn-danger" onclick="deleteAppointment(${appointment.id})">Delete</button>
+            </td>
+        </tr>`;
+}
+
+// The patient and doctor lists start with the first matches of an empty search
 function openAddModal() {
+  for (const id of ['patientSearch', 'doctorSearch']) {
+    document.getElementById(id).dispatchEvent(new Event('input'));
+  }
   addModal.show();
 }
 
@@ -208,6 +228,8 @@ function openEditModal(id) {
       const patients = data.patients;
 
       document.getElementById('editAppointmentId').value = appointment.id;
+      document.getElementById('editPatientSearch').value = '';
+      document.getElementById('editDoctorSearch').value = '';
 
       const editPatientSelect = document.getElementById('editPatient');
       editPatientSelect.innerHTML = patients.map(patient =>
@@ -4,32 +4,18 @@ document.addEventListener("DOMContentLoaded", function () {
   addModal = new bootstrap.Modal(document.getElementById("addModal"));
   editModal = new bootstrap.Modal(document.getElementById("editModal"));
   const searchInput = document.getElementById("searchInput");
-  const table = document.getElementById("doctorsTable");
-  const rows = table.getElementsByTagName("tr");
-
-  searchInput.addEventListener("keyup", function () {
-    const searchTerm = searchInput.value.toLowerCase();
-
-    for (let i = 1; i < rows.length; i++) {
-      const row = rows[i];
-      const cells = row.getElementsByTagName("td");
-      let found = false;
-
-      for (let j = 0; j < cells.length; j++) {
-        const cellText = cells[j].textContent.toLowerCase();
-        if (cellText.includes(searchTerm)) {
-          found = true;
-          break;
-        }
-      }
-
-      if (found) {
-        row.style.display = "";
-      } else {
-        row.style.display = "none";
-      }
-    }
+  const departmentFilter = document.getElementById("departmentFilter");
+  const doctorsTable = new PagedTable({
+    url: "/list_doctors",
+    table: document.getElementById("doctorsTable"),
+    loadMoreButton: document.getElementById("loadMoreButton"),
+    renderRow: renderDoctorRow,
+    params: () => ({ q: searchInput.value.trim(), department_id: departmentFilter.value }),
   });
+
+  searchInput.addEventListener("keyup", debounce(() => doctorsTable.reload(), 250));
+  departmentFilter.addEventListener("change", () => doctorsTable.reload());
+  doctorsTable.reload();
 });
 
 function isValidPhoneNumber(phone) {
@@ -46,6 +32,26 @@ function validateEmail(email) {
 }
 
 
+function renderDoctorRow(doctor) {
+  return `
+    <tr>
+      <td>${escapeHtml(doctor.name)}</td>
+      <td>${escapeHtml(doctor.phone)}</td>
+      <td>${escapeHtml(doctor.email)}</td>
+      <td>${escapeHtml(doctor.department_name)}</td>
+      <td>${escapeHtml(doctor.category)}</td>
+      <td>${escapeHtml(doctor.experience)}</td>
+      <td>${escapeHtml(doctor.degree)}</td>
+      <td>${formatAddress(doctor)}</td>
+      <td>
+        <button class="btn btn-sm btn-warning" onclick="openEditModal(${doctor.id})">Edit</button>
+      </td>
+      <td>
+        <button class="btn btn-sm btn-danger" onclick="deleteDoctor(${doctor.id})">Delete</button>
+      </td>
+    </tr>`;
+}
+
 function openAddModal() {
   addModal.show();
 }
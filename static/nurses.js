@@ -16,9 +16,19 @@ function validateEmail(email) {
 document.addEventListener("DOMContentLoaded", function () {
   addModal = new bootstrap.Modal(document.getElementById("addModal"));
   editModal = new bootstrap.Modal(document.getElementById("editModal"));
+  attachTypeahead({
+    input: document.getElementById("editDoctorSearch"),
+    select: document.getElementById("editDoctor"),
+    url: "/typeahead/doctors",
+  });
   const searchInput = document.getElementById("searchInput");
-  const table = document.getElementById("nursesTable");
-  const rows = table.getElementsByTagName("tr");
+  const nursesTable = new PagedTable({
+    url: "/list_nurses",
+    table: document.getElementById("nursesTable"),
+    loadMoreButton: document.getElementById("loadMoreButton"),
+    renderRow: renderNurseRow,
+    params: () => ({ q: searchInput.value.trim() }),
+  });
 
   document
     .getElementById("addNurseForm")
@@ -129,31 +139,27 @@ document.addEventListener("DOMContentLoaded", function () {
       }
     });
 
-  searchInput.addEventListener("keyup", function () {
-    const searchTerm = searchInput.value.toLowerCase();
-
-    for (let i = 1; i < rows.length; i++) {
-      const row = rows[i];
-      const cells = row.getElementsByTagName("td");
-      let found = false;
-
-      for (let j = 0; j < cells.length; j++) {
-        const cellText = cells[j].textContent.toLowerCase();
-        if (cellText.includes(searchTerm)) {
-          found = true;
-          break;
-        }
-      }
-
-      if (found) {
-        row.style.display = "";
-      } else {
-        row.style.display = "none";
-      }
-    }
-  });
+  searchInput.addEventListener("keyup", debounce(() => nursesTable.reload(), 250));
+  nursesTable.reload();
 });
 
+function renderNurseRow(nurse) {
+  return `
+    <tr>
+      <td>${escapeHtml(nurse.name)}</td>
+      <td>${escapeHtml(nurse.phone)}</td>
+      <td>${escapeHtml(nurse.email)}</td>
+      <td>${escapeHtml(nurse.doctor_name)}</td>
+      <td>${formatAddress(nurse)}</td>
+      <td>
+        <button class="btn btn-sm btn-warning" onclick="openEditModal(${nurse.id})">Edit</button>
+      </td>
+      <td>
+        <button class="btn btn-sm btn-danger" onclick="deleteNurse(${nurse.id})">Delete</button>
+      </td>
+    </tr>`;
+}
+
 function openAddModal() {
   addModal.show();
 }
@@ -171,6 +177,7 @@ function openEditModal(id) {
       document.getElementById("editNurseId").value = id;
       const nurse = data.nurse;
       const doctors = data.doctors;
+      document.getElementById("editDoctorSearch").value = "";
       const editDoctorSelect = document.getElementById('editDoctor');
             editDoctorSelect.innerHTML = doctors.map(doctor =>
               `<option value="${doctor.id}" ${doctor.id == nurse.doctor_id ? 'selected' : ''}>${doctor.name}</option>`
@@ -0,0 +1,132 @@
+// Fills a table from one of the /list_* endpoints, one page at a time.
+// Searching, filtering and sorting happen on the server, the table only ever holds
+// the pages the user has asked for.
+class PagedTable {
+  constructor({ url, table, loadMoreButton, renderRow, params }) {
+    this.url = url;
+    this.tbody = table.querySelector("tbody");
+    this.loadMoreButton = loadMoreButton;
+    this.renderRow = renderRow;
+    this.params = params || (() => ({}));
+    this.sort = null;
+    this.order = null;
+    this.cursor = null;
+    this.requestId = 0;
+
+    this.loadMoreButton.addEventListener("click", () => this.loadMore());
+    table.querySelectorAll("th[data-sort]").forEach((header) => {
+      header.style.cursor = "pointer";
+      header.addEventListener("click", () => {
+        this.order = this.sort === header.dataset.sort && this.order === "asc" ? "desc" : "asc";
+        this.sort = header.dataset.sort;
+        this.reload();
+      });
+    });
+  }
+
+  reload() {
+    this.cursor = null;
+    this.fetchPage(true);
+  }
+
+  loadMore() {
+    if (this.cursor) {
+      this.fetchPage(false);
+    }
+  }
+
+  fetchPage(replace) {
+    const query = new URLSearchParams();
+    Object.entries(this.params()).forEach(([key, value]) => {
+      if (value) {
+        query.set(key, value);
+      }
+    });
+    if (this.sort) {
+      query.set("sort", this.sort);
+      query.set("order", this.order);
+    }
+    if (!replace) {
+      query.set("cursor", this.cursor);
+    }
+
+    // Only the latest request may update the table, earlier keystrokes are dropped
+    const requestId = ++this.requestId;
+    this.loadMoreButton.disabled = true;
+    fetch(`${this.url}?${query}`)
+      .then((response) => response.json())
+      .then((data) => {
+        if (requestId !== this.requestId) {
+          return;
+        }
+        if (data.error) {
+          alert(data.error);
+          return;
+        }
+        const rows = data.items.map(this.renderRow).join("");
+        if (replace) {
+          this.tbody.innerHTML = rows;
+        } else {
+          this.tbody.insertAdjacentHTML("beforeend", rows);
+        }
+        this.cursor = data.next_cursor;
+        this.loadMoreButton.classList.toggle("d-none", !this.cursor);
+      })
+      .finally(() => {
+        this.loadMoreButton.disabled = false;
+      });
+  }
+}
+
+function escapeHtml(value) {
+  return String(value ?? "")
+    .replace(/&/g, "&amp;")
+    .replace(/</g, "&lt;")
+    .replace(/>/g, "&gt;")
+    .replace(/"/g, "&quot;")
+    .replace(/'/g, "&#39;");
+}
+
+function formatAddress(row) {
+  return escapeHtml(`${row.street}, ${row.county}, ${row.city}, ${row.state}, ${row.country} - ${row.zipcode}`);
+}
+
+// SQLite returns "YYYY-MM-DD HH:MM:SS", matches the strftime formats the templates used
+function formatDate(value, withTime) {
+  const date = new Date(String(value).replace(" ", "T"));
+  const options = { month: "short", day: "2-digit", year: "numeric" };
+  if (withTime) {
+    Object.assign(options, { hour: "2-digit", minute: "2-digit" });
+  }
+  return escapeHtml(date.toLocaleString("en-US", options));
+}
+
+function debounce(fn, wait) {
+  let timeout;
+  return function (...args) {
+    clearTimeout(timeout);
+    timeout = setTimeout(() => fn.apply(this, args), wait);
+  };
+}
+
+// Fills a <select> with the entities matching what is typed into a search box, from one of the
+// /typeahead/* endpoints. The selected option stays first, so the dialog only needs to be given the
+// entity its record references.
+function attachTypeahead({ input, select, url }) {
+  let requestId = 0;
+  input.addEventListener("input", debounce(() => {
+    const current = ++requestId;
+    fetch(`${url}?${new URLSearchParams({ q: input.value.trim() })}`)
+      .then((response) => response.json())
+      .then((data) => {
+        if (current !== requestId) {
+          return;
+        }
+        const selected = select.selectedOptions[0];
+        const options = data.results
+          .filter((entity) => !selected || String(entity.id) !== selected.value)
+          .map((entity) => new Option(`${entity.name} (${entity.email})`, entity.id));
+        select.replaceChildren(...(selected ? [selected] : []), ...options);
+      });
+  }, 250));
+}
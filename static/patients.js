@@ -33,8 +33,13 @@ document.addEventListener("DOMContentLoaded", function () {
   addModal = new bootstrap.Modal(document.getElementById("addModal"));
   editModal = new bootstrap.Modal(document.getElementById("editModal"));
   const searchInput = document.getElementById("searchInput");
-  const table = document.getElementById("patientsTable");
-  const rows = table.getElementsByTagName("tr");
+  const patientsTable = new PagedTable({
+    url: "/list_patients",
+    table: document.getElementById("patientsTable"),
+    loadMoreButton: document.getElementById("loadMoreButton"),
+    renderRow: renderPatientRow,
+    params: () => ({ q: searchInput.value.trim() }),
+  });
 
   document
     .getElementById("addPatientForm")
@@ -157,31 +162,27 @@ document.addEventListener("DOMContentLoaded", function () {
       }
     });
 
-  searchInput.addEventListener("keyup", function () {
-    const searchTerm = searchInput.value.toLowerCase();
-
-    for (let i = 1; i < rows.length; i++) {
-      const row = rows[i];
-      const cells = row.getElementsByTagName("td");
-      let found = false;
-
-      for (let j = 0; j < cells.length; j++) {
-        const cellText = cells[j].textContent.toLowerCase();
-        if (cellText.includes(searchTerm)) {
-          found = true;
-          break;
-        }
-      }
-
-      if (found) {
-        row.style.display = "";
-      } else {
-        row.style.display = "none";
-      }
-    }
-  });
+  searchInput.addEventListener("keyup", debounce(() => patientsTable.reload(), 250));
+  patientsTable.reload();
 });
 
+function renderPatientRow(patient) {
+  return `
+    <tr>
+      <td>${escapeHtml(patient.name)}</td>
+      <td>${formatDate(patient.dob, false)}</td>
+      <td>${escapeHtml(patient.phone)}</td>
+      <td>${escapeHtml(patient.email)}</td>
+      <td>${formatAddress(patient)}</td>
+      <td>
+        <button class="btn btn-sm btn-warning" onclick="openEditModal(${patient.id})">Edit</button>
+      </td>
+      <td>
+        <button class="btn btn-sm btn-danger" onclick="deletePatient(${patient.id})">Delete</button>
+      </td>
+    </tr>`;
+}
+
 function openAddModal() {
   addModal.show();
 }
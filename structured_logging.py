@@ -0,0 +1,135 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import has_request_context, request, session
+
+# Records waiting for the writer thread, further records are dropped instead of blocking a request
+QUEUE_SIZE = 10000
+# Attributes every LogRecord has, everything else was passed in `extra` and is written as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+# Writes each record as one JSON object per line.
+# The message is formatted here, in the writer thread, from the template and arguments of the call.
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and not name.startswith('_'):
+                entry[name] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+# Keeps a share of the INFO records of each event, given by extra={'event': ...}.
+# Warnings and errors are always kept. Kept records of sampled events carry their sample_rate,
+# so counts taken from the log can be scaled back up.
+class SamplingFilter(logging.Filter):
+
+    def __init__(self, rates=None):
+        super().__init__()
+        rates = dict(rates or {})
+        self.default = rates.pop('default', 1.0)
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno != logging.INFO:
+            return True
+        rate = self.rates.get(getattr(record, 'event', None), self.default)
+        if rate >= 1:
+            return True
+        if random.random() >= rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+# Adds the user, route and client of the current request to its records.
+class RequestContextFilter(logging.Filter):
+
+    def filter(self, record):
+        if has_request_context():
+            record.user = session.get('username')
+            record.route = request.url_rule.rule if request.url_rule else request.path
+            record.method = request.method
+            record.remote_addr = request.remote_addr
+        return True
+
+
+# Queues records without formatting them and never blocks: when the queue is full the record is
+# dropped, and the next queued record reports how many were.
+class NonBlockingQueueHandler(QueueHandler):
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self._lock_dropped = threading.Lock()
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        if self.dropped:
+            with self._lock_dropped:
+                record.dropped_records, self.dropped = self.dropped, 0
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock_dropped:
+                self.dropped += 1 + getattr(record, 'dropped_records', 0)
+
+
+# Sends the records of `logger` through a queue to `handlers`, which run in a writer thread.
+#     Args:
+#         logger (logging.Logger): Its current handlers are replaced.
+#         handlers (list of logging.Handler): Where the writer thread sends the records.
+#         filters (list of logging.Filter): Run in the logging thread before a record is queued.
+#         queue_size (int): Records that may wait for the writer thread.
+
+#     Returns:
+#         QueueListener: The started listener, it is stopped and drained at exit.
+def queue_logging(logger, handlers, filters=(), queue_size=QUEUE_SIZE):
+    records = queue.Queue(queue_size)
+    handler = NonBlockingQueueHandler(records)
+    for log_filter in filters:
+        handler.addFilter(log_filter)
+    for old_handler in list(logger.handlers):
+        logger.removeHandler(old_handler)
+    logger.addHandler(handler)
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop, listener)
+    return listener
+
+
+# QueueListener.stop fails when the listener was already stopped
+def _stop(listener):
+    if listener._thread is not None:
+        listener.stop()
+
+
+# JSON lines file handler with size based rotation, for the writer thread.
+def json_file_handler(path, max_bytes=1024 * 1024, backup_count=10):
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def console_handler():
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s in %(module)s: %(message)s'))
+    return handler
@@ -0,0 +1,58 @@
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import text
+
+# app.py binds its database on import, the tests get one of their own
+os.environ['HOSPITAL_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='hms-test-'), 'hospital.db')}"
+
+import app as hospital_app  # noqa: E402
+import db_queries  # noqa: E402
+from cache import data_versions  # noqa: E402
+from models import db  # noqa: E402
+
+
+# The Flask app inside an app context. Every test starts with empty tables and cold caches.
+@pytest.fixture
+def app():
+    with hospital_app.app.app_context():
+        yield hospital_app.app
+        db.session.remove()
+        tables = [table.name for table in reversed(db.metadata.sorted_tables)]
+        for table in tables:
+            db.session.execute(text(f'DELETE FROM "{table}"'))
+        db.session.commit()
+        data_versions.bump(*tables)
+        for cache in hospital_app.result_caches.values():
+            cache.clear()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+# Logs the client in as the given user without a password check, and returns it.
+@pytest.fixture
+def log_in(client):
+    def log_in(user_id=1, username='admin', is_admin=True):
+        with client.session_transaction() as session:
+            session.update(user_id=user_id, username=username, is_admin=is_admin)
+        return client
+
+    return log_in
+
+
+# Inserts a doctor and a patient and returns their ids.
+@pytest.fixture
+def people(app):
+    doctor_id = db.session.execute(text("""
+        INSERT INTO doctor (name, phone, email, category, experience, degree)
+        VALUES ('Doctor', '0', 'doctor@example.com', 'Medicine', 1, 'PhD')
+    """)).lastrowid
+    patient_id = db.session.execute(text("""
+        INSERT INTO patient (name, phone, email, dob) VALUES ('Patient', '0', 'patient@example.com', '1990-01-01 00:00:00')
+    """)).lastrowid
+    db.session.commit()
+    return doctor_id, patient_id
@@ -0,0 +1,142 @@
+import dataclasses
+
+import pytest
+from sqlalchemy import text
+
+import db_queries
+from analytics import AnalyticsEngine
+from models import db
+
+# The dashboard queries the analytics engine replaces, as they aggregated the appointment table
+BASELINE = {
+    'patients_per_doctor': """
+        SELECT doctor.id AS doctor_id, doctor.name AS doctor_name, COUNT(DISTINCT patient.id) AS patient_count
+        FROM doctor
+        LEFT JOIN appointment ON doctor.id = appointment.doctor_id
+        LEFT JOIN patient ON appointment.patient_id = patient.id
+        GROUP BY doctor.id, doctor.name
+        ORDER BY doctor.id
+    """,
+    'patients_per_department': """
+        SELECT d.name AS department_name, COUNT(p.id) AS patient_count
+        FROM Department d
+        LEFT JOIN Doctor doc ON d.id = doc.department_id
+        LEFT JOIN Appointment a ON doc.id = a.doctor_id
+        LEFT JOIN Patient p ON a.patient_id = p.id
+        GROUP BY d.name
+    """,
+    'daily': """
+        SELECT DATE(a.from_time) AS date, COUNT(DISTINCT p.id) AS patient_count
+        FROM Appointment a JOIN Patient p ON a.patient_id = p.id
+        GROUP BY 1 ORDER BY 1
+    """,
+    'monthly': """
+        SELECT strftime('%Y-%m', a.from_time) AS date, COUNT(DISTINCT p.id) AS patient_count
+        FROM Appointment a JOIN Patient p ON a.patient_id = p.id
+        GROUP BY 1 ORDER BY 1
+    """,
+    'yearly': """
+        SELECT strftime('%Y', a.from_time) AS date, COUNT(DISTINCT p.id) AS patient_count
+        FROM Appointment a JOIN Patient p ON a.patient_id = p.id
+        GROUP BY 1 ORDER BY 1
+    """,
+    'top_diagnostics_per_patient': """
+        SELECT p.name AS patient_name, COUNT(d.id) AS diagnostics_count
+        FROM Patient p
+        LEFT JOIN Appointment a ON p.id = a.patient_id
+        LEFT JOIN Diagnostic d ON a.id = d.appointment_id
+        GROUP BY p.name
+        ORDER BY diagnostics_count DESC, p.name
+    """,
+}
+
+
+# Three departments (Oncology without doctors), three doctors (doctor 3 without
+# appointments), four patients (patients 1 and 4 share a name, patient 3 has no appointments) and
+# appointments across two days, months and years with zero to two diagnostics each.
+@pytest.fixture
+def hospital(app):
+    statements = [
+        "INSERT INTO department (id, name) VALUES (1, 'Cardiology'), (2, 'Neurology'), (3, 'Oncology')",
+        """INSERT INTO doctor (id, name, phone, email, department_id, category, experience, degree)
+           VALUES (1, 'Doctor 1', '0', 'd1@example.com', 1, 'Medicine', 1, 'PhD'),
+                  (2, 'Doctor 2', '0', 'd2@example.com', 2, 'Medicine', 1, 'PhD'),
+                  (3, 'Doctor 3', '0', 'd3@example.com', 2, 'Medicine', 1, 'PhD')""",
+        "INSERT INTO patient (id, name, email, dob) VALUES "
+        "(1, 'Ann', 'p1@example.com', '1990-01-01 00:00:00'), "
+        "(2, 'Bob', 'p2@example.com', '1990-01-01 00:00:00'), "
+        "(3, 'Cid', 'p3@example.com', '1990-01-01 00:00:00'), "
+        "(4, 'Ann', 'p4@example.com', '1990-01-01 00:00:00')",
+        "INSERT INTO appointment (id, doctor_id, patient_id, from_time, to_time) VALUES "
+        "(1, 1, 1, '2029-12-31 09:00:00', '2029-12-31 09:30:00'), "
+        "(2, 1, 1, '2030-01-01 09:00:00', '2030-01-01 09:30:00'), "
+        "(3, 2, 1, '2030-01-01 10:00:00', '2030-01-01 10:30:00'), "
+        "(4, 2, 2, '2030-01-01 11:00:00', '2030-01-01 11:30:00'), "
+        "(5, 2, 4, '2030-02-01 11:00:00', '2030-02-01 11:30:00')",
+        "INSERT INTO diagnostic (appointment_id, test_name) VALUES (1, 'ECG'), (2, 'MRI'), (4, 'X-Ray'), (4, 'CT')",
+    ]
+    for statement in statements:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+
+def baseline(name):
+    return [tuple(row) for row in db.session.execute(text(BASELINE[name]))]
+
+
+def rows(df):
+    return list(df.itertuples(index=False, name=None))
+
+
+def assert_matches_baseline(engine):
+    assert rows(engine.patients_per_doctor()) == baseline('patients_per_doctor')
+    assert rows(engine.patients_per_department()) == baseline('patients_per_department')
+    for time_frame in ('daily', 'monthly', 'yearly'):
+        assert rows(engine.patients_over_time(time_frame)) == baseline(time_frame)
+    assert rows(engine.top_diagnostics_per_patient(10)) == baseline('top_diagnostics_per_patient')
+
+
+def test_series_match_the_baseline_queries(hospital):
+    engine = AnalyticsEngine()
+    assert_matches_baseline(engine)
+    # Patients without appointments are counted with no diagnostics, patients sharing a name together
+    assert rows(engine.top_diagnostics_per_patient(10)) == [('Ann', 2), ('Bob', 2), ('Cid', 0)]
+    assert rows(engine.top_diagnostics_per_patient(1)) == [('Ann', 2)]
+
+
+def test_series_follow_writes(hospital):
+    engine = AnalyticsEngine()
+    assert_matches_baseline(engine)
+    db_queries.delete_appointment(1)
+    db_queries.add_diagnostic(5, {'test_name': 'ECG', 'test_report': None})
+    db_queries.edit_appointment(3, 1, 2, '2030-03-01 10:00:00', '2030-03-01 10:30:00', None)
+    assert_matches_baseline(engine)
+    assert rows(engine.top_diagnostics_per_patient(2)) == [('Ann', 2), ('Bob', 2)]
+
+
+def test_empty_database(app):
+    engine = AnalyticsEngine()
+    assert rows(engine.patients_per_doctor()) == []
+    assert rows(engine.patients_over_time('daily')) == []
+    assert rows(engine.top_diagnostics_per_patient(10)) == []
+
+
+def test_series_are_copies(hospital):
+    engine = AnalyticsEngine()
+    df = engine.patients_per_doctor()
+    df.loc[0, 'patient_count'] = 100
+    assert rows(engine.patients_per_doctor()) == baseline('patients_per_doctor')
+
+
+def test_cached_query_results_cannot_be_modified(hospital):
+    queries = (db_queries.count_patients_per_doctor, db_queries.count_patients_per_department,
+               db_queries.count_patients_daily, db_queries.count_patients_monthly, db_queries.count_patients_yearly,
+               lambda: db_queries.count_top_diagnostics_per_patient(10))
+    for query in queries:
+        rows = query()
+        assert isinstance(rows, tuple)
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            setattr(rows[0], rows[0]._fields[-1], 100)
+        assert query() is rows
+    assert [(row.doctor_id, row.doctor_name, row.patient_count) for row in db_queries.count_patients_per_doctor()] == \
+        baseline('patients_per_doctor')
@@ -0,0 +1,91 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+import db_queries
+from models import BOOKING_CONFLICT, db
+
+CONFLICT = {'success': False, 'message': BOOKING_CONFLICT}
+
+
+def at(hour, minute=0):
+    return datetime(2030, 1, 1, hour, minute)
+
+
+# Lets bookings through the check that runs before the write, as when another booking of the
+# slot commits right after it, so that only the booking guard trigger stands in the way.
+@pytest.fixture
+def race(monkeypatch):
+    monkeypatch.setattr(db_queries, 'find_conflicting_appointment', lambda *args, **kwargs: None)
+
+
+def appointments():
+    rows = db.session.execute(text("SELECT doctor_id, from_time, to_time FROM appointment ORDER BY from_time"))
+    return [tuple(row) for row in rows]
+
+
+def book(people, from_time, to_time):
+    doctor_id, patient_id = people
+    return db_queries.add_appointment(doctor_id, patient_id, from_time, to_time, '')
+
+
+def test_trigger_rejects_an_overlapping_insert(people):
+    doctor_id, patient_id = people
+    insert = text("INSERT INTO appointment (doctor_id, patient_id, from_time, to_time) VALUES (:d, :p, :f, :t)")
+    db.session.execute(insert, {'d': doctor_id, 'p': patient_id, 'f': '2030-01-01 09:00:00', 't': '2030-01-01 09:30:00'})
+    with pytest.raises(IntegrityError, match=BOOKING_CONFLICT):
+        db.session.execute(insert, {'d': doctor_id, 'p': patient_id, 'f': '2030-01-01 09:15:00',
+                                    't': '2030-01-01 09:45:00'})
+    db.session.rollback()
+
+
+def test_overlapping_booking_is_reported_by_the_guard(people, race):
+    assert book(people, at(9), at(9, 30))['success']
+    assert book(people, at(9, 15), at(9, 45)) == CONFLICT
+    assert book(people, at(8, 45), at(10)) == CONFLICT
+    assert len(appointments()) == 1
+    # The session is usable after the rejected insert
+    assert book(people, at(10), at(10, 30))['success']
+
+
+def test_back_to_back_slots_are_allowed(people, race):
+    assert book(people, at(9), at(9, 30))['success']
+    assert book(people, at(9, 30), at(10))['success']
+    assert book(people, at(8, 30), at(9))['success']
+    assert len(appointments()) == 3
+
+
+def test_same_slot_of_another_doctor_is_allowed(people, race):
+    _, patient_id = people
+    other_doctor = db.session.execute(text("""
+        INSERT INTO doctor (name, phone, email, category, experience, degree)
+        VALUES ('Other', '0', 'other@example.com', 'Medicine', 1, 'PhD')
+    """)).lastrowid
+    db.session.commit()
+    assert book(people, at(9), at(9, 30))['success']
+    assert db_queries.add_appointment(other_doctor, patient_id, at(9), at(9, 30), '')['success']
+
+
+def test_overlapping_edit_is_reported_by_the_guard(people, race):
+    doctor_id, patient_id = people
+    book(people, at(9), at(9, 30))
+    second = book(people, at(10), at(10, 30))['id']
+    assert db_queries.edit_appointment(second, doctor_id, patient_id, at(9, 15), at(9, 45), 'moved') == CONFLICT
+    assert appointments() == [(doctor_id, '2030-01-01 09:00:00', '2030-01-01 09:30:00'),
+                              (doctor_id, '2030-01-01 10:00:00', '2030-01-01 10:30:00')]
+    # Moving within its own slot and right up to the other one is fine
+    assert db_queries.edit_appointment(second, doctor_id, patient_id, at(9, 30), at(10, 15), 'moved')['success']
+
+
+def test_guard_conflict_inside_a_transaction_keeps_the_rest_of_the_scope(people, race):
+    with db_queries.transaction():
+        db_queries.add_department({'name': 'Cardiology'})
+        first = book(people, at(9), at(9, 30))
+        rejected = book(people, at(9), at(9, 30))
+        last = book(people, at(11), at(11, 30))
+    assert first['success'] and last['success']
+    assert rejected == CONFLICT
+    assert [row[1] for row in appointments()] == ['2030-01-01 09:00:00', '2030-01-01 11:00:00']
+    assert db.session.execute(text("SELECT name FROM department")).scalars().all() == ['Cardiology']
@@ -0,0 +1,58 @@
+import io
+
+import pytest
+from sqlalchemy import text
+
+import app as hospital_app
+import bulk_import
+from models import db
+
+PATIENTS_CSV = b'\xef\xbb\xbfname,dob\r\nAnn,1990-01-01\r\nBob,1991-02-03\r\n'
+
+
+def patient_names():
+    return db.session.execute(text("SELECT name FROM patient ORDER BY id")).scalars().all()
+
+
+def test_import_csv_with_bom(app):
+    report = bulk_import.import_stream('patient', io.BytesIO(PATIENTS_CSV), 'csv')
+    assert (report['rows'], report['imported'], report['rejected']) == (2, 2, 0)
+    assert patient_names() == ['Ann', 'Bob']
+
+
+@pytest.mark.parametrize('format, data', [
+    ('csv', b'name,dob\nAnn,1990-01-01\n\xff\xfe bad,1990-01-01\n'),
+    ('ndjson', b'{"name": "Ann", "dob": "1990-01-01"}\n\n\xff\xfe\n'),
+])
+def test_invalid_utf8_is_reported_with_its_line(app, format, data):
+    with pytest.raises(bulk_import.BulkImportError, match='Line 3 is not valid UTF-8'):
+        bulk_import.import_stream('patient', io.BytesIO(data), format)
+
+
+def test_malformed_csv_is_reported_with_its_line(app):
+    data = b'name,dob\nAnn,1990-01-01\n"' + b'x' * 200000 + b'",1990-01-01\n'
+    with pytest.raises(bulk_import.BulkImportError, match='Malformed CSV on line 3: field larger than field limit'):
+        bulk_import.import_stream('patient', io.BytesIO(data), 'csv')
+
+
+def test_chunks_before_an_unreadable_line_stay_imported(app):
+    data = PATIENTS_CSV + b'\xff\n'
+    with pytest.raises(bulk_import.BulkImportError, match=r'\(2 rows were imported before it\)'):
+        bulk_import.import_stream('patient', io.BytesIO(data), 'csv', chunk_size=1)
+    assert patient_names() == ['Ann', 'Bob']
+
+
+def test_route_answers_400(log_in):
+    response = log_in().post('/import/patient?format=csv', data=b'name,email\n\xff\xfe bad,x@y\n',
+                             content_type='text/csv')
+    assert response.status_code == 400
+    assert response.get_json() == {'success': False,
+                                   'error': 'Line 2 is not valid UTF-8: invalid start byte (0 rows were imported before it)'}
+
+
+def test_cli_prints_the_error(app, tmp_path):
+    path = tmp_path / 'patients.csv'
+    path.write_bytes(b'name,email\n\xff\xfe bad,x@y\n')
+    result = app.test_cli_runner().invoke(hospital_app.import_data_command, ['patient', str(path)])
+    assert result.exit_code == 1
+    assert 'Error: Line 2 is not valid UTF-8' in result.output
@@ -0,0 +1,110 @@
+import pytest
+from sqlalchemy import text
+
+import db_queries
+from models import db
+
+TABLES = ('department', 'doctor', 'nurse', 'patient', 'address', 'appointment', 'prescription', 'diagnostic')
+
+
+# Two departments with a doctor and a nurse each, and two patients. Patient 1 has appointment 1 with
+# doctor 1 and appointment 2 with doctor 2, patient 2 has appointment 3 with doctor 2. Every
+# appointment has a prescription and a diagnostic. Doctors 1 and 2 live at addresses 1 and 2,
+# patient 1 at address 3.
+@pytest.fixture
+def hospital(app):
+    statements = [
+        "INSERT INTO department (id, name) VALUES (1, 'Cardiology'), (2, 'Neurology')",
+        "INSERT INTO address (id, city) VALUES (1, 'A'), (2, 'B'), (3, 'C')",
+        """INSERT INTO doctor (id, name, phone, email, department_id, category, experience, degree, address_id)
+           VALUES (1, 'Doctor 1', '0', 'd1@example.com', 1, 'Medicine', 1, 'PhD', 1),
+                  (2, 'Doctor 2', '0', 'd2@example.com', 2, 'Medicine', 1, 'PhD', 2)""",
+        "INSERT INTO nurse (id, name, email, doctor_id) VALUES (1, 'Nurse 1', 'n1@example.com', 1), "
+        "(2, 'Nurse 2', 'n2@example.com', 2)",
+        "INSERT INTO patient (id, name, email, dob, address_id) VALUES "
+        "(1, 'Patient 1', 'p1@example.com', '1990-01-01 00:00:00', 3), "
+        "(2, 'Patient 2', 'p2@example.com', '1990-01-01 00:00:00', NULL)",
+        "INSERT INTO appointment (id, doctor_id, patient_id, from_time, to_time) VALUES "
+        "(1, 1, 1, '2030-01-01 09:00:00', '2030-01-01 09:30:00'), "
+        "(2, 2, 1, '2030-01-01 10:00:00', '2030-01-01 10:30:00'), "
+        "(3, 2, 2, '2030-01-01 11:00:00', '2030-01-01 11:30:00')",
+        "INSERT INTO prescription (appointment_id, prescription_notes) VALUES (1, 'a'), (2, 'b'), (3, 'c')",
+        "INSERT INTO diagnostic (appointment_id, test_name) VALUES (1, 'ECG'), (2, 'MRI'), (3, 'X-Ray')",
+    ]
+    for statement in statements:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+
+def ids(table, column='id'):
+    return sorted(db.session.execute(text(f"SELECT {column} FROM {table}")).scalars().all())
+
+
+def snapshot():
+    return {table: db.session.execute(text(f"SELECT * FROM {table} ORDER BY id")).all() for table in TABLES}
+
+
+def test_delete_appointment_removes_its_prescription_and_diagnostic(hospital):
+    db_queries.delete_appointment(1)
+    assert ids('appointment') == [2, 3]
+    assert ids('prescription', 'appointment_id') == [2, 3]
+    assert ids('diagnostic', 'appointment_id') == [2, 3]
+
+
+def test_delete_doctor_cascades_and_keeps_nurses(hospital):
+    assert db_queries.delete_doctor(1) == 1
+    assert ids('doctor') == [2]
+    assert ids('address') == [2, 3]
+    assert ids('appointment') == [2, 3]
+    assert ids('prescription', 'appointment_id') == [2, 3]
+    assert ids('diagnostic', 'appointment_id') == [2, 3]
+    # The nurse stays on staff without a designated doctor
+    nurses = db.session.execute(text("SELECT id, doctor_id FROM nurse ORDER BY id")).all()
+    assert [tuple(nurse) for nurse in nurses] == [(1, None), (2, 2)]
+
+
+def test_delete_patient_cascades(hospital):
+    assert db_queries.delete_patient(1) == 2
+    assert ids('patient') == [2]
+    assert ids('address') == [1, 2]
+    assert ids('appointment') == [3]
+    assert ids('prescription', 'appointment_id') == [3]
+    assert ids('diagnostic', 'appointment_id') == [3]
+
+
+def test_delete_department_cascades_to_doctors(hospital):
+    assert db_queries.delete_department(2) == {'doctors': 1, 'appointments': 2}
+    assert ids('department') == [1]
+    assert ids('doctor') == [1]
+    assert ids('address') == [1, 3]
+    assert ids('appointment') == [1]
+    assert ids('prescription', 'appointment_id') == [1]
+    assert ids('diagnostic', 'appointment_id') == [1]
+    assert [tuple(nurse) for nurse in db.session.execute(text("SELECT id, doctor_id FROM nurse ORDER BY id"))] == \
+        [(1, 1), (2, None)]
+
+
+def test_delete_of_missing_row_changes_nothing(hospital):
+    before = snapshot()
+    for delete in (db_queries.delete_appointment, db_queries.delete_doctor, db_queries.delete_patient,
+                   db_queries.delete_department):
+        with pytest.raises(db_queries.DatabaseError, match='No .* found'):
+            delete(99)
+    assert snapshot() == before
+
+
+# The doctor rows are deleted last, after their appointments, prescriptions, diagnostics, addresses
+# and nurses were changed, so failing there has to roll back all of those.
+@pytest.mark.parametrize('delete, id', [(db_queries.delete_doctor, 1), (db_queries.delete_department, 1)])
+def test_failure_midway_rolls_back_every_table(hospital, delete, id):
+    db.session.execute(text("CREATE TRIGGER fail_doctor_delete BEFORE DELETE ON doctor "
+                            "BEGIN SELECT RAISE(ABORT, 'doctor delete failed'); END"))
+    db.session.commit()
+    try:
+        before = snapshot()
+        with pytest.raises(db_queries.DatabaseError, match='doctor delete failed'):
+            delete(id)
+        assert snapshot() == before
+    finally:
+        db.session.execute(text("DROP TRIGGER fail_doctor_delete"))
+        db.session.commit()
@@ -0,0 +1,92 @@
+import math
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import conditional_get
+import db_queries
+from cache import data_versions
+
+
+@pytest.fixture
+def department(app):
+    return db_queries.add_department({'name': 'Cardiology'})
+
+
+def get(client, path, etag=None):
+    return client.get(path, headers={'If-None-Match': etag} if etag else {})
+
+
+def test_repeat_request_is_answered_with_304(department, log_in):
+    client = log_in()
+    first = get(client, f'/get_department/{department}')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert etag.startswith('W/')
+    assert 'private' in first.headers['Cache-Control'] and 'no-cache' in first.headers['Cache-Control']
+
+    repeat = get(client, f'/get_department/{department}', etag)
+    assert repeat.status_code == 304
+    assert repeat.data == b''
+    assert repeat.headers['ETag'] == etag
+
+
+def test_write_to_a_table_read_by_the_view_changes_the_etag(department, log_in):
+    client = log_in()
+    etag = get(client, f'/get_department/{department}').headers['ETag']
+    db_queries.edit_department(department, {'name': 'Neurology'})
+    response = get(client, f'/get_department/{department}', etag)
+    assert response.status_code == 200
+    assert response.get_json()['name'] == 'Neurology'
+    assert response.headers['ETag'] != etag
+
+
+def test_write_to_another_table_keeps_the_etag(department, log_in):
+    client = log_in()
+    etag = get(client, f'/get_department/{department}').headers['ETag']
+    data_versions.bump('patient')
+    assert get(client, f'/get_department/{department}', etag).status_code == 304
+
+
+def test_users_get_different_etags(department, client, log_in):
+    admin_etag = get(log_in(user_id=1, username='admin', is_admin=True), '/departments').headers['ETag']
+    user = log_in(user_id=2, username='user', is_admin=False)
+    response = get(user, '/departments', admin_etag)
+    assert response.status_code == 200
+    assert response.headers['ETag'] != admin_etag
+    assert get(user, '/departments', response.headers['ETag']).status_code == 304
+
+
+# Freezes the clock of the validators `seconds` after the last write to the department table.
+@pytest.fixture
+def clock(monkeypatch):
+    def set_clock(seconds):
+        now = data_versions.last_modified('department') + seconds
+        monkeypatch.setattr(conditional_get, 'time', SimpleNamespace(time=lambda: now))
+
+    return set_clock
+
+
+def test_no_last_modified_within_the_second_of_a_write(department, log_in, clock):
+    # A second write in the same second would carry the same date
+    clock(0)
+    assert 'Last-Modified' not in get(log_in(), f'/get_department/{department}').headers
+
+
+def test_if_modified_since(department, log_in, clock):
+    clock(2)
+    client, path = log_in(), f'/get_department/{department}'
+    response = get(client, path)
+    last_modified = response.headers['Last-Modified']
+    assert response.last_modified.timestamp() == math.floor(data_versions.last_modified('department'))
+    assert client.get(path, headers={'If-Modified-Since': last_modified}).status_code == 304
+    earlier = response.last_modified.timestamp() - 1
+    since = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(earlier))
+    assert client.get(path, headers={'If-Modified-Since': since}).status_code == 200
+
+
+def test_errors_carry_no_validators(app, log_in):
+    response = get(log_in(), '/get_department/999')
+    assert response.status_code == 404
+    assert 'ETag' not in response.headers
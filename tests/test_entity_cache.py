@@ -0,0 +1,52 @@
+import dataclasses
+
+import pytest
+
+import db_queries
+
+
+@pytest.fixture
+def department(app):
+    return db_queries.add_department({'name': 'Cardiology'})
+
+
+def test_cached_rows_cannot_be_modified(people, department):
+    doctor_id, patient_id = people
+    for row in (db_queries.get_doctor(doctor_id), db_queries.get_patient(patient_id),
+                db_queries.get_department(department)):
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            row.name = 'Changed'
+        with pytest.raises(TypeError):
+            row['name'] = 'Changed'
+    assert db_queries.get_doctor(doctor_id)['name'] == 'Doctor'
+    assert db_queries.get_department(department).name == 'Cardiology'
+
+
+def test_cached_lists_cannot_be_modified(people, department):
+    for rows in (db_queries.get_all_departments(), db_queries.get_doctor_options()):
+        assert isinstance(rows, tuple)
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            rows[0].name = 'Changed'
+    assert [row.name for row in db_queries.get_doctor_options()] == ['Doctor']
+
+
+def test_cache_hits_return_the_same_values(people):
+    doctor_id, _ = people
+    first = db_queries.get_doctor(doctor_id)
+    hits = db_queries.entity_cache.hits
+    assert db_queries.get_doctor(doctor_id) is first
+    assert db_queries.entity_cache.hits == hits + 1
+
+
+def test_writes_invalidate_cached_rows(department):
+    assert db_queries.get_department(department).name == 'Cardiology'
+    db_queries.edit_department(department, {'name': 'Neurology'})
+    assert db_queries.get_department(department).name == 'Neurology'
+    assert [row.name for row in db_queries.get_all_departments()] == ['Neurology']
+
+
+def test_cached_rows_are_written_as_json(client, people, log_in):
+    doctor_id, _ = people
+    response = log_in().get(f'/get_doctor/{doctor_id}')
+    assert response.status_code == 200
+    assert response.get_json()['name'] == 'Doctor'
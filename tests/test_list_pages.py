@@ -0,0 +1,60 @@
+import pytest
+from sqlalchemy import text
+
+import db_queries
+from models import db
+
+
+def add_patients(names):
+    for i, name in enumerate(names):
+        db.session.execute(text("""
+            INSERT INTO patient (name, email, dob) VALUES (:name, :email, '1990-01-01 00:00:00')
+        """), {'name': name, 'email': f'patient{i}@example.com'})
+    db.session.commit()
+
+
+def add_nurses(emails):
+    for i, email in enumerate(emails):
+        db.session.execute(text("INSERT INTO nurse (name, email) VALUES (:name, :email)"),
+                           {'name': f'Nurse {i}', 'email': email})
+    db.session.commit()
+
+
+def all_pages(list_function, **kwargs):
+    pages, cursor = [], None
+    while True:
+        page = list_function(cursor=cursor, **kwargs)
+        pages.append([item['id'] for item in page['items']])
+        cursor = page['next_cursor']
+        if cursor is None:
+            return pages
+
+
+def test_pages_cover_every_row_once(app):
+    add_patients([f'Patient {i:02}' for i in range(7)])
+    pages = all_pages(db_queries.list_patients, limit=3)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert sum(pages, []) == sorted(sum(pages, []))
+
+
+def test_page_ending_on_null_name_continues(app):
+    add_patients([None, None, 'Alice', 'Bob'])
+    for descending in (False, True):
+        pages = all_pages(db_queries.list_patients, sort='name', descending=descending, limit=2)
+        ids = sum(pages, [])
+        assert len(pages) == 2
+        assert sorted(ids) == [1, 2, 3, 4]
+        # NULL names sort as empty strings, before every name
+        assert ids[:2] == ([1, 2] if not descending else [4, 3])
+
+
+def test_page_ending_on_null_email_continues(app):
+    add_nurses([None, 'a@example.com', None, 'b@example.com'])
+    ids = sum(all_pages(db_queries.list_nurses, sort='email', limit=1), [])
+    assert ids == [1, 3, 2, 4]
+
+
+def test_invalid_cursor_is_rejected(app):
+    add_patients(['Alice'])
+    with pytest.raises(db_queries.DatabaseError, match='^Invalid cursor$'):
+        db_queries.list_patients(cursor='not a cursor')
@@ -0,0 +1,26 @@
+def test_summary_requires_login(client):
+    response = client.get('/metrics/summary')
+    assert response.status_code == 302
+    assert '/login' in response.headers['Location']
+
+
+def test_summary_is_admin_only(log_in):
+    assert log_in(is_admin=False).get('/metrics/summary').status_code == 403
+
+
+def test_summary_for_admins(log_in):
+    response = log_in().get('/metrics/summary')
+    assert response.status_code == 200
+    assert 'caches' in response.get_json()
+
+
+def test_scrape_from_local_host(client):
+    response = client.get('/metrics', environ_base={'REMOTE_ADDR': '127.0.0.1'})
+    assert response.status_code == 200
+    assert 'cache_hits_total' in response.get_data(as_text=True)
+
+
+def test_scrape_from_other_networks_is_refused(client, log_in):
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '10.1.2.3'}).status_code == 403
+    # A session does not open the scrape endpoint
+    assert log_in().get('/metrics', environ_base={'REMOTE_ADDR': '10.1.2.3'}).status_code == 403
@@ -0,0 +1,93 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import db_queries
+from models import db
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setitem(db_queries.write_retry, 'backoff_ms', 1)
+
+
+# What a write function raises when SQLite refuses it the write lock: its own rollback, then
+# a DatabaseError caused by the OperationalError.
+def fail_busy(statement):
+    try:
+        raise OperationalError(statement, {}, sqlite3.OperationalError('database is locked'))
+    except OperationalError as e:
+        db_queries._rollback()
+        raise db_queries.DatabaseError(f"Error: {e}")
+
+
+def department_names():
+    return db.session.execute(text("SELECT name FROM department ORDER BY name")).scalars().all()
+
+
+def test_run_in_transaction_reruns_the_whole_block_on_busy_errors(app):
+    attempts = []
+
+    def work():
+        attempts.append(1)
+        db_queries.add_department({'name': 'Cardiology'})
+        if len(attempts) == 1:
+            fail_busy('INSERT INTO department')
+        return db_queries.add_department({'name': 'Neurology'})
+
+    assert db_queries.run_in_transaction(work) is not None
+    assert len(attempts) == 2
+    # The first attempt's insert was rolled back with it
+    assert department_names() == ['Cardiology', 'Neurology']
+
+
+def test_run_in_transaction_gives_up_after_the_configured_attempts(app, monkeypatch):
+    monkeypatch.setitem(db_queries.write_retry, 'attempts', 2)
+    attempts = []
+
+    def work():
+        attempts.append(1)
+        db_queries.add_department({'name': 'Cardiology'})
+        fail_busy('INSERT INTO department')
+
+    with pytest.raises(db_queries.DatabaseError):
+        db_queries.run_in_transaction(work)
+    assert len(attempts) == 3
+    assert department_names() == []
+
+
+def test_other_errors_are_not_retried(app):
+    attempts = []
+
+    def work():
+        attempts.append(1)
+        db_queries.add_department({'name': 'Cardiology'})
+        db_queries.add_department({'name': 'Cardiology'})
+
+    with pytest.raises(db_queries.DatabaseError, match='already exists'):
+        db_queries.run_in_transaction(work)
+    assert len(attempts) == 1
+    assert department_names() == []
+
+
+def test_add_appointment_route_retries_a_busy_prescription_insert(people, log_in, monkeypatch):
+    doctor_id, patient_id = people
+    add_prescription, calls = db_queries.add_prescription, []
+
+    def flaky_add_prescription(id):
+        calls.append(id)
+        if len(calls) == 1:
+            fail_busy('INSERT INTO prescription')
+        return add_prescription(id)
+
+    monkeypatch.setattr(db_queries, 'add_prescription', flaky_add_prescription)
+    response = log_in().post('/add_appointment', json={
+        'doctor_id': doctor_id, 'patient_id': patient_id, 'from_time': '2030-01-01T09:00:00',
+        'to_time': '2030-01-01T09:30:00', 'notes': ''})
+    assert response.status_code == 200
+    assert response.get_json()['success']
+    assert len(calls) == 2
+    assert db.session.execute(text("SELECT COUNT(*) FROM appointment")).scalar() == 1
+    assert db.session.execute(text("SELECT COUNT(*) FROM prescription")).scalar() == 1
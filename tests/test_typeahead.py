@@ -0,0 +1,57 @@
+import pytest
+from sqlalchemy import text
+
+import db_queries
+from models import db
+
+
+@pytest.fixture
+def patients(app):
+    rows = [('Anna Smith', 'anna@example.com', '555-0100'), ('annabel Jones', 'bel@example.com', '555-0101'),
+            ('Bob Anders', 'ann.b@example.com', '555-0102'), ('100% Real', 'real@example.com', '0100')]
+    for name, email, phone in rows:
+        db.session.execute(text("""
+            INSERT INTO patient (name, email, phone, dob) VALUES (:name, :email, :phone, '1990-01-01 00:00:00')
+        """), {'name': name, 'email': email, 'phone': phone})
+    db.session.commit()
+
+
+def names(results):
+    return [result['name'] for result in results]
+
+
+def test_prefix_of_name_email_or_phone_ignoring_case(patients):
+    # Name matches first, then email matches
+    assert names(db_queries.typeahead_patients('ANN')) == ['Anna Smith', 'annabel Jones', 'Bob Anders']
+    assert names(db_queries.typeahead_patients('555-0102')) == ['Bob Anders']
+    # Not a substring search
+    assert db_queries.typeahead_patients('Smith') == []
+
+
+def test_like_wildcards_are_matched_literally(patients):
+    assert names(db_queries.typeahead_patients('100%')) == ['100% Real']
+    assert db_queries.typeahead_patients('_nna') == []
+
+
+def test_limit(patients):
+    assert len(db_queries.typeahead_patients('', limit=2)) == 2
+    assert len(db_queries.typeahead_patients('a', limit=1000)) <= db_queries.MAX_TYPEAHEAD_LIMIT
+
+
+def test_typeahead_route(patients, client, log_in):
+    assert client.get('/typeahead/patients?q=bob').status_code == 302
+    response = log_in().get('/typeahead/patients?q=bob')
+    assert response.status_code == 200
+    assert names(response.get_json()['results']) == ['Bob Anders']
+
+
+def test_full_patient_list_endpoint_is_gone(patients, log_in):
+    assert log_in().get('/get_patients').status_code == 404
+
+
+def test_appointments_page_does_not_list_patients(patients, log_in):
+    response = log_in().get('/appointments')
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    assert 'id="patientSearch"' in page
+    assert 'Anna Smith' not in page